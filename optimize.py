@@ -1,6 +1,7 @@
 import sys, re, os, datetime, logging, traceback, json
 
 from src.commons.system_util import SystemUtilities, S3Manager, get_athenas_error
+from src.commons.s3_transfer import S3Transfer
 from src.optimization.run_optimization import run_optimization
 
 logging.getLogger('pyomo.core').setLevel(logging.ERROR)
@@ -27,15 +28,10 @@ if __name__=='__main__':
             with open(system_utilities.parameters["output_json_dir"], 'w') as f:
                 json.dump(system_utilities.parameters['json_file'], f)
             error.to_csv(output_path, index=0)
-            s3.client.upload_file(
-                os.path.join(os.path.dirname(system_utilities.parameters["output_model_dir"]), f'{system_utilities.v_data}.csv'),
-                s3.bucket,
-                system_utilities.parameters['s3_output_appsync']
-            )
-            s3.save_s3results(
-                os.path.dirname(system_utilities.parameters["output_model_dir"]),
-                system_utilities.parameters['s3_output_model']
-                )
+            output_dir = os.path.dirname(system_utilities.parameters["output_model_dir"])
+            transfer = S3Transfer(s3.bucket, s3.client)
+            transfer.upload_files(S3Transfer.folder_files(output_dir, system_utilities.parameters['s3_output_model']))
+            transfer.upload_file(os.path.join(output_dir, f'{system_utilities.v_data}.csv'), system_utilities.parameters['s3_output_appsync'])
     else:
         try:
             date = None if re.match('linux.*', sys.platform) else datetime.datetime.now()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+s3_transfer.py
+====================================
+Concurrent transfers with the s3 bucket. The objects are downloaded and uploaded by a pool of threads that share
+the connection pool of one client; the large files (e.g. the athenas csv) are uploaded in parts and every
+transfer is retried on connection errors.
+
+The endpoint can be changed with the S3_ENDPOINT_URL environment variable, e.g. to run against a local moto server
+or MinIO container.
+
+@author:
+     - g.munera.gonzalez
+     - yeison.diaz
+"""
+
+import os, time
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+MB = 1024 * 1024
+DEFAULT_WORKERS = 8
+DEFAULT_ATTEMPTS = 5
+
+
+def create_client(workers=DEFAULT_WORKERS, attempts=DEFAULT_ATTEMPTS):
+    """Returns a s3 client with a connection pool for the workers and the standard retry mode. Every one of the
+    concurrent uploads sends up to workers parts at the same time, so the pool has a connection for each of them.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of concurrent transfers.
+    attempts : int, optional
+        Maximum attempts of every request.
+
+    Returns
+    -------
+    botocore.client.S3
+        The s3 client.
+    """
+    config = Config(max_pool_connections=max(workers * workers, 10), retries={'max_attempts': attempts, 'mode': 'standard'})
+    return boto3.client('s3', config=config, endpoint_url=os.environ.get('S3_ENDPOINT_URL'))
+
+def is_retryable(error):
+    #boto3 raises the client errors of the uploads as S3UploadFailedError, the wrapped error decides
+    if isinstance(error, S3UploadFailedError) and (error.__cause__ or error.__context__) is not None:
+        return is_retryable(error.__cause__ or error.__context__)
+    if isinstance(error, ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return status >= 500 or error.response.get('Error', {}).get('Code') in ('RequestTimeout', 'SlowDown', 'Throttling')
+    return isinstance(error, (BotoCoreError, ConnectionError))
+
+def retry(function, *args, attempts=DEFAULT_ATTEMPTS, **kwargs):
+    """Calls the function again (with exponential backoff) while it fails with a retryable error. The client
+    retries the requests by itself, this also covers the errors while reading a response body.
+    """
+    for attempt in range(attempts):
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            if attempt == attempts - 1 or not is_retryable(e):
+                raise
+            time.sleep(min(2 ** attempt * 0.5, 10))
+
+
+class S3Transfer:
+    """Downloads and uploads several objects of a bucket at the same time.
+    """
+    def __init__(self, bucket, client=None, workers=DEFAULT_WORKERS, multipart_threshold=8 * MB) -> None:
+        """S3Transfer Initializer
+
+        Parameters
+        ----------
+        bucket : str
+            Name of the bucket.
+        client : botocore.client.S3, optional
+            The s3 client. By default, a new one with a connection pool for the workers.
+        workers : int, optional
+            Number of concurrent transfers.
+        multipart_threshold : int, optional
+            Size (in bytes) from which the files are uploaded in parts.
+        """
+        self.bucket, self.workers = bucket, workers
+        self.client = client or create_client(workers)
+        self.config = TransferConfig(multipart_threshold=multipart_threshold, multipart_chunksize=multipart_threshold,
+                                     max_concurrency=workers, use_threads=True)
+
+    def get_object(self, key):
+        """Returns the content of an object."""
+        return retry(lambda: self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read())
+
+    def get_objects(self, keys):
+        """Downloads the objects concurrently.
+
+        Parameters
+        ----------
+        keys : list(str)
+            Keys of the objects.
+
+        Returns
+        -------
+        dict(str, bytes)
+            The content of every object, in the order of the keys.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            contents = list(executor.map(self.get_object, keys))
+        return dict(zip(keys, contents))
+
+    def upload_file(self, path, key):
+        """Uploads a file (in parts if it is larger than the multipart threshold)."""
+        retry(self.client.upload_file, path, self.bucket, key, Config=self.config)
+        return key
+
+    def upload_files(self, files):
+        """Uploads the files concurrently.
+
+        Parameters
+        ----------
+        files : list(tuple(str, str))
+            Local path and key of the object of every file (a file can be uploaded to several keys).
+
+        Returns
+        -------
+        list(str)
+            Keys of the uploaded objects.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(lambda file: self.upload_file(*file), files))
+
+    @staticmethod
+    def folder_files(folder, prefix):
+        """Returns the (path, key) pairs of the files of a folder (not its subfolders) under a prefix of the bucket.
+        The keys are '<prefix>/<file name>', the layout of S3Manager.save_s3results that the consumers of the
+        output folders read.
+
+        Parameters
+        ----------
+        folder : str
+            Local folder.
+        prefix : str
+            Prefix of the keys.
+
+        Returns
+        -------
+        list(tuple(str, str))
+            Local path and key of every file.
+        """
+        return [(os.path.join(folder, name), f"{prefix.rstrip('/')}/{name}") for name in sorted(os.listdir(folder))
+                if os.path.isfile(os.path.join(folder, name))]
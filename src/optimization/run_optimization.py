@@ -11,12 +11,14 @@ Script to concatenate the model runing. It reads parameters.json and use its inf
 """
 
 import sys, os, re, json
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 import numpy as np
 import json
 from src.commons.s3_manager import S3Manager
-from src.optimization.treatment.treatment import process_treatment_results, treatment_model
+from src.commons.s3_transfer import S3Transfer, DEFAULT_WORKERS
+from src.optimization.treatment.treatment import process_treatment_results, treatment_model, resolve_treatment_model
 from src.commons.system_util import get_athenas_error
 from src.optimization.injection.injection import injection_model, process_injection_results
 from src.recommendations.injection_recommendations import get_action_arc_use, get_action_operational_pump
@@ -68,7 +70,7 @@ def run_optimization(system_utilities, s3_data, param_file, date):
                                                      athena, times, delta, iterations, parameters['json_file']['time_periods'])
     
     elif parameters['water'] == True:
-        model, result, runtime = treatment_model('water', s3_data, param_file, date, None)
+        model, result, runtime = treatment_model('water', s3_data, param_file, date, None, rolling_horizon=True)
         model_athena = process_treatment_results('water', s3_data, param_file, date, None, model, result)
         athena, times = save_optimization_results(system_utilities, athena, times, 'water', model, model_athena, runtime)
 
@@ -94,11 +96,13 @@ def blender_descomposition(system_utilities, s3_data, param_file, date, athena,
                                     'OtherCosts' : np.full(time_periods, 0),
                                     'time' : np.arange(1, time_periods + 1),
                                     'old_cost' : np.full(time_periods, 0)})
+    workers = system_utilities.parameters['json_file'].get('injection_workers', 1)
     is_equal=False
+    model_treatment = None
     while iterations > 0 :
         model_treatment, result_treatment, runtime_treatment,\
         models_injection, runtime_injection,\
-        costs_per_liter_new = run_treatment_and_injection(s3_data, param_file, date, cost_per_liter_df, time_periods)
+        costs_per_liter_new = run_treatment_and_injection(s3_data, param_file, date, cost_per_liter_df, time_periods, workers, model_treatment)
         cost_per_liter_df['mean'] = cost_per_liter_df[['OtherCosts', 'old_cost']].mean(axis=1)
         mean2_old=cost_per_liter_df[["time", "mean"]].set_index("time")["mean"].to_dict() 
                
@@ -120,6 +124,7 @@ def blender_descomposition(system_utilities, s3_data, param_file, date, athena,
     athena_injection = pd.concat(injection_results[0], ignore_index = True)
     names_df = ['nodes', 'edges', 'summary']
     pandas_dataframes = {name:pd.concat(list(map(lambda dict: dict[name], injection_results[1])), ignore_index = True) for name in names_df}
+    model_treatment.arc_other_cost[:,'TO_INJECT_TANK_MIX']=0
     model_treatment.other_cost[:,'TO_INJECT_TANK_MIX',:]=0
     athena_treatment = process_treatment_results('water', s3_data, param_file, date, cost_per_liter_df, model_treatment, result_treatment)
     athena, times = save_optimization_results(system_utilities, athena, times,\
@@ -128,14 +133,16 @@ def blender_descomposition(system_utilities, s3_data, param_file, date, athena,
                                                          'injection', model_injection, athena_injection, runtime_injection)                      
     return athena, times, pandas_dataframes 
 
-def run_treatment_and_injection(s3_data, param_file, date, cost_per_liter_df, time_periods):
+def run_treatment_and_injection(s3_data, param_file, date, cost_per_liter_df, time_periods, workers=1, model_treatment=None):
     
-    model_treatment, result_treatment , runtime_treatment  = treatment_model('water', s3_data, param_file, date, cost_per_liter_df)
+    if model_treatment is None:
+        model_treatment, result_treatment , runtime_treatment  = treatment_model('water', s3_data, param_file, date, cost_per_liter_df)
+    else: #only the injection costs changed since the last iteration
+        model_treatment, result_treatment , runtime_treatment  = resolve_treatment_model(model_treatment, cost_per_liter_df)
     qwats = calculate_water_to_inject(model_treatment, time_periods)
     costs_per_liter = np.array([])
     models_injection = np.array([])
-    for t, qwat in enumerate(qwats):
-        model_injection, runtime_injection , cost_per_liter = injection_model(qwat, s3_data, param_file, date, t+1)
+    for model_injection, runtime_injection, cost_per_liter in solve_injection_models(qwats, s3_data, param_file, date, workers):
         if cost_per_liter is None:
             break
         models_injection = np.append(models_injection, model_injection)
@@ -144,6 +151,50 @@ def run_treatment_and_injection(s3_data, param_file, date, cost_per_liter_df, ti
             models_injection, runtime_injection,\
             costs_per_liter
 
+def solve_injection_models(qwats, s3_data, param_file, date, workers=1):
+    '''Generator of the injection models of every period, in period order. The periods are independent once the
+    treatment model fixed the water to inject, so with more than one worker they are solved in a process pool.
+    The generator stops after the first period without cost per liter, like the serial loop, and the pending
+    periods are cancelled.
+
+    Parameters
+    ----------
+    qwats : np.array
+        Water to inject per period
+    s3_data : bool
+        Tell the model if run from s3 or not
+    param_file : str
+        Parameters file name
+    date : datetime.datetime
+        Running time
+    workers : int, optional, default 1
+        Number of processes ('injection_workers' key of the parameters json file)
+
+    Yields
+    ------
+    tuple
+        The injection model, its running time and its cost per liter
+    '''
+    if workers is None or workers <= 1:
+        for t, qwat in enumerate(qwats):
+            result = injection_model(qwat, s3_data, param_file, date, t+1)
+            yield result
+            if result[2] is None:
+                return
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(injection_model, qwat, s3_data, param_file, date, t+1) for t, qwat in enumerate(qwats)]
+        try:
+            for future in futures:
+                result = future.result()
+                yield result
+                if result[2] is None:
+                    return
+        finally:
+            for future in futures:
+                future.cancel()
+
 def save_optimization_results(system_utilities, athena, times, model_name, model, model_athena, runtime):
     times[model_name] = runtime
     if model!=None:
@@ -203,13 +254,12 @@ def save_recommendations(system_utilities, athena):
 def save_results_in_s3_bucket(system_utilities, s3_data, parameters):
     if re.match('linux.*', sys.platform) or s3_data:
         print('saving results in s3 bucket...')
-        test_ = S3Manager()
-        test_.save_s3results(os.path.dirname(parameters["output_model_dir"]), parameters['s3_output_model'])
-        test_.client.upload_file(
-            os.path.join(os.path.dirname(parameters["output_model_dir"]), f'{system_utilities.v_data}.csv'),
-            test_.bucket,
-            parameters['s3_output_appsync']
-        )
+        output_dir = os.path.dirname(parameters["output_model_dir"])
+        s3 = S3Manager()
+        transfer = S3Transfer(s3.bucket, s3.client, workers=parameters['json_file'].get('s3_workers', DEFAULT_WORKERS))
+        transfer.upload_files(S3Transfer.folder_files(output_dir, parameters['s3_output_model']))
+        #the appsync object goes last: its consumers read the output folder
+        transfer.upload_file(os.path.join(output_dir, f'{system_utilities.v_data}.csv'), parameters['s3_output_appsync'])
 
 def export_time_report(times):
     print('\n'+'*'*50)
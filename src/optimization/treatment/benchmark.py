@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark.py
+====================================
+This script runs the same treatment instance with every available solver backend (and, optionally, every big-M
+method) and reports, for every run, the build time and the solve time, status, objective value, gap and branch
+and bound nodes of every hierarchical stage. The backends with a persistent interface (gurobi, highs) are solved
+through it, so their node count is reported.
+
+Usage:
+    python -m src.optimization.treatment.benchmark --param_file parameters.json --solvers highs gurobi --big_m tight global
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import argparse, os, time
+import pandas as pd
+import src.optimization.treatment.solvers as solvers
+from src.optimization.treatment.make_model import build_model, set_objective_function, optimize, get_contaminant_formulation, get_big_m
+
+
+def benchmark_solvers(processed_data, useful_sets, parameters, attributes_with_time, backends=None, big_m_methods=None):
+    """Builds and solves the treatment model once per backend and big-M method.
+
+    Parameters
+    ----------
+    processed_data : ProcessedData
+        It has all the model's processed data.
+    useful_sets : UsefulSets
+        It has all the model's sets.
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
+    attributes_with_time: Dictionary(string, pd.Dataframe)
+        Time dependent attributes of nodes and arcs.
+    backends : list(string), optional
+        Backends to compare. By default, all the available ones.
+    big_m_methods : list(string), optional
+        Big-M methods to compare ('tight', 'global'). By default, the one of the parameters json file.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per backend, big-M method and hierarchical stage.
+    """
+    backends = backends or solvers.available_backends()
+    big_m_methods = big_m_methods or [get_big_m(parameters)]
+    report = []
+    for backend in backends:
+        for big_m in big_m_methods:
+            print(f"    benchmarking {backend} ({big_m} big-M)...")
+            #the persistent interfaces keep the solver model, where the node count of gurobi is read
+            json_file = dict(parameters["json_file"], solver=backend, persistent_solver=solvers.BACKENDS[backend][1])
+            backend_parameters = dict(parameters, json_file=json_file)
+
+            tik = time.time()
+            model = build_model(processed_data, useful_sets, attributes_with_time, get_contaminant_formulation(parameters), big_m)
+            build_time = time.time() - tik
+            try:
+                model = set_objective_function(model, backend_parameters)
+                optimize(model, backend_parameters)
+            except Exception as e: #e.g. a non convex model in a linear solver
+                print(f"    {backend} failed: {e}")
+                report.append({'backend': backend, 'big_m': big_m, 'build_time': build_time, 'error': str(e)})
+                continue
+
+            for stage in model.stages:
+                report.append(dict(stage, backend=backend, big_m=big_m, build_time=build_time))
+
+    report = pd.DataFrame(report)
+    columns = ['backend', 'big_m', 'build_time', 'stage', 'objective', 'solve_time', 'status', 'termination_condition', 'objective_value', 'gap', 'nodes', 'error']
+    return report.reindex(columns=[c for c in columns if c in report.columns])
+
+
+if __name__=='__main__':
+    from src.optimization.treatment.treatment import read_parameters
+    from src.optimization.treatment.preprocess_data import preprocess_data
+
+    parser = argparse.ArgumentParser(description="Compares the solver backends on the same treatment instance")
+    parser.add_argument('--param_file', default=None, help="parameters json file")
+    parser.add_argument('--model_name', default='water')
+    parser.add_argument('--s3_data', action='store_true', help="read the input data from the s3 bucket")
+    parser.add_argument('--solvers', nargs='*', default=None, help=f"backends to compare ({', '.join(solvers.BACKENDS)}). By default, all the available ones")
+    parser.add_argument('--big_m', nargs='*', default=None, choices=['tight', 'global'], help="big-M methods to compare. By default, the one of the parameters json file")
+    args = parser.parse_args()
+
+    _, parameters, simulated_period = read_parameters(args.model_name, args.s3_data, args.param_file, None)
+    data, useful_sets, attributes_with_time = preprocess_data(parameters, simulated_period, s3_data=args.s3_data)
+    report = benchmark_solvers(data, useful_sets, parameters, attributes_with_time, args.solvers, args.big_m)
+
+    output_path = os.path.join(os.path.dirname(parameters["output_model_dir"]), 'solver_benchmark.csv')
+    report.to_csv(output_path, index=False)
+    print(report.to_string(index=False))
+    print(f"    benchmark saved in {output_path}")
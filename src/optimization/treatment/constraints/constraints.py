@@ -14,8 +14,174 @@ This script collects all treatment model constraints
 
 import pyomo.environ as pe
 import itertools
+import src.optimization.treatment.preprocess_classes.node_roles as roles
+
+#Constants shared with the matrix compiler (matrix_model.py)
+BPD_PSI_TO_KWH = 0.00022837058567207023
+EVAPORATION_TO_BARRELS = 6.28981077
+ARCS_EPSILON = 1e-30
+PUMPS_EPSILON = 1e-30
+PONDS_EPSILON = 1e-6
+MIN_PUMP_ENERGY = 400
+
+#region flow expressions
+def e_water_inflow(model, i, t):
+    """Generates the total water inflow expression of the node i in time t.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    i : string
+        The node.
+    t: int
+        Time dimension
+
+    Returns
+    -------
+    Expression
+        Sum of the water flowing through every arc that ends in the node.
+    """
+    return sum(model.x_water[j, i, t] for j in model.entry[i])
+
+
+def e_water_outflow(model, i, t):
+    """Generates the total water outflow expression of the node i in time t.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    i : string
+        The node.
+    t: int
+        Time dimension
+
+    Returns
+    -------
+    Expression
+        Sum of the water flowing through every arc that starts in the node.
+    """
+    return sum(model.x_water[i, j, t] for j in model.exit[i])
+
+
+def e_oil_inflow(model, i, t):
+    """Generates the total oil inflow expression of the node i in time t.
+    Only the arcs that can carry oil are considered.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    i : string
+        The node.
+    t: int
+        Time dimension
+
+    Returns
+    -------
+    Expression
+        Sum of the oil flowing through every oil arc that ends in the node.
+    """
+    return sum(model.x_oil[j, i, t] for j in model.entry[i] if (j, i) in model.oil_arcs)
+
+
+def e_oil_outflow(model, i, t):
+    """Generates the total oil outflow expression of the node i in time t.
+    Only the arcs that can carry oil are considered.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    i : string
+        The node.
+    t: int
+        Time dimension
+
+    Returns
+    -------
+    Expression
+        Sum of the oil flowing through every oil arc that starts in the node.
+    """
+    return sum(model.x_oil[i, j, t] for j in model.exit[i] if (i, j) in model.oil_arcs)
+
+
+def add_flow_expressions(model):
+    """Sets the inflow and outflow expressions of every node in the model for time t.
+    They are built once and shared by all the constraint families that need them.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    model.water_inflow = pe.Expression(model.nodes, model.time_dim, rule = e_water_inflow)
+    model.water_outflow = pe.Expression(model.nodes, model.time_dim, rule = e_water_outflow)
+    model.oil_inflow = pe.Expression(model.nodes, model.time_dim, rule = e_oil_inflow)
+    model.oil_outflow = pe.Expression(model.nodes, model.time_dim, rule = e_oil_outflow)
+
+    return model
+
+
+def add_balance_totals(model):
+    """Sets the model-wide totals used by the global (across time) balance of the initial nodes:
+    - Water/oil leaving the initial nodes in every period
+    - Water/oil reaching the ending nodes in every period
+    - Water/oil stored in the last period outside the initial and ending nodes
+    - Initial content of the tanks and ponds
+
+    They are built once as named expressions so the balance constraints do not rebuild them
+    for every node and period.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    last_time = model.time_dim.last()
+    inner_nodes = [i for i in model.nodes if i not in model.ending and i not in model.initial]
+
+    model.total_water_in = pe.Expression(expr = sum(model.water_outflow[i,t] for i in model.initial for t in model.time_dim))
+    model.total_water_out = pe.Expression(expr = sum(model.water_inflow[j,t] for j in model.ending for t in model.time_dim))
+    model.total_water_stored_last_time = pe.Expression(expr = sum(model.y_water[i,last_time] for i in inner_nodes))
+    model.total_initial_content = pe.Expression(expr = sum(model.initial_content[i] for i in model.tanks.union(model.ponds)))
+
+    model.total_oil_in = pe.Expression(expr = sum(model.oil_outflow[i,t] for i in model.initial for t in model.time_dim))
+    model.total_oil_out = pe.Expression(expr = sum(model.oil_inflow[j,t] for j in model.ending for t in model.time_dim))
+    model.total_oil_stored_last_time = pe.Expression(expr = sum(model.y_oil[i,last_time] for i in inner_nodes if i in model.oil_nodes))
+    model.total_initial_oil_content = pe.Expression(expr = sum(model.initial_oil_content[i] for i in model.tanks.union(model.ponds) if i in model.oil_nodes))
+
+    return model
+#endregion
 
 #region arcs capacity
+def get_usable_percentage(model, i, j, t):
+    """Returns the usable percentage of the arc (i,j) in time t: the parameter of the period if it changes
+    in it, or the static one of the arc.
+    """
+    if (i, j, t) in model.usable_percentage_periods:
+        return model.usable_percentage[i, j, t]
+    return model.arc_usable_percentage[i, j]
+
+def get_other_cost(model, i, j, t):
+    """Returns the other cost of the arc (i,j) in time t: the parameter of the period if it changes
+    in it, or the static one of the arc.
+    """
+    if (i, j, t) in model.other_cost_periods:
+        return model.other_cost[i, j, t]
+    return model.arc_other_cost[i, j]
+
 def c_2_arcs_capacity(model,t,i, j):
     """Generates the capacity constraint expression for the arc (i,j) in time t.
 
@@ -36,7 +202,7 @@ def c_2_arcs_capacity(model,t,i, j):
         Relational expression for the constraint.
     """
     ########### c_2_Capacity ############
-    usable_percentage = model.usable_percentage[i, j, t]
+    usable_percentage = get_usable_percentage(model, i, j, t)
 
     max_flow = model.max_flow[i, j] * usable_percentage
     min_flow = model.min_flow[i, j] * usable_percentage
@@ -52,7 +218,8 @@ def c_2_arcs_capacity(model,t,i, j):
 
 
 def add_arcs_capacity(model):
-    """Sets the capacity constraint for every arc in the model in time t.
+    """Sets the capacity of every arc in the model in time t. The flow of the arcs without oil is only
+    x_water, so their capacity is set as the bounds of the variable; the oil arcs keep the constraint.
 
     Parameters
     ----------
@@ -64,8 +231,43 @@ def add_arcs_capacity(model):
     Pyomo ConcreteModel
         The optimization model.
     """
-    model.c_2_capacity_arc = pe.Constraint(model.time_dim, model.arcs, rule = c_2_arcs_capacity)
+    for (i, j) in model.arcs:
+        if (i, j) in model.oil_arcs:
+            continue
+        for t in model.time_dim:
+            set_arc_capacity_bounds(model, i, j, t)
+    model.c_2_capacity_arc = pe.Constraint(model.time_dim, model.oil_arcs, rule = c_2_arcs_capacity)
+    model.closed_arcs = pe.Set(dimen=3) #(i, j, t) of the water variables fixed by update_closed_arcs
+
+    return update_closed_arcs(model)
 
+def set_arc_capacity_bounds(model, i, j, t):
+    #the bounds depend on the mutable usable percentage, so they follow its updates
+    usable_percentage = get_usable_percentage(model, i, j, t)
+    model.x_water[i,j,t].setlb(model.min_flow[i, j] * usable_percentage)
+    model.x_water[i,j,t].setub(model.max_flow[i, j] * usable_percentage)
+
+def update_arcs_capacity(model, periods):
+    """Sets again the capacity of the arcs in the periods where the usable percentage starts to change
+    (they took the static usable percentage of the arc).
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    periods : list(tuple(string, string, int))
+        The arcs and periods (i, j, t).
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    for (i, j, t) in periods:
+        if (i, j) in model.oil_arcs:
+            model.c_2_capacity_arc[t,i,j].set_value(c_2_arcs_capacity(model, t, i, j))
+        else:
+            set_arc_capacity_bounds(model, i, j, t)
     return model
 #endregion
 
@@ -91,7 +293,7 @@ def c_2_2_node_capacity(model,t,i):
     ########### c_2_2_Capacity ############
     ########### c_2_4_Capacity ############
 
-    if i in model.oil_nodes:
+    if model.node_roles.has(i, roles.OIL):
         content =(model.y_water[i,t] + model.y_oil[i,t])
     else:
         content = model.y_water[i,t]
@@ -99,7 +301,8 @@ def c_2_2_node_capacity(model,t,i):
 
 
 def add_nodes_capacity(model):
-    """Sets the capacity constraint for every node in the model for time t.
+    """Sets the capacity of every node in the model for time t. The content of the nodes without oil is only
+    y_water, so their capacity is set as the bounds of the variable; the oil nodes keep the constraint.
 
     Parameters
     ----------
@@ -111,9 +314,46 @@ def add_nodes_capacity(model):
     Pyomo ConcreteModel
         The optimization model.
     """
-    model.c_2_2_capacity_node = pe.Constraint(model.time_dim,model.nodes, rule = c_2_2_node_capacity)
+    for i in model.nodes:
+        if model.node_roles.has(i, roles.OIL):
+            continue
+        for t in model.time_dim:
+            model.y_water[i,t].setlb(model.min_capacity[i])
+            model.y_water[i,t].setub(model.max_capacity[i])
+    model.closed_nodes = pe.Set(dimen=2) #(i, t) of the water variables fixed because the node is closed
+    fix_closed_variables(model.y_water, [(i,t) for i in model.nodes if not model.node_roles.has(i, roles.OIL) for t in model.time_dim], model.closed_nodes)
+    model.c_2_2_capacity_node = pe.Constraint(model.time_dim,model.oil_nodes, rule = c_2_2_node_capacity)
 
     return model
+
+def fix_closed_variables(variable, indices, closed):
+    """Fixes to zero the variables whose upper bound is zero and frees the ones that are not closed anymore.
+    The indices fixed here are kept in the set closed, so the variables fixed somewhere else are not freed."""
+    for index in indices:
+        if variable[index].ub == 0 and (variable[index].lb is None or variable[index].lb <= 0):
+            if not variable[index].fixed:
+                variable[index].fix(0)
+                closed.add(index)
+        elif index in closed:
+            variable[index].unfix()
+            closed.remove(index)
+
+def update_closed_arcs(model):
+    """Fixes to zero the water of the arcs without oil that are closed in a period (usable percentage or
+    maximum flow 0). The usable percentages are mutable, so it must be called again when they change.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    fix_closed_variables(model.x_water, [(i,j,t) for (i,j) in model.arcs if (i,j) not in model.oil_arcs for t in model.time_dim], model.closed_arcs)
+    return model
 #endregion
 
 
@@ -137,12 +377,12 @@ def c_0_elec_cost(model,t, i):
     Constraint Expression
         Relational expression for the constraint.
     """
-    bpd_psi_to_kwh=0.00022837058567207023
+    bpd_psi_to_kwh=BPD_PSI_TO_KWH
     
     ########### c_0_1_Electrical cost ############
 
     if i in model.pumps_linear_regression:
-        fluid_in = sum(model.x_water[k, i,t] for k in model.entry[i])
+        fluid_in = model.water_inflow[i,t]
         return model.y_elec_amount[i,t]\
             >= ((model.pumps_energy_model_pressure_coef[i]\
                 *(model.pressure_out[i]-model.pressure_in[i])\
@@ -152,10 +392,10 @@ def c_0_elec_cost(model,t, i):
 
     elif i in model.pumps_fixed_efficiency:
     ########### c_0_2_Electrical cost ############   
-        if i in model.oil_nodes:
+        if model.node_roles.has(i, roles.OIL):
             fluid_in = sum(model.x_water[k, i,t] + model.x_oil [k, i,t] for k in model.entry[i] if (k,i) in model.oil_arcs)
         else:
-            fluid_in = sum(model.x_water[k, i,t] for k in model.entry[i])
+            fluid_in = model.water_inflow[i,t]
         
         fluid_in =  bpd_psi_to_kwh*fluid_in
 
@@ -200,17 +440,16 @@ def c_1_1_water_flow_balance(model,t,i):
             Relational expression for the constraint.
         """
     ########### c_1_Flow Balancing ############
-    water_in  = sum([model.x_water[j, i,t] for j in model.entry[i]])
-    water_out = sum([model.x_water[i, j,t] for j in model.exit[i]])      
-    water_stored =  model.y_water[i,t]
-    #Consolidate all the input flows of every time t
-
-    if i in list(model.initial):
+    if model.node_roles.has(i, roles.INITIAL):
         return pe.Constraint.Skip
+
+    water_in  = model.water_inflow[i,t]
+    water_out = model.water_outflow[i,t]
+    water_stored =  model.y_water[i,t]
     
-    elif t == model.time_dim.first():
+    if t == model.time_dim.first():
         ########### c_1_1_2_Flow Balancing ############
-        if i in list(model.tanks.union(model.ponds)):
+        if model.node_roles.has(i, roles.STORAGE):
             return water_in - water_out == water_stored - model.initial_content[i]
         else:
             return water_in - water_out == water_stored
@@ -239,19 +478,8 @@ def c_1_2_1_water_flow_balance(model,i):
         Relational expression for the constraint.
 
     """
-    total_in_every_time=sum([model.x_water[i,j,t] for i in model.initial\
-        for t in model.time_dim  for j in model.exit[i]])
-    #Consolidate all the output flows of every time t    
-    total_out_every_time=sum([model.x_water[i,j,t]  for j in model.ending\
-        for t in model.time_dim for i in model.entry[j]])
-    #Consolidate all the storage water of the last t without starting and ending nodes   
-    total_storage_last_time=sum([model.y_water[i,model.time_dim.last()]\
-        for i in model.nodes if i not in (list(model.ending)+list(model.initial))])
-    #consolidate initial tanks content
-    total_initial_content= sum( [model.initial_content[i] for i in model.tanks.union(model.ponds)])
-    
-         ########### c_1_2_1_Flow Balancing ############
-    return total_in_every_time + total_initial_content == total_out_every_time + total_storage_last_time
+    ########### c_1_2_1_Flow Balancing ############
+    return model.total_water_in + model.total_initial_content == model.total_water_out + model.total_water_stored_last_time
 
 
 
@@ -300,24 +528,16 @@ def c_1_3_oil_flow_balance(model,t,i):
     Constraint Expression
         Relational expression for the constraint.
     """
-    oil_in  = sum([model.x_oil[j, i,t] for j in model.entry[i] if j in model.oil_nodes])
-    oil_out = sum([model.x_oil[i, j,t] for j in model.exit[i] if j in model.oil_nodes])    
-    #Consolidate all the input flows of every time t
-    total_in_every_time=sum([model.x_oil[i,j,t] for i in model.initial\
-         for t in model.time_dim for j in model.exit[i] ])
-    #Consolidate all the output flows of every time t    
-    total_out_every_time=sum([model.x_oil[i,j,t]\
-        for j in model.ending for t in model.time_dim for i in model.entry[j]])
-    #Consolidate all the storage oil of the last t without starting and ending nodes   
-    total_storage_last_time=sum([model.y_oil[i,model.time_dim.last()]\
-        for i in model.nodes if i not in (list(model.ending)+list(model.initial))])   
-    
-    if i in list(model.initial):
+    if model.node_roles.has(i, roles.INITIAL):
         ########### c_1_5_1_Flow Balancing ############
-        return total_in_every_time == total_out_every_time + total_storage_last_time 
-        
-    elif t == model.time_dim.first():
+        return model.total_oil_in + model.total_initial_oil_content == model.total_oil_out + model.total_oil_stored_last_time
+
+    oil_in  = model.oil_inflow[i,t]
+    oil_out = model.oil_outflow[i,t]
+    if t == model.time_dim.first():
         ########### c_1_3_2_Flow Balancing ############
+        if model.node_roles.has(i, roles.STORAGE):
+            return oil_in - oil_out == model.y_oil[i,t] - model.initial_oil_content[i]
         return oil_in - oil_out == model.y_oil[i,t]
     else:
         ########### c_1_3_1_Flow Balancing ############
@@ -363,9 +583,13 @@ def c_3_1_water_stability(model,i,j, t):
     """
     ########### c_3_1_water_stability ############
     if t == model.time_dim.first():
-        return pe.Constraint.Skip   #We cannot compare the flow of water of the first period with the previous period
+        #The flow of the first period is only compared with the previous period in a rolling horizon window
+        if (i,j) not in model.arcs_previous_flow:
+            return pe.Constraint.Skip
+        previous_flow = model.previous_flow[i,j]
     else:
-        return  model.x_water[i,j,t] - model.x_water[i,j,t-1] == model.slack_positive_watermix[i,j,t] - model.slack_negative_watermix[i,j,t]
+        previous_flow = model.x_water[i,j,t-1]
+    return  model.x_water[i,j,t] - previous_flow == model.slack_positive_watermix[i,j,t] - model.slack_negative_watermix[i,j,t]
 
 def add_water_stability(model):
     """Sets the water mix stability constraint for every decision variables on the amount of water for water mix stability arcs at time t.
@@ -407,9 +631,13 @@ def c_3_2_pond_stability(model,i,j, t):
     """
     ########### c_3_2_water_stability ############
     if t == model.time_dim.first():
-        return pe.Constraint.Skip   #We cannot compare the flow of water of the first period with the previous period
+        #The activity of the first period is only compared with the previous period in a rolling horizon window
+        if (i,j) not in model.arcs_previous_pond_activity:
+            return pe.Constraint.Skip
+        previous_activity = model.previous_pond_activity[i,j]
     else:
-        return  model.x_active_arc_pond[i,j,t] - model.x_active_arc_pond[i,j,t-1] == model.slack_positive_pond[i,j,t] - model.slack_negative_pond[i,j,t]
+        previous_activity = model.x_active_arc_pond[i,j,t-1]
+    return  model.x_active_arc_pond[i,j,t] - previous_activity == model.slack_positive_pond[i,j,t] - model.slack_negative_pond[i,j,t]
 
 def add_pond_stability(model):
     """Sets the pond stability constraint for every binary variable for pond stability arcs at time t.
@@ -433,6 +661,18 @@ def add_pond_stability(model):
 
 
 #region contaminant flow balance
+def is_contaminated(model, j, contaminant):
+    """Checks if a contaminated source can reach the node (see the presolve of preprocess_data). The rest
+    of the nodes, and their outlet arcs, do not have contaminant variables, so their balances are skipped.
+    """
+    return (j, contaminant) in model.contaminant_nodes
+
+def get_contaminant(variable, *index):
+    """Returns the contaminant variable of the index, or 0 if the presolve did not create it
+    because no contaminated source reaches it.
+    """
+    return variable[index] if index in variable else 0
+
 def c_7_2_balance_contaminant_intial_node(model, t, i,contaminant):
     """
     A inital node is were the system starts, were some contaminants are
@@ -456,6 +696,8 @@ def c_7_2_balance_contaminant_intial_node(model, t, i,contaminant):
         Balance equation for contaminants for specific type of nodes.
 
     """
+    if not is_contaminated(model, i, contaminant):
+        return pe.Constraint.Skip
     ########### c_7_Starting Nodes ############
     for j in model.exit[i]:
         return model.x_contaminant[i,j,contaminant,t] == model.contaminant_in[i,contaminant,t]    
@@ -483,10 +725,12 @@ def c_7_1_balance_contaminant_process_node(model, t, j,contaminant):
         Balance equation for contaminants for specific type of nodes.
 
     """
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
     ########### c_7_1_Process Nodes ############
     for i,k in itertools.product(model.entry[j], model.exit[j]):
         return model.x_contaminant[j,k,contaminant,t] * model.x_water[j,k,t]\
-                == model.x_contaminant[i,j,contaminant,t] * model.x_water[i,j,t]\
+                == get_contaminant(model.x_contaminant, i, j, contaminant, t) * model.x_water[i,j,t]\
                 + model.contaminant_addition_ppm[j,contaminant]
 
 def c_8_1_balance_contaminant_treatment_node(model, t, j,contaminant):
@@ -513,11 +757,13 @@ def c_8_1_balance_contaminant_treatment_node(model, t, j,contaminant):
         Balance equation for contaminants for specific type of nodes.
 
     """
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
         
     ########### c_8_1_Process Nodes ############
     for i,k in itertools.product(model.entry[j], model.exit[j]):
         return model.x_contaminant[j,k,contaminant,t]\
-            == model.x_contaminant[i,j,contaminant,t] * (1 - model.contaminant_removal_rate[j,contaminant]) 
+            == get_contaminant(model.x_contaminant, i, j, contaminant, t) * (1 - model.contaminant_removal_rate[j,contaminant]) 
 
 def c_5_1_balance_contaminant_split_node(model, t, j,contaminant):
     """
@@ -541,9 +787,11 @@ def c_5_1_balance_contaminant_split_node(model, t, j,contaminant):
         Balance equation for contaminants for specific type of nodes.
 
     """
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
     ########### c_5_1_Splitter Nodes Without Loss Tanks ############
     for i,k in itertools.product(model.entry[j], model.exit[j]):
-        return model.x_contaminant[j,k,contaminant,t] == model.x_contaminant[i,j,contaminant,t]  
+        return model.x_contaminant[j,k,contaminant,t] == get_contaminant(model.x_contaminant, i, j, contaminant, t)  
 
 def c_5_1_2_balance_contaminant_split_node_with_loss_tanks(model, t, j, contaminant):
     """
@@ -568,10 +816,12 @@ def c_5_1_2_balance_contaminant_split_node_with_loss_tanks(model, t, j, contamin
         Balance equation for contaminants for specific type of nodes.
 
     """
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
     ########### 5.1. Splitter Nodes With Tank Nodes ############
     bar_to_lts = 119.24047119599997
-    contaminants_in  = sum([model.x_contaminant[i,j,contaminant,t] * model.x_water[i,j,t] * bar_to_lts for i in model.entry[j]])
-    contaminants_out = sum([model.x_contaminant[j,k,contaminant,t] * model.x_water[j,k,t] * bar_to_lts for k in model.exit[j] if k not in model.loss_tanks])
+    contaminants_in  = sum([get_contaminant(model.x_contaminant, i, j, contaminant, t) * model.x_water[i,j,t] * bar_to_lts for i in model.entry[j]])
+    contaminants_out = sum([model.x_contaminant[j,k,contaminant,t] * model.x_water[j,k,t] * bar_to_lts for k in model.exit[j] if not model.node_roles.has(k, roles.LOSS_TANK)])
     return contaminants_out == contaminants_in  
 
 def c_6_1_balance_contaminant_mixer_node(model, t, j,contaminant):
@@ -598,9 +848,11 @@ def c_6_1_balance_contaminant_mixer_node(model, t, j,contaminant):
         Balance equation for contaminants for specific type of nodes.
 
     """
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
     ########### c_6_1_Mixer Nodes ############
     bar_to_lts = 119.24047119599997
-    contaminants_in  = sum([model.x_contaminant[i,j, contaminant,t] * model.x_water[i,j,t] * bar_to_lts for i in model.entry[j]])
+    contaminants_in  = sum([get_contaminant(model.x_contaminant, i, j, contaminant, t) * model.x_water[i,j,t] * bar_to_lts for i in model.entry[j]])
     contaminants_out = sum([model.x_contaminant[j,k, contaminant,t] * model.x_water[j,k,t] * bar_to_lts for k in model.exit[j]])
     return contaminants_out == contaminants_in
     
@@ -628,9 +880,11 @@ def c_6_2_balance_contaminant_boiler_node(model, t, j,contaminant):
         Balance equation for contaminants for specific type of nodes.
 
     """
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
     ########### c_6_2_boiler Nodes ############
     bar_to_lts = 119.24047119599997
-    contaminants_in  = sum([model.x_contaminant[i,j, contaminant,t] * model.x_water[i,j,t] * bar_to_lts for i in model.entry[j]])
+    contaminants_in  = sum([get_contaminant(model.x_contaminant, i, j, contaminant, t) * model.x_water[i,j,t] * bar_to_lts for i in model.entry[j]])
     contaminants_out = sum([model.x_contaminant[j,k, contaminant,t] * model.x_water[j,k,t] * bar_to_lts for k in model.exit[j]])
     return contaminants_out == contaminants_in
 
@@ -658,9 +912,11 @@ def c_6_3_balance_contaminant_cooling_tower_node(model, t, j,contaminant):
         Balance equation for contaminants for specific type of nodes.
 
     """
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
     ########### c_6_3_cooling towers Nodes ############
     bar_to_lts = 119.24047119599997
-    contaminants_in  = sum([model.x_contaminant[i,j, contaminant,t] * model.x_water[i,j,t] * bar_to_lts for i in model.entry[j]])
+    contaminants_in  = sum([get_contaminant(model.x_contaminant, i, j, contaminant, t) * model.x_water[i,j,t] * bar_to_lts for i in model.entry[j]])
     contaminants_out = sum([model.x_contaminant[j,k, contaminant,t] * model.x_water[j,k,t] * bar_to_lts for k in model.exit[j]])
     return contaminants_out == contaminants_in
 
@@ -669,7 +925,8 @@ def c_10_1_1_balance_contaminant_tank_node(model, t, j,contaminant):
     See equation (10.1.1) and (10.1.2) in the mathematical model 
     The concentration of contaminant c in a tank j depends on the current
     content's concentration of the tank, as well as the concentration of the
-    inflow and outflow.
+    inflow and outflow. The contaminants stored before the first period are
+    the ones of the initial content.
 
     Parameters
     ----------
@@ -688,21 +945,29 @@ def c_10_1_1_balance_contaminant_tank_node(model, t, j,contaminant):
         Balance equation for contaminants for specific type of nodes.
 
     """
-    for i,k in itertools.product(model.entry[j], model.exit[j]):
-        ########### c_10_1_2_Tank Nodes ############
-        if  t == model.time_dim.first():
-            return model.initial_content[j]* model.initial_content_contaminants_tanks[j,contaminant] \
-                + model.y_contaminant[j,contaminant,t]* model.y_water[j,t] \
-                == model.x_contaminant[i,j,contaminant,t] * model.x_water[i,j,t] \
-                - model.x_contaminant[j,k,contaminant,t] * model.x_water[j,k,t]
-        ########### c_10_1_1_Tank Nodes ############
-        else:
-            return model.y_contaminant[j,contaminant,t]* model.y_water[j,t] \
-                == model.x_contaminant[i,j,contaminant,t] * model.x_water[i,j,t]\
-            	- model.x_contaminant[j,k,contaminant,t] * model.x_water[j,k,t] \
-                + model.y_contaminant[j,contaminant,t-1]* model.y_water[j,t-1]
-    
-def c_10_2_balance_contaminant_tank_node (model, t, j,contaminant):
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
+    contaminants_in  = sum([get_contaminant(model.x_contaminant, i, j, contaminant, t) * model.x_water[i,j,t] for i in model.entry[j]])
+    contaminants_out = sum([model.x_contaminant[j,k,contaminant,t] * model.x_water[j,k,t] for k in model.exit[j] if not model.node_roles.has(k, roles.LOSS_TANK)])
+    contaminants_stored_now = model.y_contaminant[j,contaminant,t]* model.y_water[j,t]
+    ########### c_10_1_2_Tank Nodes ############
+    if  t == model.time_dim.first():
+        contaminants_stored_before = model.initial_content[j]* model.initial_content_contaminants_tanks[j,contaminant]
+    ########### c_10_1_1_Tank Nodes ############
+    else:
+        contaminants_stored_before = model.y_contaminant[j,contaminant,t-1]* model.y_water[j,t-1]
+    return contaminants_stored_now - contaminants_stored_before == contaminants_in - contaminants_out
+
+def storage_outlet_concentration(model, t, j, k, contaminant):
+    """Concentration of the outlet (j,k) of a tank or pond: the concentration stored at the time t-1, or the
+    concentration that gets in during the first period.
+    """
+    if t > model.time_dim.first():
+        return model.x_contaminant[j,k,contaminant,t] == model.y_contaminant[j,contaminant,t-1]
+    contaminants_in = sum([get_contaminant(model.x_contaminant, i, j, contaminant, t) * model.x_water[i,j,t] for i in model.entry[j]])
+    return model.x_contaminant[j,k,contaminant,t] * model.water_inflow[j,t] == contaminants_in
+
+def c_10_2_balance_contaminant_tank_node (model, t, j, k, contaminant):
     """
     See equation (10.2) in the mathematical model
     ASSUMPTION: We consider the output flow concentration to be equal to the 
@@ -714,8 +979,8 @@ def c_10_2_balance_contaminant_tank_node (model, t, j,contaminant):
         The optimization model.
     t : int
         Time dimension.
-    j : String
-        The tank nodes of the system.
+    j, k : String
+        The arc, it is an outlet of a tank node of the system.
     contaminant : String
         Aditional substance that can be found within the principal fluid.
 
@@ -725,17 +990,11 @@ def c_10_2_balance_contaminant_tank_node (model, t, j,contaminant):
         Balance equation for contaminants for specific type of nodes.
 
     """
+    if not model.node_roles.has(j, roles.TANK) or model.node_roles.has(k, roles.LOSS_TANK)\
+        or not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
     ########### c_10_2_Tank Nodes ############
-    if  t > model.time_dim.first():
-        for k in model.exit[j]:
-            return model.x_contaminant[j,k,contaminant,t] == model.y_contaminant[j,contaminant,t-1]
-        
-    
-    else:
-        ########### c_5_2_Oil Splitter Nodes ############
-        ########### c_5_3_Oil Splitter Nodes ############
-        for i,k in itertools.product(model.entry[j], model.exit[j]):
-            return model.x_contaminant[j,k,contaminant,t] == model.x_contaminant[i,j,contaminant,t]
+    return storage_outlet_concentration(model, t, j, k, contaminant)
     
 def c_12_1_2_balance_contaminant_loss_tank_node(model, t, j, contaminant):
     """
@@ -758,6 +1017,8 @@ def c_12_1_2_balance_contaminant_loss_tank_node(model, t, j, contaminant):
         Balance equation for contaminants for specific type of nodes.
 
     """
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
     return model.y_contaminant[j,contaminant,t] == 0
 
 def c_12_1_1_balance_contaminant_before_loss_tank_node(model, t, j, contaminant):
@@ -781,7 +1042,11 @@ def c_12_1_1_balance_contaminant_before_loss_tank_node(model, t, j, contaminant)
         Balance equation for contaminants for specific type of nodes.
 
     """
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
     for i in model.entry[j]:
+        if not is_contaminated(model, i, contaminant):
+            return pe.Constraint.Skip
         return model.x_contaminant[i,j,contaminant,t] == 0
 
 def c_14_balance_contaminant_pond_node(model, t, j, contaminant):
@@ -806,17 +1071,19 @@ def c_14_balance_contaminant_pond_node(model, t, j, contaminant):
         Balance equation for contaminants for specific type of nodes.
 
     """
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
     bar_to_lts = 119.24047119599997
-    contaminants_in  = sum([model.x_contaminant[i,j,contaminant,t] * model.x_water[i,j,t] * bar_to_lts for i in model.entry[j]])
-    contaminants_out = sum([model.x_contaminant[j,k,contaminant,t] * model.x_water[j,k,t] * bar_to_lts for k in model.exit[j] if k not in model.loss_tanks])
+    contaminants_in  = sum([get_contaminant(model.x_contaminant, i, j, contaminant, t) * model.x_water[i,j,t] * bar_to_lts for i in model.entry[j]])
+    contaminants_out = sum([model.x_contaminant[j,k,contaminant,t] * model.x_water[j,k,t] * bar_to_lts for k in model.exit[j] if not model.node_roles.has(k, roles.LOSS_TANK)])
 
     contaminants_stored_now = model.y_contaminant[j,contaminant,t]* model.y_water[j,t] * bar_to_lts
     
-    contaminants_inital_content= model.initial_content[j]* model.initial_content_contaminants_ponds[j,contaminant] 
+    contaminants_inital_content= model.initial_content[j]* model.initial_content_contaminants_ponds[j,contaminant] * bar_to_lts
     
     ########### c_14_1_1 Pond Nodes ############
     if  t == model.time_dim.first():
-        return contaminants_stored_now+contaminants_inital_content ==  contaminants_in - contaminants_out
+        return contaminants_stored_now - contaminants_inital_content ==  contaminants_in - contaminants_out
 
     ########### c_14_1_2 Pond Nodes ############
     else:
@@ -824,7 +1091,7 @@ def c_14_balance_contaminant_pond_node(model, t, j, contaminant):
         
         return contaminants_stored_now - contaminant_stored_before == contaminants_in - contaminants_out
 
-def c_14_2_1_balance_contaminant_pond_node_2(model, t, j,contaminant):
+def c_14_2_1_balance_contaminant_pond_node_2(model, t, j, k, contaminant):
     """
     ASSUMPTION: We consider the output flow concentration to be equal to the 
     tank concentration at the time t-1
@@ -835,8 +1102,8 @@ def c_14_2_1_balance_contaminant_pond_node_2(model, t, j,contaminant):
         The optimization model.
     t : int
         Time dimension.
-    j : String
-        The pond node.
+    j, k : String
+        The arc, it is an outlet of a pond node (the loss tanks are skipped).
     contaminant : String
         Aditional substance that can be found within the principal fluid.
 
@@ -846,14 +1113,11 @@ def c_14_2_1_balance_contaminant_pond_node_2(model, t, j,contaminant):
         Balance equation for contaminants for specific type of nodes.
 
     """
-    ########### 10.1.2 Tank Nodes ############
-    if  t > model.time_dim.first():
-        for k in model.exit[j]:
-            if k not in model.loss_tanks:
-                return model.x_contaminant[j,k,contaminant,t] == model.y_contaminant[j,contaminant,t-1]
-
-    else:
+    if not model.node_roles.has(j, roles.POND) or model.node_roles.has(k, roles.LOSS_TANK)\
+        or not is_contaminated(model, j, contaminant):
         return pe.Constraint.Skip
+    ########### 14.2.1 Pond Nodes ############
+    return storage_outlet_concentration(model, t, j, k, contaminant)
 
 
 def c_10_3_balance_contaminant_all_other_nodes(model, t, j,contaminant):
@@ -880,21 +1144,295 @@ def c_10_3_balance_contaminant_all_other_nodes(model, t, j,contaminant):
         Balance equation for contaminants for specific type of nodes.
 
     """
-    if j in list(model.process)\
-        +list(model.treatment)\
-        +list(model.split)\
-        +list(model.mix)\
-        +list(model.tanks)\
-        +list(model.initial)\
-        +list(model.ending)\
-        +list(model.cooling_towers)\
-        +list(model.boiler)\
-        +list(model.loss_tanks)\
-        +list(model.ponds):
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
+    if model.node_roles.has(j, roles.PROCESS | roles.TREATMENT | roles.SPLITTER | roles.MIXER | roles.TANK | roles.INITIAL\
+                            | roles.ENDING | roles.COOLING_TOWER | roles.BOILER | roles.LOSS_TANK | roles.POND):
         return pe.Constraint.Skip
     else:
         for i,k in itertools.product(model.entry[j], model.exit[j]):
-            return model.x_contaminant[j,k,contaminant,t] == model.x_contaminant[i,j,contaminant,t]
+            return model.x_contaminant[j,k,contaminant,t] == get_contaminant(model.x_contaminant, i, j, contaminant, t)
+
+def has_contaminant_balance(model):
+    """Checks if the model needs the contaminant balances: there are process nodes or contaminants
+    in the initial nodes or in the initial content of tanks and ponds.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+
+    Returns
+    -------
+    boolean
+        True if the contaminant balances are needed.
+    """
+    return len(model.process)!=0\
+        or sum(model.contaminant_in.extract_values().values())!=0\
+        or (sum(model.initial_content_contaminants_ponds.extract_values().values())\
+            + sum(model.initial_content_contaminants_tanks.extract_values().values()))!=0
+
+def contaminant_mass_in(model, j, contaminant, t):
+    return sum(get_contaminant(model.m_contaminant, i, j, contaminant, t) for i in model.entry[j])
+
+def contaminant_mass_out(model, j, contaminant, t):
+    return sum(model.m_contaminant[j,k,contaminant,t] for k in model.exit[j] if not model.node_roles.has(k, roles.LOSS_TANK))
+
+def c_18_1_mass_contaminant_initial_arcs(model, t, i, j, contaminant):
+    """The contaminant mass that leaves an initial node is its water flow times the contaminant
+    concentration of the node.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    t : int
+        Time dimension.
+    i, j : String
+        The arc.
+    contaminant : String
+        Aditional substance that can be found within the principal fluid.
+
+    Returns
+    -------
+    Constraint Expression
+        Linear mass equation of the arc.
+    """
+    if not is_contaminated(model, i, contaminant):
+        return pe.Constraint.Skip
+    if not model.node_roles.has(i, roles.INITIAL):
+        return pe.Constraint.Skip
+    return model.m_contaminant[i,j,contaminant,t] == model.contaminant_in[i,contaminant,t] * model.x_water[i,j,t]
+
+def c_18_2_mass_contaminant_node_balance(model, t, j, contaminant):
+    """The contaminant mass that leaves a node (without counting the loss tanks) is the mass that gets in,
+    reduced by the removal rate of treatment nodes and increased by the addition of process nodes.
+    Initial, ending, loss tank, tank and pond nodes have their own equations.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    t : int
+        Time dimension.
+    j : String
+        The node.
+    contaminant : String
+        Aditional substance that can be found within the principal fluid.
+
+    Returns
+    -------
+    Constraint Expression
+        Linear mass balance of the node.
+    """
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
+    if model.node_roles.has(j, roles.INITIAL | roles.ENDING | roles.LOSS_TANK | roles.STORAGE):
+        return pe.Constraint.Skip
+
+    mass_in = contaminant_mass_in(model, j, contaminant, t)
+    if j in model.treatment:
+        mass_in = mass_in * (1 - model.contaminant_removal_rate[j,contaminant])
+    if j in model.process:
+        mass_in = mass_in + model.contaminant_addition_ppm[j,contaminant]
+    return contaminant_mass_out(model, j, contaminant, t) == mass_in
+
+def c_18_3_mass_contaminant_storage_balance(model, t, j, contaminant):
+    """The contaminant mass stored in a tank or pond is the mass stored in the previous period (or its initial
+    content) plus the mass that gets in minus the mass that leaves (loss tanks get water, not contaminants).
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    t : int
+        Time dimension.
+    j : String
+        The tank or pond.
+    contaminant : String
+        Aditional substance that can be found within the principal fluid.
+
+    Returns
+    -------
+    Constraint Expression
+        Linear mass balance of the storage node.
+    """
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
+    if t == model.time_dim.first():
+        if model.node_roles.has(j, roles.TANK):
+            stored_before = model.initial_content[j] * model.initial_content_contaminants_tanks[j,contaminant]
+        else:
+            stored_before = model.initial_content[j] * model.initial_content_contaminants_ponds[j,contaminant]
+    else:
+        stored_before = model.s_contaminant[j,contaminant,t-1]
+    return model.s_contaminant[j,contaminant,t] - stored_before\
+        == contaminant_mass_in(model, j, contaminant, t) - contaminant_mass_out(model, j, contaminant, t)
+
+def c_18_4_mass_contaminant_loss_arcs(model, t, i, j, contaminant):
+    """Loss tanks (evaporation) do not get contaminants.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    t : int
+        Time dimension.
+    i, j : String
+        The arc.
+    contaminant : String
+        Aditional substance that can be found within the principal fluid.
+
+    Returns
+    -------
+    Constraint Expression
+        Mass of the arc equal to zero.
+    """
+    if not model.node_roles.has(j, roles.LOSS_TANK) or not is_contaminated(model, i, contaminant):
+        return pe.Constraint.Skip
+    return model.m_contaminant[i,j,contaminant,t] == 0
+
+def c_18_5_mass_contaminant_fixed_splitter(model, t, j, k, contaminant):
+    """A fixed splitter sends the same percentage of the water and of the contaminant mass to each outlet,
+    so the concentration is the same in all the outlets without a bilinear equation.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    t : int
+        Time dimension.
+    j, k : String
+        The fixed splitter arc.
+    contaminant : String
+        Aditional substance that can be found within the principal fluid.
+
+    Returns
+    -------
+    Constraint Expression
+        Linear mass equation of the arc.
+    """
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
+    return model.m_contaminant[j,k,contaminant,t] == contaminant_mass_in(model, j, contaminant, t) * model.fixed_percentage[j,k]
+
+def c_18_6_mass_contaminant_outlet_concentration(model, t, j, k, contaminant):
+    """The non linear equations of the mass flow formulation: the concentration of every outlet of a node
+    is the concentration of the node. It is only needed when the balance does not define it: nodes with more
+    than one outlet (without the fixed splitter ones) and tanks and ponds, whose outlets have the concentration
+    stored in the previous period (the concentration that gets in, in the first period). The outlets of tanks
+    and ponds keep it in x_contaminant (see c_18_7).
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    t : int
+        Time dimension.
+    j, k : String
+        The arc.
+    contaminant : String
+        Aditional substance that can be found within the principal fluid.
+
+    Returns
+    -------
+    Constraint Expression
+        Bilinear concentration equation of the arc.
+    """
+    if not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
+    outlets = [n for n in model.exit[j] if not model.node_roles.has(n, roles.LOSS_TANK)]
+    storage = model.node_roles.has(j, roles.STORAGE)
+    if model.node_roles.has(j, roles.INITIAL) or model.node_roles.has(k, roles.LOSS_TANK) or (j,k) in model.fixed_splitter_arcs\
+        or (len(outlets) < 2 and not storage):
+        return pe.Constraint.Skip
+
+    if storage:
+        if t > model.time_dim.first():
+            return model.x_contaminant[j,k,contaminant,t] * model.y_water[j,t-1] == model.s_contaminant[j,contaminant,t-1]
+        return model.x_contaminant[j,k,contaminant,t] * model.water_inflow[j,t] == contaminant_mass_in(model, j, contaminant, t)
+    return model.m_contaminant[j,k,contaminant,t] * model.water_inflow[j,t]\
+        == model.x_water[j,k,t] * contaminant_mass_in(model, j, contaminant, t)
+
+def c_18_7_mass_contaminant_storage_outlets(model, t, j, k, contaminant):
+    """The contaminant mass that leaves a tank or pond through an arc is its water flow times the outlet
+    concentration (c_18_6). Writing it as a product keeps the mass of the arcs without water at 0, also when
+    the concentration is not defined (e.g. no water gets in during the first period).
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    t : int
+        Time dimension.
+    j, k : String
+        The arc.
+    contaminant : String
+        Aditional substance that can be found within the principal fluid.
+
+    Returns
+    -------
+    Constraint Expression
+        Bilinear mass equation of the arc.
+    """
+    if not model.node_roles.has(j, roles.STORAGE) or model.node_roles.has(k, roles.LOSS_TANK)\
+        or not is_contaminated(model, j, contaminant):
+        return pe.Constraint.Skip
+    return model.m_contaminant[j,k,contaminant,t] == model.x_contaminant[j,k,contaminant,t] * model.x_water[j,k,t]
+
+def add_contaminant_mass_flow_balance(model):
+    """Sets the mass flow formulation of the contaminant balances: the contaminant mass of every arc
+    (m_contaminant) and stored in every tank or pond (s_contaminant) are variables, so all the balances are
+    linear and only the outlet equations (c_18_6 and c_18_7) are bilinear.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    if has_contaminant_balance(model):
+        model.c_18_1_mass_contaminant_initial_arcs = pe.Constraint(model.time_dim, model.arcs, model.contaminants,
+                                                        rule=c_18_1_mass_contaminant_initial_arcs)
+        model.c_18_2_mass_contaminant_node_balance = pe.Constraint(model.time_dim, model.nodes, model.contaminants,
+                                                        rule=c_18_2_mass_contaminant_node_balance)
+        model.c_18_3_mass_contaminant_storage_balance = pe.Constraint(model.time_dim, model.tanks.union(model.ponds), model.contaminants,
+                                                        rule=c_18_3_mass_contaminant_storage_balance)
+        model.c_18_4_mass_contaminant_loss_arcs = pe.Constraint(model.time_dim, model.arcs, model.contaminants,
+                                                        rule=c_18_4_mass_contaminant_loss_arcs)
+        model.c_18_5_mass_contaminant_fixed_splitter = pe.Constraint(model.time_dim, model.fixed_splitter_arcs, model.contaminants,
+                                                        rule=c_18_5_mass_contaminant_fixed_splitter)
+        model.c_18_6_mass_contaminant_outlet_concentration = pe.Constraint(model.time_dim, model.arcs, model.contaminants,
+                                                        rule=c_18_6_mass_contaminant_outlet_concentration)
+        model.c_18_7_mass_contaminant_storage_outlets = pe.Constraint(model.time_dim, model.arcs, model.contaminants,
+                                                        rule=c_18_7_mass_contaminant_storage_outlets)
+    return model
+
+def set_contaminant_concentrations(model):
+    """Loads the concentrations of the mass flow formulation solution in x_contaminant and y_contaminant,
+    which are the variables reported in the outputs.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    for (i, j, contaminant, t), mass in model.m_contaminant.items():
+        water = model.x_water[i,j,t].value
+        model.x_contaminant[i,j,contaminant,t].set_value(mass.value / water if mass.value is not None and water else 0)
+    for (j, contaminant, t), mass in model.s_contaminant.items():
+        water = model.y_water[j,t].value
+        model.y_contaminant[j,contaminant,t].set_value(mass.value / water if mass.value is not None and water else 0)
+    return model
 
 def add_contaminant_flow_balance (model):
     """Sets the contaminant flow balance constraint for every arc in the model for time t.
@@ -909,11 +1447,10 @@ def add_contaminant_flow_balance (model):
     Pyomo ConcreteModel
         The optimization model.
     """
-    if len(model.process)!=0\
-        or sum(model.contaminant_in.extract_values().values())!=0\
-        or (sum(model.initial_content_contaminants_ponds.extract_values().values())\
-            + sum(model.initial_content_contaminants_tanks.extract_values().values()))!=0:  
-        
+    if getattr(model, 'contaminant_formulation', 'concentration') == 'mass_flow':
+        return add_contaminant_mass_flow_balance(model)
+
+    if has_contaminant_balance(model):
         model.c_7_2_balance_contaminant_intial_node = pe.Constraint(model.time_dim, 
                                                         model.initial,model.contaminants, 
                                                         rule = c_7_2_balance_contaminant_intial_node)
@@ -944,7 +1481,7 @@ def add_contaminant_flow_balance (model):
                                                         model.tanks,model.contaminants, 
                                                         rule=c_10_1_1_balance_contaminant_tank_node)
         model.c_10_2_balance_contaminant_tank_node = pe.Constraint(model.time_dim, 
-                                                        model.tanks,model.contaminants,
+                                                        model.arcs,model.contaminants,
                                                         rule=c_10_2_balance_contaminant_tank_node)
         model.c_12_1_2_balance_contaminant_loss_tank_node = pe.Constraint(model.time_dim, 
                                                         model.loss_tanks,model.contaminants, 
@@ -956,7 +1493,7 @@ def add_contaminant_flow_balance (model):
                                                         model.ponds, model.contaminants, 
                                                         rule=c_14_balance_contaminant_pond_node)
         model.c_14_2_1_balance_contaminant_pond_node_2 = pe.Constraint(model.time_dim, 
-                                                        model.ponds, model.contaminants, 
+                                                        model.arcs, model.contaminants, 
                                                         rule=c_14_2_1_balance_contaminant_pond_node_2)
         model.c_10_3_balance_contaminant_all_other_nodes = pe.Constraint(model.time_dim, 
                                                             model.nodes,model.contaminants, 
@@ -990,11 +1527,11 @@ def c_1_4_storing_water_oil_proportion(model,t,j):
     if len(model.entry[j]) == 0 and len(model.exit[j]) == 0:
         return pe.Constraint.Skip
         
-    water_in = sum([model.x_water[i, j,t] for i in model.entry[j]])
-    oil_in = sum([model.x_oil[i, j,t] for i in model.entry[j]])
+    water_in = model.water_inflow[j,t]
+    oil_in = model.oil_inflow[j,t]
 
     #Initial nodes
-    if j in list(model.initial):
+    if model.node_roles.has(j, roles.INITIAL):
         water_in = model.water_in[j,t]
         oil_in = model.oil_in[j,t]
     ########### c_1_4_Flow Balancing ############
@@ -1041,7 +1578,7 @@ def c_5_2_water_fixed_splitter_values(model,t,j,k):
     Constraint Expression
         Relational expression for the constraint.
     """
-    water_in = sum([model.x_water[i, j,t] for i in model.entry[j]])
+    water_in = model.water_inflow[j,t]
     rate = model.fixed_percentage[j, k]
     ########### c_5_2_Splitter Nodes ############
     return model.x_water[j,k,t] == (water_in - model.y_water[j,t]) * rate
@@ -1068,7 +1605,7 @@ def c_5_3_oil_fixed_splitter_values(model,t,j, k):
     if (j, k)  not in model.oil_arcs:
         return pe.Constraint.Skip
 
-    oil_in = sum([model.x_oil[i, j,t] for i in model.entry[j] if (i, j) in model.oil_arcs])
+    oil_in = model.oil_inflow[j,t]
     rate = model.fixed_percentage[j, k]
     ########### c_5_3_Splitter Nodes ############
     return model.x_oil[j, k,t] == (oil_in - model.y_oil[j,t]) * rate
@@ -1114,7 +1651,7 @@ def c_9_2_oil_fixed_treatment_values(model,t, j, k):
         Relational expression for the constraint.
     """
 
-    flow_in = sum([model.x_oil[i, j,t] for i in model.entry[j]])
+    flow_in = model.oil_inflow[j,t]
     rate = model.fixed_oil_percentage[j,k]
     ########### c_9_2_Treatment Nodes ############
     return model.x_oil[j,k,t] == (flow_in - model.y_oil[j,t]) * rate
@@ -1139,7 +1676,7 @@ def c_9_1_water_fixed_treatment_values(model,t,j, k):
     Constraint Expression
         Relational expression for the constraint.
     """
-    water_in = sum([model.x_water[i, j,t] for i in model.entry[j]])
+    water_in = model.water_inflow[j,t]
     rate = model.fixed_water_percentage[j, k]
     ########### c_9_1_Treatment Nodes ############
     return model.x_water[j, k,t] == (water_in - model.y_water[j,t]) * rate
@@ -1184,7 +1721,7 @@ def c_14_3_1_pond_evaporation(model, t, j):
     Constraint Expression
         Relational expression for the constraint.
     """
-    evap_flow = model.forecasted_evap_rate[t] * model.pond_average_surface[j] * model.xActivePonds[j, t] * 6.28981077
+    evap_flow = model.forecasted_evap_rate[t] * model.pond_average_surface[j] * model.xActivePonds[j, t] * EVAPORATION_TO_BARRELS
 
     evap_water_out = sum([model.x_water[j, k, t] for k in model.exit[j] if k in model.loss_tanks])
 
@@ -1231,10 +1768,10 @@ def c_4_3_initial_nodes_water(model,t,i):
     Constraint Expression
         Relational expression for the constraint.
     """
-    water_out = sum([model.x_water[i, j,t] for j in model.exit[i]])
+    water_out = model.water_outflow[i,t]
     if t==model.time_dim.first():
         ########### c_4_3_Flow Balancing Relationship ############
-        return model.y_water[i,t] + water_out == model.water_in[i,t]
+        return model.y_water[i,t] + water_out == model.water_in[i,t] + model.initial_content[i]
     else:
         ########### c_4_4_Flow Balancing Relationship ############
         return model.y_water[i,t] + water_out == model.water_in[i,t] + model.y_water[i,t-1]
@@ -1256,11 +1793,11 @@ def c_4_5_initial_nodes_oil(model,t,i):
     Constraint Expression
         Relational expression for the constraint.
     """
-    if i in model.oil_nodes:
-        oil_out = sum([model.x_oil[i, j,t] for j in model.exit[i]])
+    if model.node_roles.has(i, roles.OIL):
+        oil_out = model.oil_outflow[i,t]
         if t==model.time_dim.first():
             ########### c_4_5_Flow Balancing Relationship ############
-            return model.y_oil[i,t] + oil_out == model.oil_in[i,t]
+            return model.y_oil[i,t] + oil_out == model.oil_in[i,t] + model.initial_oil_content[i]
         else:
             ########### c_4_6_Flow Balancing Relationship ############
             return model.y_oil[i,t] + oil_out == model.oil_in[i,t] + model.y_oil[i,t-1]
@@ -1304,11 +1841,12 @@ def c_11_1_3_initial_ending_spill_oil(model,t,i):
     Constraint Expression
         Relational expression for the constraint.
     """
-    if i in model.oil_nodes:
+    if model.node_roles.has(i, roles.OIL):
         if t==model.time_dim.first():
             ########### c_4_8_1_Flow Balancing Relationship ############
             ########### c_11_1_3 Flow Balancing ############
-            return model.y_oil[i,t] >= 0
+            #the oil spilled before the window (rolling horizon) can not be used either
+            return model.y_oil[i,t] >= (model.initial_oil_content[i] if model.node_roles.has(i, roles.INITIAL) else 0)
         else:
             ########### c_4_8_2_Flow Balancing Relationship ############
             ########### c_11_1_4 Flow Balancing ############
@@ -1337,7 +1875,8 @@ def c_11_1_1_initial_ending_spill_water(model,t,i):
     if t==model.time_dim.first():
         ########### c_4_7_1_Flow Balancing Relationship ############
         ########### c_11_1_1_Constraint in ending nodes ############
-        return model.y_water[i,t] >=0
+        #the water spilled before the window (rolling horizon) can not be used either
+        return model.y_water[i,t] >= (model.initial_content[i] if model.node_roles.has(i, roles.INITIAL) else 0)
     else:
         ########### c_4_7_2_Flow Balancing Relationship ############
         ########### c_11_1_2_Constraint in ending nodes ############
@@ -1385,12 +1924,12 @@ def c_11_2_demand_ending_nodes (model,t,j):
     Constraint Expression
         Relational expression for the constraint.
     """
-    if j in model.oil_nodes:
-        oil_in  = sum([model.x_oil[i,j,t] for i in model.entry[j]])
+    if model.node_roles.has(j, roles.OIL):
+        oil_in  = model.oil_inflow[j,t]
          ########### c_11_2_2_Constraint in ending nodes ############
         return oil_in <= model.ending_demand[j,t]
     else:
-        water_in  = sum([model.x_water[i,j,t] for i in model.entry[j]])
+        water_in  = model.water_inflow[j,t]
         ########### c_11_2_1_Constraint in ending nodes ############
         return water_in <= model.ending_demand[j,t]
 
@@ -1413,6 +1952,57 @@ def add_demand_ending_nodes (model):
 
 #endregion
 
+#region big-M of the activity constraints
+def arcs_flow_capacity(model, arcs, t):
+    return sum(model.max_flow[i,j] * pe.value(get_usable_percentage(model, i, j, t)) for (i,j) in arcs)
+
+def update_big_m(model):
+    """Computes the big-M of the constraints that link the pumps, ponds and stability arcs with their
+    activity binaries (c_13_2, c_17_1 and c_15). With the 'tight' method (default), the big-M is the
+    largest value the linked flow or storage can take:
+    - Pumps: the inflow, bounded by the capacity of the inlet arcs and by the capacity of the outlet
+      arcs plus the capacity of the pump.
+    - Ponds: the stored water, bounded by the capacity of the pond and by its initial content plus
+      the capacity of the inlet arcs up to t.
+    - Stability arcs: the flow, bounded by the capacity of the arc.
+    With the 'global' method, the big-M is the maximum node capacity (BigPenalty) or arc flow
+    (BigPenaltyArcs) of the network. The big-M depend on the mutable usable percentages and initial
+    contents, so they must be updated when those change.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    tight = getattr(model, 'big_m_method', 'tight') == 'tight'
+    for pump in model.pumps:
+        inlet_arcs = [(i, pump) for i in model.entry[pump]]
+        outlet_arcs = [(pump, k) for k in model.exit[pump]]
+        for t in model.time_dim:
+            if tight:
+                model.big_m_pumps[pump,t] = min(arcs_flow_capacity(model, inlet_arcs, t),
+                                                arcs_flow_capacity(model, outlet_arcs, t) + model.max_capacity[pump])
+            else:
+                model.big_m_pumps[pump,t] = model.BigPenalty
+
+    for pond in model.ponds:
+        inlet_arcs = [(i, pond) for i in model.entry[pond]]
+        stored = pe.value(model.initial_content[pond])
+        for t in model.time_dim:
+            stored = min(stored + arcs_flow_capacity(model, inlet_arcs, t), model.max_capacity[pond])
+            model.big_m_ponds[pond,t] = stored if tight else model.BigPenalty
+
+    for (i, j, t) in model.big_m_arcs:
+        model.big_m_arcs[i,j,t] = arcs_flow_capacity(model, [(i, j)], t) if tight else model.BigPenaltyArcs
+    return model
+
+#endregion
+
 #region positive energy for pumps
        
 def c_13_1_active_pumps_max(model, pump, t):
@@ -1429,8 +2019,8 @@ def c_13_1_active_pumps_max(model, pump, t):
     value pyomo.core.base.constraint.Constraint
         Check if pump isn't active then the variable should be zero.
     '''
-    water_in  = sum([model.x_water[i, pump, t] for i in model.entry[pump]]) 
-    epsilon = 1e-30
+    water_in  = model.water_inflow[pump, t]
+    epsilon = PUMPS_EPSILON
 
     return model.xActivePump[pump, t] <= 1 + water_in - epsilon
 
@@ -1465,9 +2055,9 @@ def c_13_2_active_pumps_min(model, pump, t):
     value pyomo.core.base.constraint.Constraint
         Check if the pump is active then the variable should be one.
     '''
-    water_in  = sum([model.x_water[i, pump, t] for i in model.entry[pump]])  
+    water_in  = model.water_inflow[pump, t]
     
-    return water_in <= model.xActivePump[pump, t] * model.BigPenalty
+    return water_in <= model.xActivePump[pump, t] * model.big_m_pumps[pump, t]
 
 def add_active_pumps_min (model):
     """Sets the constraint for detect the active pumps lower bound
@@ -1500,7 +2090,7 @@ def c_13_3_positive_energy(model, pump, t):
         value pyomo.core.base.constraint.Constraint
             Checked if the energy function value is negative
         '''
-        constant = 400
+        constant = MIN_PUMP_ENERGY
 
         return model.y_elec_amount[pump, t]>=constant*model.xActivePump[pump, t]
 
@@ -1538,7 +2128,7 @@ def c_15_1_active_arcs_zero_watermix(model,i,j,t):
     value pyomo.core.base.constraint.Constraint
         Check if arc isn't active then the variable should be zero.
     '''
-    epsilon = 1e-30
+    epsilon = ARCS_EPSILON
 
     return model.x_active_arc_watermix[i,j,t] <= 1 + model.x_water[i,j,t] - epsilon
 
@@ -1573,7 +2163,7 @@ def c_15_2_active_arcs_positive_watermix(model,i,j,t):
         Check if the arc is active then the variable should be one.
     '''
     
-    return model.x_water[i,j,t] <= model.x_active_arc_watermix[i,j,t] * model.BigPenaltyArcs
+    return model.x_water[i,j,t] <= model.x_active_arc_watermix[i,j,t] * model.big_m_arcs[i,j,t]
 
 def add_active_arcs_positive_watermix(model):
     """Sets the constraint to force binary variable to be 1 if active arc: for water mix and pond stability arcs
@@ -1609,7 +2199,7 @@ def c_15_3_active_arcs_zero_pond(model,i,j,t):
     value pyomo.core.base.constraint.Constraint
         Check if arc isn't active then the variable should be zero.
     '''
-    epsilon = 1e-30
+    epsilon = ARCS_EPSILON
 
     return model.x_active_arc_pond[i,j,t] <= 1 + model.x_water[i,j,t] - epsilon
 
@@ -1644,7 +2234,7 @@ def c_15_4_active_arcs_positive_pond(model,i,j,t):
         Check if the arc is active then the variable should be one.
     '''
     
-    return model.x_water[i,j,t] <= model.x_active_arc_pond[i,j,t] * model.BigPenaltyArcs
+    return model.x_water[i,j,t] <= model.x_active_arc_pond[i,j,t] * model.big_m_arcs[i,j,t]
 
 def add_active_arcs_positive_pond(model):
     """Sets the constraint to force binary variable to be 1 if active arc: for water mix stability arcs
@@ -1749,7 +2339,7 @@ def c_17_1_active_ponds_max(model, pond, t):
         Check if pond isn't active then the variable should be zero.
     '''
     water_stored  = model.y_water[pond, t]
-    epsilon = 1e-6
+    epsilon = PONDS_EPSILON
 
     return model.xActivePonds[pond, t] <= 1 + water_stored - epsilon
 
@@ -1786,7 +2376,7 @@ def c_17_1_active_ponds_min(model, pond, t):
     '''
     water_stored  = model.y_water[pond, t]
     
-    return water_stored <= model.xActivePonds[pond, t] * model.BigPenalty
+    return water_stored <= model.xActivePonds[pond, t] * model.big_m_ponds[pond, t]
 
 def add_active_ponds_min (model):
     """Sets the constraint for detect the active ponds lower bound
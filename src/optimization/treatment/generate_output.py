@@ -16,6 +16,8 @@ from array import array
 import math, json
 import pandas as pd
 import pyomo.environ as pe
+from src.optimization.treatment.constraints.constraints import get_contaminant, get_usable_percentage, get_other_cost
+import src.optimization.treatment.preprocess_classes.node_roles as roles
 
 
 def generate_model_output(model, result, df_nodes, df_arcs, parameters):
@@ -85,16 +87,7 @@ def node_type(model, node):
     string
         It represents the node's type.
     """
-    list_sets = [model.initial, model.ending, model.tanks, model.pumps, model.split, model.mix, \
-                 model.process, model.treatment, model.oil_treatment, model.cooling_towers, model.boiler, model.loss_tanks, \
-                 model.ponds]
-    list_types = ["Initial", "Ending", "Tank", "Pump", "Splitter", "Mixer", \
-                  "Process", "Treatment", "Oil Treatment", "Cooling TW", "Boiler", "Loss", \
-                  "Ponds"]
-    for i, s in enumerate(list_sets):
-        if node in s:
-            return list_types[i]
-    return None
+    return model.node_roles.node_type(node)
     
 def extract_contaminants (model, in_out, contaminants_dict, df):
     """This function add the contaminants to the dataframe to complete outpus
@@ -145,7 +138,7 @@ def generate_nodes_output(model, processed_data):
     water_stored, oil_stored = [], []
     for t in model.time_dim:
         water_stored.extend([model.y_water[node, t].value for node in active_nodes])
-        oil_stored.extend([0 if node not in model.oil_nodes else model.y_oil[node, t].value\
+        oil_stored.extend([0 if not model.node_roles.has(node, roles.OIL) else model.y_oil[node, t].value\
             for node in active_nodes])
 
     #endregion]
@@ -233,9 +226,9 @@ def nodes_fluid_in(model, active_nodes):
             min_cap=model.min_capacity[node]
             max_cap=model.max_capacity[node]
 
-            if node in model.initial:
-                node_water_in = model.water_in[node,t]
-                node_oil_in = model.oil_in[node,t]
+            if model.node_roles.has(node, roles.INITIAL):
+                node_water_in = pe.value(model.water_in[node,t])
+                node_oil_in = pe.value(model.oil_in[node,t])
             water_in.append(node_water_in)
             oil_in.append(node_oil_in)
             time_data.append(t)
@@ -247,7 +240,7 @@ def nodes_fluid_in(model, active_nodes):
             for contaminant in model.contaminants:
                 contaminant_data = []
                 
-                if node in model.initial:
+                if model.node_roles.has(node, roles.INITIAL):
                     contaminant_data.append([model.contaminant_in[node, contaminant,t],t,node])
 
                 elif node_water_in > 0:
@@ -257,7 +250,7 @@ def nodes_fluid_in(model, active_nodes):
                                 + sum(model.initial_content_contaminants_tanks.extract_values().values()))==0:
                         contaminant_data.append([0,t,node])
                     else:
-                        node_contaminant = sum([model.x_contaminant[j, node, contaminant,t].value\
+                        node_contaminant = sum([pe.value(get_contaminant(model.x_contaminant, j, node, contaminant, t), exception=False)\
                             *model.x_water[j,node,t].value for j in model.entry[node]])
                         contaminant_data.append([node_contaminant / node_water_in,t,node])
                 else:
@@ -309,7 +302,7 @@ def nodes_fluid_out(model, active_nodes):
                             + sum(model.initial_content_contaminants_tanks.extract_values().values()))==0:
                         contaminant_data.append([0,t,node])
                     else:
-                        node_contaminant = sum([model.x_contaminant[node, j, contaminant,t].value\
+                        node_contaminant = sum([pe.value(get_contaminant(model.x_contaminant, node, j, contaminant, t), exception=False)\
                             * model.x_water[node, j,t].value for j in model.exit[node]])
                         contaminant_data.append([node_contaminant / node_water_out,t,node])
                 else:
@@ -335,9 +328,9 @@ def add_params(model, processed_data, df):
     Pandas Dataframe
         It contains the nodes' data (parameters and model's decision variables)
     """
-    df["Other_costs"] = df.apply(lambda row: sum((model.x_water[i, row.Source, row.Date].value + model.x_oil[i, row.Source, row.Date].value)* pe.value(model.other_cost[i, row.Source, row.Date])\
-                                                    if i in model.oil_nodes else (model.x_water[i, row.Source, row.Date].value)\
-                                                 * pe.value(model.other_cost[i, row.Source, row.Date]) for i in model.entry[row.Source]), axis = 1)
+    df["Other_costs"] = df.apply(lambda row: sum((model.x_water[i, row.Source, row.Date].value + model.x_oil[i, row.Source, row.Date].value)* pe.value(get_other_cost(model, i, row.Source, row.Date))\
+                                                    if model.node_roles.has(i, roles.OIL) else (model.x_water[i, row.Source, row.Date].value)\
+                                                 * pe.value(get_other_cost(model, i, row.Source, row.Date)) for i in model.entry[row.Source]), axis = 1)
     df["Has_Oil"] = df.apply(lambda row: model.node_has_oil[row.Source], axis = 1)
 
     df["Pressure_In"] = df[df["Type"] == "Pump"].apply(lambda row: model.pressure_in[row.Source] ,axis = 1, result_type = 'reduce')
@@ -419,9 +412,9 @@ def generate_arcs_output(model, processed_data, dates):
     time_data = [t for i, j, t in active_arcs]
 
     min_flow = [model.min_flow[i,j] for i,j,t in active_arcs]
-    max_flow = [model.max_flow[i,j] * model.usable_percentage[i,j,t] for i,j,t in active_arcs]
+    max_flow = [model.max_flow[i,j] * pe.value(get_usable_percentage(model, i, j, t)) for i,j,t in active_arcs]
     
-    usable_percentage_available = [model.usable_percentage[i,j,t] for i,j,t in active_arcs]
+    usable_percentage_available = [pe.value(get_usable_percentage(model, i, j, t)) for i,j,t in active_arcs]
 
     water = map(lambda arc: active_water_arcs[arc], active_arcs)
     contaminants = {}
@@ -434,7 +427,7 @@ def generate_arcs_output(model, processed_data, dates):
                     + sum(model.initial_content_contaminants_tanks.extract_values().values()))==0:
                 contaminant_data.append(0)
             else:
-                contaminant_data.append(model.x_contaminant[i,j, contaminant,t].value)
+                contaminant_data.append(pe.value(get_contaminant(model.x_contaminant, i, j, contaminant, t), exception=False))
         
         contaminants[contaminant] = contaminant_data
     
@@ -584,8 +577,22 @@ def generate_output(model, result, parameters, processed_data):
     
     df_nodes, df_arcs = standardize_outputs(df_nodes, df_arcs, model)
 
+    outputs = {'nodes': df_nodes, 'edges': df_arcs, 'summary': df_summary}
+    save_outputs(outputs, parameters)
+    return outputs
+
+
+def save_outputs(outputs, parameters):
+    """Saves the nodes', arcs' and model's output files and the parameters json file.
 
-    df_list = [df_nodes, df_arcs, df_summary]
+    Parameters
+    ----------
+    outputs : dict
+        Outputs of the model (nodes, edges and summary Dataframes).
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
+    """
+    df_list = [outputs['nodes'], outputs['edges'], outputs['summary']]
     paths_list = [parameters["output_nodes_dir"], parameters["output_arcs_dir"], parameters["output_model_dir"]]
 
     for i, df in enumerate(df_list):
@@ -593,7 +600,4 @@ def generate_output(model, result, parameters, processed_data):
 
     # saving parameters json file
     with open(parameters['output_json_dir'], 'w') as f:
-        json.dump(parameters['json_file'], f)
-
-    outputs = {'nodes': df_nodes, 'edges': df_arcs, 'summary': df_summary}
-    return outputs
\ No newline at end of file
+        json.dump(parameters['json_file'], f)
\ No newline at end of file
@@ -14,10 +14,17 @@ This script store the functions to build and run pyomo model
 
 from re import T
 import pyomo.environ as pe
+from pyomo.core.expr.numeric_expr import LinearExpression, NPV_MaxExpression, NPV_MinExpression
+from pyomo.solvers.plugins.solvers.persistent_solver import PersistentSolver
+from pyomo.opt import SolverResults
 import pandas as pd
 import src.optimization.treatment.constraints.constraints as constraints
+import src.optimization.treatment.solvers as solvers
+import src.optimization.treatment.model_cache as model_cache
+from src.optimization.treatment.model_report import get_report
 import datetime as dt
-from src.optimization.treatment.preprocess_data import preprocess_data
+import time
+from src.optimization.treatment.preprocess_data import preprocess_data, get_time_values
 
 def set_sets(model, useful_sets):
     """Defines the useful_sets in the model.
@@ -75,6 +82,8 @@ def set_sets(model, useful_sets):
     model.boiler = pe.Set(within = model.nodes, initialize = useful_sets.boiler_nodes)
     #Define the nodes that will have oil
     model.oil_nodes = pe.Set(within = model.nodes, initialize = useful_sets.oil_nodes)
+    #Roles of every node, checked in constant time by the constraints and the outputs
+    model.node_roles = useful_sets.node_roles
 
     #Contaminants
     model.contaminants = pe.Set(initialize = useful_sets.contaminants)
@@ -83,6 +92,10 @@ def set_sets(model, useful_sets):
     model.arcs = pe.Set(within = model.nodes*model.nodes, initialize = useful_sets.arcs)
     #Valid Arcs with nominal values that must be a subset of the arcs (within is not necessary but is good practice for error checking)
     model.arcs_nominal = pe.Set(within = model.arcs, initialize = useful_sets.arcs_nominal_values)
+    #Nodes and arcs that a contaminated source can reach, by contaminant (the others have concentration 0)
+    model.contaminant_nodes = pe.Set(within = model.nodes*model.contaminants, initialize = useful_sets.contaminant_nodes)
+    model.contaminant_arcs = pe.Set(within = model.arcs*model.contaminants, initialize = useful_sets.contaminant_arcs)
+    model.contaminant_storage = pe.Set(within = model.contaminant_nodes, initialize = [(j, c) for (j, c) in useful_sets.contaminant_nodes if j in useful_sets.tank_nodes or j in useful_sets.pond_nodes])
     #Define arcs after splitter nodes
     model.fixed_splitter_arcs = pe.Set(within = model.nodes*model.nodes, initialize = useful_sets.fixed_splitter_arcs)
     #Define arcs after oil treatment nodes
@@ -100,6 +113,10 @@ def set_sets(model, useful_sets):
     return model
 
 
+#Default value of the nominal values of the arcs (the periods where the attribute does not change)
+def default_nominal_value(model, i, j, t):
+    return model.arc_nominal_value[i, j]
+
 def set_parameters(model, processed_data, useful_sets, attributes_with_time):
     """Defines the model's processed_data parameters in the model.
 
@@ -122,9 +139,17 @@ def set_parameters(model, processed_data, useful_sets, attributes_with_time):
     model.min_flow = pe.Param(model.arcs, initialize=processed_data.arcs_data["MinFlow"].to_dict())
     model.max_flow = pe.Param(model.arcs, initialize=processed_data.arcs_data["MaxFlow"].to_dict()) 
     #This would be opening and closing the gate
-    model.usable_percentage = pe.Param(model.arcs, model.time_dim, initialize=attributes_with_time['arcs_data']["UsablePercentage"].to_dict())
+    #Only the periods where it changes are stored (indexed by the *_periods sets), the other ones take the static
+    #value of the arc. Read them with constraints.get_usable_percentage and constraints.get_other_cost
+    static, overrides = get_time_values(attributes_with_time, "UsablePercentage")
+    model.arc_usable_percentage = pe.Param(model.arcs, initialize=static, mutable=True)
+    model.usable_percentage_periods = pe.Set(within=model.arcs*model.time_dim, initialize=list(overrides))
+    model.usable_percentage = pe.Param(model.usable_percentage_periods, initialize=overrides, mutable=True)
     model.flow_cost = pe.Param(model.arcs, initialize=processed_data.arcs_data["ArcFlowCost"].to_dict())
-    model.other_cost = pe.Param(model.arcs, model.time_dim, initialize=attributes_with_time['arcs_data']['OtherCosts'].to_dict(),within=pe.Any,mutable=True)
+    static, overrides = get_time_values(attributes_with_time, 'OtherCosts')
+    model.arc_other_cost = pe.Param(model.arcs, initialize=static, within=pe.Any, mutable=True)
+    model.other_cost_periods = pe.Set(within=model.arcs*model.time_dim, initialize=list(overrides))
+    model.other_cost = pe.Param(model.other_cost_periods, initialize=overrides, within=pe.Any, mutable=True)
     model.arc_has_oil = pe.Param(model.arcs, initialize=processed_data.arcs_data['HasOil'].to_dict(),within=pe.Any)
     
     model.arc_flag = pe.Param(model.arcs, initialize=processed_data.arcs_data['Recirculation'].to_dict(),within=pe.Any)
@@ -136,7 +161,9 @@ def set_parameters(model, processed_data, useful_sets, attributes_with_time):
     #Splitting oil arcs parameter
     model.fixed_percentage = pe.Param(model.fixed_splitter_arcs, initialize=processed_data.splitter_arcs_data['FixedPercentage'].to_dict(), within=pe.Any)
     #Nominal values per arc
-    model.nominal_values = pe.Param(model.arcs, model.time_dim, initialize=attributes_with_time['arcs_data']["Nominal_Value"].to_dict(), within=pe.Any)
+    static, overrides = get_time_values(attributes_with_time, "Nominal_Value")
+    model.arc_nominal_value = pe.Param(model.arcs, initialize=static, within=pe.Any)
+    model.nominal_values = pe.Param(model.arcs, model.time_dim, initialize=overrides, default=default_nominal_value, within=pe.Any)
 
     #NODES PARAMETERS
     #Nodes that  are connected in and out each node
@@ -149,14 +176,14 @@ def set_parameters(model, processed_data, useful_sets, attributes_with_time):
     model.node_has_oil = pe.Param(model.nodes, initialize=processed_data.nodes_data["HasOil"].to_dict())
     
     #Starting nodes parameters
-    model.water_in = pe.Param(model.initial, model.time_dim, initialize=processed_data.tanks_flow["WaterQty"].to_dict())
-    model.oil_in = pe.Param(model.initial,model.time_dim,  initialize=processed_data.tanks_flow["OilQty"].to_dict())
+    model.water_in = pe.Param(model.initial, model.time_dim, initialize=processed_data.tanks_flow["WaterQty"].to_dict(), mutable=True)
+    model.oil_in = pe.Param(model.initial,model.time_dim,  initialize=processed_data.tanks_flow["OilQty"].to_dict(), mutable=True)
     model.contaminant_in = pe.Param(model.initial,model.contaminants,model.time_dim, initialize=processed_data.initial_nodes_contaminants_data["value"].to_dict(), within=pe.Any)
     model.initial_content_contaminants_tanks = pe.Param(model.tanks,model.contaminants, initialize=processed_data.initial_content_contaminants_tanks["value"].to_dict(), within=pe.Any)
     model.initial_content_contaminants_ponds = pe.Param(model.ponds,model.contaminants, initialize=processed_data.initial_content_contaminants_ponds["value"].to_dict(), within=pe.Any)
 
     #Ending nodes parameters
-    model.ending_demand = pe.Param(model.ending,model.time_dim, initialize=processed_data.terminal_dinamic_capacity["Aditional Total Capacity"].to_dict(), within=pe.Any)
+    model.ending_demand = pe.Param(model.ending,model.time_dim, initialize=processed_data.terminal_dinamic_capacity["Aditional Total Capacity"].to_dict(), within=pe.Any, mutable=True)
 
     #Pump nodes parameters
     model.pressure_in = pe.Param(model.pumps, initialize=processed_data.pumps_nodes_data["PressureIn"].to_dict(),within=pe.Any)
@@ -174,8 +201,17 @@ def set_parameters(model, processed_data, useful_sets, attributes_with_time):
     #Treatment Nodes parameters:
     model.contaminant_removal_rate = pe.Param(model.treatment * model.contaminants, initialize=processed_data.treatment_nodes_contaminants_data['Removal_Percentage'].to_dict(),within=pe.Any)
 
-    #Tanks and Ponds parameters:
-    model.initial_content = pe.Param(model.tanks.union(model.ponds), initialize=processed_data.inital_content, within=pe.Any)
+    #Tanks, Ponds and Initial nodes parameters. The initial nodes only start with content in a rolling horizon
+    #window: the water spilled and the oil held until the end of the previous window (see rolling_horizon.get_state)
+    storage_nodes = model.tanks.union(model.ponds, model.initial)
+    model.initial_content = pe.Param(storage_nodes, initialize={**dict.fromkeys(storage_nodes, 0), **processed_data.inital_content}, within=pe.Any, mutable=True)
+    model.initial_oil_content = pe.Param(storage_nodes, initialize={**dict.fromkeys(storage_nodes, 0), **processed_data.initial_oil_content}, within=pe.Any, mutable=True)
+    #Flows and pond activities of the stability arcs in the period before the first one, only in a rolling horizon window
+    previous_period = processed_data.previous_period or {}
+    model.arcs_previous_flow = pe.Set(within=model.arcs, initialize=list(previous_period.get('x_water', {})))
+    model.previous_flow = pe.Param(model.arcs_previous_flow, initialize=previous_period.get('x_water', {}), mutable=True)
+    model.arcs_previous_pond_activity = pe.Set(within=model.arcs, initialize=list(previous_period.get('x_active_arc_pond', {})))
+    model.previous_pond_activity = pe.Param(model.arcs_previous_pond_activity, initialize=previous_period.get('x_active_arc_pond', {}), mutable=True)
     
     #Pond Nodes Parameters:
     model.pond_average_surface = pe.Param(model.ponds, initialize=processed_data.ponds_nodes_data['avg_area'].to_dict())
@@ -189,11 +225,20 @@ def set_parameters(model, processed_data, useful_sets, attributes_with_time):
     #Penalization of initial storage
     model.BigPenalty=processed_data.nodes_data["MaxCapacity"].max()
     model.BigPenaltyArcs=processed_data.arcs_data["MaxFlow"].max()
+    #Big-M of the pump, pond and stability arc activity constraints (see constraints.update_big_m)
+    model.big_m_pumps = pe.Param(model.pumps, model.time_dim, initialize=0, mutable=True)
+    model.big_m_ponds = pe.Param(model.ponds, model.time_dim, initialize=0, mutable=True)
+    model.big_m_arcs = pe.Param(model.arcs_water_stability.union(model.arcs_water_stability_low_priority, model.arcs_pond_stability),
+                                model.time_dim, initialize=0, mutable=True)
+    model = constraints.update_big_m(model)
 
     return model
 
 def set_variables(model):
-    """Sets the model's variables.
+    """Sets the model's variables. Every variable family is declared only on the index set its constraints and
+    objectives use: the pumps' binaries on the pumps, the nominal deltas on the arcs with nominal value and the
+    contaminant variables only if the model has contaminant balances. The number of variables removed from
+    every family is stored in model.pruned_variables.
 
     Parameters
     ----------
@@ -205,11 +250,15 @@ def set_variables(model):
     Pyomo ConcreteModel
         The optimization model.
     """
+    contaminant_balance = constraints.has_contaminant_balance(model)
+    model.contaminant_variable_arcs = pe.Set(within = model.contaminant_arcs, initialize = model.contaminant_arcs if contaminant_balance else [])
+    model.contaminant_variable_nodes = pe.Set(within = model.contaminant_nodes, initialize = model.contaminant_nodes if contaminant_balance else [])
+
     # let´s define the arc's variables (Quantity to send by arc)
     model.x_water       = pe.Var(model.arcs,model.time_dim,domain=pe.NonNegativeReals)
     model.x_oil         = pe.Var(model.oil_arcs,model.time_dim,domain=pe.NonNegativeReals)
-    model.x_contaminant = pe.Var(model.arcs * model.contaminants,model.time_dim, domain=pe.NonNegativeReals)
-    model.x_water_delta = pe.Var(model.arcs, model.time_dim, domain=pe.NonNegativeReals)
+    model.x_contaminant = pe.Var(model.contaminant_variable_arcs,model.time_dim, domain=pe.NonNegativeReals)
+    model.x_water_delta = pe.Var(model.arcs_nominal, model.time_dim, domain=pe.NonNegativeReals)
     model.x_active_arc_watermix  = pe.Var(model.arcs_water_stability.union(model.arcs_water_stability_low_priority), model.time_dim, domain=pe.Binary) #binary variables for arcs of water mix
     model.x_active_arc_pond  = pe.Var(model.arcs_pond_stability, model.time_dim, domain=pe.Binary) #binary variables for arcs of pond stability
 
@@ -224,11 +273,96 @@ def set_variables(model):
     model.y_water       = pe.Var(model.nodes, model.time_dim, domain=pe.NonNegativeReals)
     model.y_oil         = pe.Var(model.oil_nodes, model.time_dim, domain=pe.NonNegativeReals)
     model.y_elec_amount = pe.Var(model.pumps, model.time_dim, domain=pe.NonNegativeReals)
-    model.y_contaminant = pe.Var(model.nodes,model.contaminants,model.time_dim, domain=pe.NonNegativeReals)
-    model.xActivePump   = pe.Var(model.nodes, model.time_dim, domain = pe.Binary)
+    model.y_contaminant = pe.Var(model.contaminant_variable_nodes,model.time_dim, domain=pe.NonNegativeReals)
+    model.xActivePump   = pe.Var(model.pumps, model.time_dim, domain = pe.Binary)
     model.xActivePonds  = pe.Var(model.ponds, model.time_dim, domain = pe.Binary)
+
+    #variables that would be declared on the whole arcs and nodes sets
+    periods = len(model.time_dim)
+    model.pruned_variables = {'x_contaminant': (len(model.contaminant_arcs) - len(model.contaminant_variable_arcs)) * periods,
+                              'x_water_delta': (len(model.arcs) - len(model.arcs_nominal)) * periods,
+                              'y_contaminant': (len(model.contaminant_nodes) - len(model.contaminant_variable_nodes)) * periods,
+                              'xActivePump': (len(model.nodes) - len(model.pumps)) * periods}
+
+    # mass flow formulation of the contaminants: mass by arc and mass stored in tanks and ponds
+    if getattr(model, 'contaminant_formulation', 'concentration') == 'mass_flow':
+        model.contaminant_variable_storage = pe.Set(within = model.contaminant_storage, initialize = model.contaminant_storage if contaminant_balance else [])
+        model.m_contaminant = pe.Var(model.contaminant_variable_arcs, model.time_dim, domain=pe.NonNegativeReals)
+        model.s_contaminant = pe.Var(model.contaminant_variable_storage, model.time_dim, domain=pe.NonNegativeReals)
+        model.pruned_variables['m_contaminant'] = model.pruned_variables['x_contaminant']
+        model.pruned_variables['s_contaminant'] = (len(model.contaminant_storage) - len(model.contaminant_variable_storage)) * periods
     return model
 
+def set_expressions(model):
+    """Sets the model's shared expressions: the water and oil inflow and outflow of
+    every node in every period and the model-wide balance totals. They are built once 
+    and reused by the constraints.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    model = constraints.add_flow_expressions(model)
+    model = constraints.add_balance_totals(model)
+    return model
+
+def linear_expression(coefficients, variables):
+    """Returns the linear expression sum(coefficients[k] * variables[k]), built at once from the lists
+    instead of adding the terms one by one."""
+    return LinearExpression(linear_coefs=list(coefficients), linear_vars=list(variables))
+
+def get_objective_indexes(model):
+    """Returns the (arc, period) and (node, period) index lists used by the objective functions. They are
+    computed once and stored in the model.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+
+    Returns
+    -------
+    dict(string, list)
+        The index lists.
+    """
+    if getattr(model, 'objective_indexes', None) is None:
+        ending = set(model.ending)
+        times = list(model.time_dim)
+        model.objective_indexes = {
+            'arcs_not_from_ending': [(i, j, t) for (i, j) in model.arcs if i not in ending for t in times],
+            'oil_arcs_not_from_ending': [(i, j, t) for (i, j) in model.oil_arcs if i not in ending for t in times],
+            'arcs_to_ending': [(i, j, t) for (i, j) in model.arcs if j in ending for t in times],
+            'pumps': [(i, t) for i in model.pumps for t in times]}
+    return model.objective_indexes
+
+def get_objective_expression(model, obj_f):
+    """Returns the expression of an objective function. It is compiled once in a named expression of the
+    model (objective_<function name>) that is reused by the objective and the bound constraint of its
+    hierarchical stage, and by the next solves of a cached model (the costs are mutable parameters).
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    obj_f : function
+        The objective function.
+
+    Returns
+    -------
+    Pyomo Expression
+        The named expression of the objective function.
+    """
+    name = 'objective_' + obj_f.__name__
+    if model.component(name) is None:
+        model.add_component(name, pe.Expression(expr=obj_f(model)))
+    return model.component(name)
+
 def penalty_initial_nodes(model): 
     storage_penalty= sum(model.y_water[i,t] * model.BigPenalty\
         for i in model.initial\
@@ -251,8 +385,8 @@ def calculate_recirculation(model):
     double
         Recirculation value
     '''
-    recirculation_function = sum(model.x_water[i,j,t] for (i,j) in model.flags_arcs\
-        for t in model.time_dim)
+    variables = [model.x_water[i,j,t] for (i,j) in model.flags_arcs for t in model.time_dim]
+    recirculation_function = linear_expression([1] * len(variables), variables)
 
     return recirculation_function
 
@@ -270,8 +404,8 @@ def calculate_delta_water_nominal(model):
     double
         Delta of water between nominal value and water flow
     '''
-    nominal_function = sum(model.x_water_delta[i,j,t] for (i,j) in model.arcs_nominal\
-        for t in model.time_dim)
+    variables = [model.x_water_delta[i,j,t] for (i,j) in model.arcs_nominal for t in model.time_dim]
+    nominal_function = linear_expression([1] * len(variables), variables)
 
     return nominal_function
 
@@ -294,26 +428,16 @@ def calculate_cost(model):
         the model's cost
 
     """
-    electrical_costs = sum(model.y_elec_amount[i,t]*model.energy_cost for i in model.pumps\
-        for t in model.time_dim)
-    
-    flow_costs_water = sum(model.x_water[i,j,t] * model.flow_cost[i,j]\
-        for (i, j) in model.arcs if i not in list(model.ending)\
-        for t in model.time_dim)
-    
-    flow_costs_oil = sum((model.x_oil[i,j,t]) * model.flow_cost[i,j]\
-        for (i, j) in model.oil_arcs if i not in list(model.ending)\
-        for t in model.time_dim)
-    
-    other_costs_water = sum((model.x_water[i,j,t]) * model.other_cost[i,j,t]\
-        for (i, j) in model.arcs if i not in list(model.ending)\
-            for t in model.time_dim)
-    
-    other_costs_oil = sum((model.x_oil[i,j,t]) * model.other_cost[i,j,t]\
-        for (i, j) in model.oil_arcs if i not in list(model.ending)\
-            for t in model.time_dim)
-    
-    return electrical_costs + flow_costs_water + flow_costs_oil + other_costs_water + other_costs_oil
+    indexes = get_objective_indexes(model)
+    coefficients = [model.energy_cost] * len(indexes['pumps'])
+    variables = [model.y_elec_amount[i,t] for (i,t) in indexes['pumps']]
+
+    #flow and other costs of the water and oil of the arcs that do not start in an ending node
+    for variable, arcs in [(model.x_water, indexes['arcs_not_from_ending']), (model.x_oil, indexes['oil_arcs_not_from_ending'])]:
+        coefficients += [model.flow_cost[i,j] + constraints.get_other_cost(model, i, j, t) for (i,j,t) in arcs]
+        variables += [variable[i,j,t] for (i,j,t) in arcs]
+
+    return linear_expression(coefficients, variables)
 
 
 def calculate_supply_demand_flow(model):
@@ -336,13 +460,12 @@ def calculate_supply_demand_flow(model):
         The sum defined
 
     """
-    chosen_initial_nodes_flow = sum(model.y_water[i,t] for i in model.initial_min\
-        for t in model.time_dim)
+    chosen_ending_nodes_flow = [model.y_water[i,t] for i in model.ending_max for t in model.time_dim]
 
-    chosen_ending_nodes_flow = sum(model.y_water[i,t] for i in model.ending_max\
-        for t in model.time_dim)
+    chosen_initial_nodes_flow = [model.y_water[i,t] for i in model.initial_min for t in model.time_dim]
 
-    flow = chosen_ending_nodes_flow  - chosen_initial_nodes_flow
+    flow = linear_expression([1] * len(chosen_ending_nodes_flow) + [-1] * len(chosen_initial_nodes_flow),
+                             chosen_ending_nodes_flow + chosen_initial_nodes_flow)
     return flow 
 
 
@@ -363,8 +486,8 @@ def calculate_energy_cost(model):
         the model's electricity cost
  
     """
-    electrical_costs = sum(model.y_elec_amount[i,t]*model.energy_cost for i in model.pumps\
-        for t in model.time_dim)
+    pumps = get_objective_indexes(model)['pumps']
+    electrical_costs = linear_expression([model.energy_cost] * len(pumps), [model.y_elec_amount[i,t] for (i,t) in pumps])
     
     return electrical_costs
 
@@ -384,9 +507,8 @@ def calculate_end_benefit(model):
     double
         End benefit of the model
     '''
-    end_benefit= sum((model.x_water[i,j,t])\
-        for (i, j) in model.arcs if j in list(model.ending)\
-            for t in model.time_dim)
+    arcs = get_objective_indexes(model)['arcs_to_ending']
+    end_benefit = linear_expression([1] * len(arcs), [model.x_water[i,j,t] for (i,j,t) in arcs])
     
 
     return end_benefit
@@ -413,9 +535,9 @@ def calculate_water_stability(model):
     double
         Sum of the slacks variables and binary variables
     """
-    sum_slacks = sum((model.slack_positive_watermix[i,j,t]) + (model.slack_negative_watermix[i,j,t]) + (model.x_active_arc_watermix[i,j,t])\
-        for (i, j) in model.arcs_water_stability\
-            for t in model.time_dim)
+    variables = [variable[i,j,t] for (i, j) in model.arcs_water_stability for t in model.time_dim\
+        for variable in (model.slack_positive_watermix, model.slack_negative_watermix, model.x_active_arc_watermix)]
+    sum_slacks = linear_expression([1] * len(variables), variables)
 
     return sum_slacks
 
@@ -440,9 +562,9 @@ def calculate_water_stability_low_priority(model):
     double
         Sum of the slacks variables and binary variables
     """
-    sum_slacks = sum((model.slack_positive_watermix[i,j,t]) + (model.slack_negative_watermix[i,j,t]) + (model.x_active_arc_watermix[i,j,t])\
-        for (i, j) in model.arcs_water_stability_low_priority\
-            for t in model.time_dim)
+    variables = [variable[i,j,t] for (i, j) in model.arcs_water_stability_low_priority for t in model.time_dim\
+        for variable in (model.slack_positive_watermix, model.slack_negative_watermix, model.x_active_arc_watermix)]
+    sum_slacks = linear_expression([1] * len(variables), variables)
 
     return sum_slacks
 
@@ -467,95 +589,192 @@ def calculate_pond_stability(model):
     double
         Sum of the slacks variables and binary variables
     """
-    sum_slacks_stability = sum((model.slack_positive_pond[i,j,t]) + (model.slack_negative_pond[i,j,t]) + (model.x_active_arc_pond[i,j,t])\
-        for (i, j) in model.arcs_pond_stability\
-            for t in model.time_dim)
+    variables = [variable[i,j,t] for (i, j) in model.arcs_pond_stability for t in model.time_dim\
+        for variable in (model.slack_positive_pond, model.slack_negative_pond, model.x_active_arc_pond)]
+    sum_slacks_stability = linear_expression([1] * len(variables), variables)
     
     return sum_slacks_stability
 
-def set_objective_function(model, parameters):
-    """Sets the model's objective function.
+def get_objective_functions(parameters):
+    """Returns the ordered objective functions of the hierarchical optimization for the
+    objective configured in the parameters.
 
     Parameters
     ----------
-    model : Pyomo ConcreteModel
-        The optimization model.
     parameters : dictionary(string, string)
         It has stored all the not-model's parameters.
 
     Returns
     -------
-    Pyomo ConcreteModel
-        The optimization model.
+    list((function, Pyomo sense))
+        The objective functions and their senses, from the most to the least important.
     """
-    model.has_initial_solution = False
     if parameters["object_funct"] == "downstream_minimize_costs":
-         model = hierarchical_optimization(model, parameters, [(calculate_supply_demand_flow, pe.maximize),
-                                                                (calculate_delta_water_nominal, pe.minimize),
-                                                                (calculate_cost, pe.minimize),
-                                                                (calculate_recirculation, pe.maximize)])
+        objective_functions = [(calculate_supply_demand_flow, pe.maximize),
+                               (calculate_delta_water_nominal, pe.minimize),
+                               (calculate_cost, pe.minimize),
+                               (calculate_recirculation, pe.maximize)]
     elif parameters["object_funct"] == "downstream_maximize_recirculation":
-         model = hierarchical_optimization(model, parameters, [(calculate_supply_demand_flow, pe.maximize),
-                                                               (calculate_delta_water_nominal, pe.minimize),
-                                                                (calculate_recirculation, pe.maximize),
-                                                                (calculate_cost, pe.minimize)])
+        objective_functions = [(calculate_supply_demand_flow, pe.maximize),
+                               (calculate_delta_water_nominal, pe.minimize),
+                               (calculate_recirculation, pe.maximize),
+                               (calculate_cost, pe.minimize)]
     elif parameters["object_funct"] == "upstream_minimize_electrical_consumption":
-        model = hierarchical_optimization(model, parameters, [(calculate_end_benefit, pe.maximize),
-                                                            (calculate_energy_cost, pe.minimize),
-                                                            (calculate_cost, pe.minimize)])
+        objective_functions = [(calculate_end_benefit, pe.maximize),
+                               (calculate_energy_cost, pe.minimize),
+                               (calculate_cost, pe.minimize)]
     
     #PERMIAN
     elif parameters["object_funct"] == "upstream_supply_demand_cost":
-        model = hierarchical_optimization(model, parameters, [(calculate_supply_demand_flow, pe.maximize),
-                                                            (calculate_recirculation, pe.maximize),
-                                                            (calculate_cost, pe.minimize)])
+        objective_functions = [(calculate_supply_demand_flow, pe.maximize),
+                               (calculate_recirculation, pe.maximize),
+                               (calculate_cost, pe.minimize)]
     
     elif parameters["object_funct"] == "upstream_supply_demand_cost_water_mix_stabilized":
-        model = hierarchical_optimization(model, parameters, [(calculate_supply_demand_flow, pe.maximize),
-                                                            (calculate_recirculation, pe.maximize),
-                                                            (calculate_water_stability, pe.minimize),
-                                                            (calculate_cost, pe.minimize),
-                                                            ])
+        objective_functions = [(calculate_supply_demand_flow, pe.maximize),
+                               (calculate_recirculation, pe.maximize),
+                               (calculate_water_stability, pe.minimize),
+                               (calculate_cost, pe.minimize),
+                               ]
         
     elif parameters["object_funct"] == "upstream_supply_demand_cost_water_mix_stabilized_inverted":
-        model = hierarchical_optimization(model, parameters, [(calculate_supply_demand_flow, pe.maximize),
-                                                            (calculate_water_stability, pe.minimize),
-                                                            (calculate_recirculation, pe.maximize),
-                                                            (calculate_cost, pe.minimize),
-                                                            ])
+        objective_functions = [(calculate_supply_demand_flow, pe.maximize),
+                               (calculate_water_stability, pe.minimize),
+                               (calculate_recirculation, pe.maximize),
+                               (calculate_cost, pe.minimize),
+                               ]
 
     elif parameters["object_funct"] == "upstream_supply_demand_cost_fully_stabilized":
-        model = hierarchical_optimization(model, parameters, [(calculate_supply_demand_flow, pe.maximize),
-                                                            (calculate_recirculation, pe.maximize),
-                                                            (calculate_water_stability, pe.minimize),
-                                                            (calculate_pond_stability, pe.minimize),
-                                                            (calculate_cost, pe.minimize),
-                                                            (calculate_water_stability_low_priority, pe.minimize),
-                                                            ])
+        objective_functions = [(calculate_supply_demand_flow, pe.maximize),
+                               (calculate_recirculation, pe.maximize),
+                               (calculate_water_stability, pe.minimize),
+                               (calculate_pond_stability, pe.minimize),
+                               (calculate_cost, pe.minimize),
+                               (calculate_water_stability_low_priority, pe.minimize),
+                               ]
         
     elif parameters["object_funct"] == "upstream_supply_demand_cost_fully_stabilized_inverted":
-        model = hierarchical_optimization(model, parameters, [(calculate_supply_demand_flow, pe.maximize),
-                                                            (calculate_water_stability, pe.minimize),
-                                                            (calculate_recirculation, pe.maximize),
-                                                            (calculate_pond_stability, pe.minimize),
-                                                            (calculate_cost, pe.minimize),
-                                                            (calculate_water_stability_low_priority, pe.minimize),
-                                                            ])
+        objective_functions = [(calculate_supply_demand_flow, pe.maximize),
+                               (calculate_water_stability, pe.minimize),
+                               (calculate_recirculation, pe.maximize),
+                               (calculate_pond_stability, pe.minimize),
+                               (calculate_cost, pe.minimize),
+                               (calculate_water_stability_low_priority, pe.minimize),
+                               ]
 
     # This elif does the same function as upstream_supply_demand_cost. It was supposed to be another function than calculate_supply_demand_flow but because of an issue of the UX team, we put that one (hot_fix)
     elif parameters["object_funct"] == "upstream_maximize_reuse" or parameters["object_funct"] == "upstream_minimize_costs":
-        model = hierarchical_optimization(model, parameters, [(calculate_supply_demand_flow, pe.maximize),
-                                                            (calculate_cost, pe.minimize)])
+        objective_functions = [(calculate_supply_demand_flow, pe.maximize),
+                               (calculate_cost, pe.minimize)]
     else:
         raise ValueError(f"Objective function '{parameters['object_funct']}' is not a valid optimization function for treatment model")
 
+    return objective_functions
+
+
+def set_objective_function(model, parameters):
+    """Sets the model's objective function.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    model = clear_hierarchical_stages(model)
+    model = hierarchical_optimization(model, parameters, get_objective_functions(parameters))
+
     return model
 
 
+def clear_hierarchical_stages(model):
+    """Removes the objective function and the bounds of the stages of a previous hierarchical optimization,
+    so a cached model can be solved again.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    for component in list(model.component_objects((pe.Objective, pe.Constraint))):
+        #the bound constraints are the ones of the models cached before the stages had a value variable
+        if component.name == 'obj_function' or component.name.startswith('lower_bound_constraint_'):
+            model.del_component(component)
+    for variable in model.component_objects(pe.Var):
+        if variable.name.startswith('value_'):
+            variable.setlb(None)
+            variable.setub(None)
+    return model
+
+def get_stage_variable(model, obj_f, solver=None):
+    """Returns the variable with the value of an objective function (value_<function name>). It is defined
+    once by an equality row with the objective expression, so the bound of a solved hierarchical stage is a
+    bound of the variable instead of a new row with the whole expression.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    obj_f : function
+        The objective function.
+    solver : Pyomo Solver, optional
+        The solver of the stage. A legacy persistent solver gets the new variable and row.
+
+    Returns
+    -------
+    Pyomo Var
+        The variable of the objective function value.
+    """
+    name = 'value_' + obj_f.__name__
+    if model.component(name) is None:
+        model.add_component(name, pe.Var(domain=pe.Reals))
+        model.add_component(name + '_definition', pe.Constraint(expr=model.component(name) == get_objective_expression(model, obj_f)))
+        if isinstance(solver, PersistentSolver):
+            solver.add_var(model.component(name))
+            solver.add_constraint(model.component(name + '_definition'))
+    return model.component(name)
+
+def set_hierarchical_relaxation(model, percentage):
+    """Changes the relaxation of the bounds of the solved hierarchical stages (percentage_hierarchical_optimization).
+    The bounds follow the mutable parameter, so the model can be solved again without rebuilding them.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    percentage : float
+        The fraction of the optimal value of every stage kept in the following ones.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    if model.component('percentage_hierarchical_optimization') is None:
+        model.percentage_hierarchical_optimization = pe.Param(initialize=percentage, mutable=True, within=pe.Reals)
+    else:
+        model.percentage_hierarchical_optimization.set_value(percentage)
+    return model
+
 def hierarchical_optimization(model, parameters, objective_functions):
     objective_function_number = 1
+    model.stages = []
+    model = set_hierarchical_relaxation(model, parameters["percentage_hierarchical_optimization"])
     for obj_f, sense in objective_functions[:-1]:
-        model.obj_function = pe.Objective(sense=sense, rule=obj_f)
+        expression = get_objective_expression(model, obj_f)
+        model.obj_function = pe.Objective(sense=sense, expr=expression)
+        model.obj_function_name = obj_f.__name__
         print("      Solving the objective function number " + str(objective_function_number))
         solver, result = optimize(model, parameters)
         print(f"        Solver status: {result.solver.status}")
@@ -563,18 +782,21 @@ def hierarchical_optimization(model, parameters, objective_functions):
         print(f"Solution count: {len(model.solutions)}")
         if ((result.solver.status==pe.SolverStatus.ok) and (result.solver.termination_condition==pe.TerminationCondition.optimal))\
             or ((result.solver.status==pe.SolverStatus.aborted) and (result.solver.termination_condition==pe.TerminationCondition.maxTimeLimit) and (len(model.solutions)>0)): #if the optimization is aborted because of the timelimit set, we still keep the last result obtained by Gurobi, if any
-            percentage = parameters["percentage_hierarchical_optimization"]
-            bound = pe.value(obj_f(model))
+            bound = pe.value(expression)
             print("        Optimal value: " + str(bound))
             model.has_initial_solution = True
+            value = get_stage_variable(model, obj_f, solver)
+            #the relaxed bound follows the mutable percentage_hierarchical_optimization
+            percentage = model.percentage_hierarchical_optimization
             if sense==pe.minimize:
-                constraint = pe.Constraint(rule = lambda m: obj_f(m)<= max(bound*percentage, bound*(2-percentage)))
-                print("        New constraint: " + obj_f.__name__ + " " + str(sense) + ": should be less than or equal to " + str(max(bound*percentage, bound*(2-percentage))))
+                value.setub(NPV_MaxExpression((bound*percentage, bound*(2-percentage))))
+                print("        New bound: " + obj_f.__name__ + " " + str(sense) + ": should be less than or equal to " + str(pe.value(value.ub)))
             if sense==pe.maximize:
-                constraint = pe.Constraint(rule = lambda m: obj_f(m)>= min(bound*percentage, bound*(2-percentage)))
-                print("        New constraint: " + obj_f.__name__ + " " + str(sense) + ": should be greater than or equal to " + str(min(bound*percentage, bound*(2-percentage))))
-           
-            setattr(model, "lower_bound_constraint_" + str(objective_function_number), constraint)
+                value.setlb(NPV_MinExpression((bound*percentage, bound*(2-percentage))))
+                print("        New bound: " + obj_f.__name__ + " " + str(sense) + ": should be greater than or equal to " + str(pe.value(value.lb)))
+            if isinstance(solver, PersistentSolver):
+                #APPSI solvers find the new bounds by themselves, the legacy persistent ones need them to be updated
+                solver.update_var(value)
         else:
             print("         An error ocurred while solving the objective function number " + str(objective_function_number))
             break
@@ -582,7 +804,8 @@ def hierarchical_optimization(model, parameters, objective_functions):
    
     print("Solving the LAST objective function!")
     last_obj_f, sense = objective_functions[-1]
-    model.obj_function = pe.Objective(sense = sense, rule = last_obj_f)
+    model.obj_function = pe.Objective(sense = sense, expr = get_objective_expression(model, last_obj_f))
+    model.obj_function_name = last_obj_f.__name__
    
     return model
 
@@ -608,47 +831,122 @@ def set_constraints(model):
     Pyomo ConcreteModel
         The optimization model.
     """
+    constraint_families = [constraints.add_nodes_capacity,
+                           constraints.add_arcs_capacity,
+                           constraints.add_elect_cost,
+                           constraints.add_water_flow_balance,
+                           constraints.add_oil_flow_balance,
+                           constraints.add_contaminant_flow_balance,
+                           constraints.add_storing_water_oil_proportion,
+                           constraints.add_water_stability,
+                           constraints.add_pond_stability,
+                           constraints.add_active_arcs_zero_watermix, #constraint to force binary to 0 if not active arc
+                           constraints.add_active_arcs_positive_watermix, #constraint to force binary to 1 if active arc
+                           constraints.add_active_arcs_zero_pond, #constraint to force binary to 0 if not active arc
+                           constraints.add_active_arcs_positive_pond, #constraint to force binary to 1 if active arc
+                           constraints.add_fixed_splitter_values,
+                           constraints.add_fixed_treatment_values,
+                           constraints.add_pond_evaporation,
+                           constraints.add_initial_nodes_flow_balance,
+                           constraints.add_initial_ending_nodes_spill,
+                           constraints.add_demand_ending_nodes,
+                           constraints.add_active_pumps_max,
+                           constraints.add_active_pumps_min,
+                           constraints.add_positive_energy,
+                           constraints.add_linear_abs_nominal_error,
+                           constraints.add_active_ponds_max,
+                           constraints.add_active_ponds_min]
+
+    report = get_report(model)
+    for add_constraints in constraint_families:
+        with report.span(add_constraints.__name__, model):
+            model = add_constraints(model)
+    return model
 
-    model = constraints.add_nodes_capacity(model)
-    model = constraints.add_arcs_capacity(model)
 
-    model = constraints.add_elect_cost(model)
+def get_persistent_solver(model, parameters):
+    """Returns the persistent solver of the model, creating it on the first call.
+    The solver is chosen with the 'persistent_solver' key of the parameters json file:
+    an APPSI solver (e.g. 'appsi_highs') or a legacy persistent one (e.g. 'gurobi_persistent').
 
-    model = constraints.add_water_flow_balance(model)
-    model = constraints.add_oil_flow_balance(model)
-    model = constraints.add_contaminant_flow_balance(model)
-    
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
 
-    model = constraints.add_storing_water_oil_proportion(model)
+    Returns
+    -------
+    Pyomo Solver
+        The persistent solver with the model loaded.
+    """
+    if getattr(model, 'persistent_solver', None) is None:
+        solver = solvers.create_solver(parameters, parameters["json_file"]["persistent_solver"], persistent=True)
+        if isinstance(solver, PersistentSolver):
+            solver.set_instance(model)
+        model.persistent_solver = solver
+    return model.persistent_solver
 
-    model = constraints.add_water_stability(model)
-    model = constraints.add_pond_stability(model)
-    model = constraints.add_active_arcs_zero_watermix(model) #constraint to force binary to 0 if not active arc
-    model = constraints.add_active_arcs_positive_watermix(model) #constraint to force binary to 1 if active arc
-    model = constraints.add_active_arcs_zero_pond(model) #constraint to force binary to 0 if not active arc
-    model = constraints.add_active_arcs_positive_pond(model) #constraint to force binary to 1 if active arc
+def optimize_persistent(model, parameters):
+    """Optimizates the model with a persistent solver. The model is loaded in the solver only once:
+    between the hierarchical stages just the objective function and the new bound constraints change.
 
-    model = constraints.add_fixed_splitter_values(model)
-    model = constraints.add_fixed_treatment_values(model)
-    model = constraints.add_pond_evaporation(model)
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
 
-    model = constraints.add_initial_nodes_flow_balance(model)
-    model = constraints.add_initial_ending_nodes_spill(model)
-    model = constraints.add_demand_ending_nodes(model)
+    Returns
+    -------
+    Pyomo Solver
+        The persistent solver.
+    Pyomo Results Object
+        The optimization results (it has the model termination conditions).
+    """
+    solver = get_persistent_solver(model, parameters)
 
-    model = constraints.add_active_pumps_max(model)    
-    model = constraints.add_active_pumps_min(model)
-    model = constraints.add_positive_energy(model)
+    if isinstance(solver, PersistentSolver):
+        solver.set_objective(model.obj_function)
+    #APPSI solvers detect the changes of the model (new objective, new constraints) by themselves
+    result = solvers.solve(solver, model, parameters, parameters["json_file"]["persistent_solver"])
 
-    model = constraints.add_linear_abs_nominal_error (model)
+    return solver, result
 
-    model = constraints.add_active_ponds_max(model)    
-    model = constraints.add_active_ponds_min(model)
-    return model
+def record_stage(model, result, solve_time, solver=None):
+    """Stores the summary of the solved hierarchical stage in model.stages.
 
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    result : Pyomo Results Object
+        The optimization results of the stage.
+    solve_time : float
+        Seconds spent writing, solving and loading the stage.
+    solver : Pyomo Solver, optional
+        The solver of the stage, to get its branch and bound node count.
+    """
+    try:
+        value = pe.value(model.obj_function)
+    except ValueError: #no solution was loaded
+        value = None
+    if not hasattr(model, 'stages'):
+        model.stages = []
+    model.stages.append({'stage': len(model.stages) + 1,
+                         'objective': getattr(model, 'obj_function_name', model.obj_function.name),
+                         'status': str(result.solver.status),
+                         'termination_condition': str(result.solver.termination_condition),
+                         'solve_time': solve_time,
+                         'objective_value': value,
+                         'gap': solvers.get_gap(result),
+                         'nodes': solvers.get_node_count(solver, result)})
 
 def optimize(model, parameters):
-    """Optimizates the model with Gurobi Solver.
+    """Optimizates the model with the solver configured in the parameters json file ('solver' key,
+    Gurobi by default), or with a persistent solver if the file has the 'persistent_solver' key.
 
     Parameters
     ----------
@@ -659,26 +957,110 @@ def optimize(model, parameters):
 
     Returns
     -------
-    Pyomo SolverFactory('gurobi')
-        The factory where the solver solved the problem.
+    Pyomo Solver
+        The solver that solved the problem.
     Pyomo Results Object
         The optimization results (it has the model termination conditions).
     """
-    solver = pe.SolverFactory('gurobi')
-
-    #The string that we use in the options is dependent on the solver used. For instance, if Gurobi does not have a NonConvex option, Pyomo will not say anything, but the solver will fail.
-    solver.options['NonConvex'] = 2
-    solver.options['TimeLimit'] = parameters["json_file"]["gurobi_time_limit"] #in seconds
-    solver.options['CSAppName'] = parameters['json_file']['run_name'] #allow Gurobi Cluster Manager to retrieve the run name
+    stage_number = len(getattr(model, 'stages', [])) + 1
+    stage_name = 'stage_' + str(stage_number) + '_' + getattr(model, 'obj_function_name', model.obj_function.name)
+    with get_report(model).span(stage_name, model) as span:
+        tik = time.time()
+        if parameters["json_file"].get("persistent_solver"):
+            solver, result = optimize_persistent(model, parameters)
+        else:
+            solver = solvers.create_solver(parameters)
+            result = solvers.solve(solver, model, parameters)
+        record_stage(model, result, time.time() - tik, solver)
+        #the solver time is only reported by some solvers, the rest of the stage is writing and loading the model
+        span['solver_time'] = solvers.get_solver_time(result)
+        if span['solver_time'] is not None:
+            span['write_load_time'] = model.stages[-1]['solve_time'] - span['solver_time']
 
-    result = solver.solve(model, 
-                          tee=False, #print the output of the solver in the terminal, which can be also found in the log of Gurobi Cluster Manager
-                          logfile=parameters['solver_log'], report_timing=True, warmstart = model.has_initial_solution)
- 
     return solver, result
 
-def make_model(processed_data, useful_sets, parameters,attributes_with_time):
-    """Generates and optimizes the optimization model.
+def build_model(processed_data, useful_sets, attributes_with_time, contaminant_formulation='concentration', big_m='tight', with_constraints=True):
+    """Generates the optimization model without objective function.
+
+    Parameters
+    ----------
+    processed_data : ProcessedData
+        It has all the model's processed data.
+    useful_sets : UsefulSets
+        It has all the model's sets. 
+    attributes_with_time: Dictionary(string, pd.Dataframe)
+        Time dependent attributes of nodes and arcs.
+    contaminant_formulation: string, optional
+        'concentration' (bilinear balances of the concentration by arc) or 'mass_flow' (linear balances
+        of the contaminant mass by arc, only the outlet concentrations are bilinear).
+    big_m: string, optional
+        'tight' (big-M of every pump, pond and stability arc from its capacities) or 'global' (the maximum
+        node capacity and arc flow of the network).
+    with_constraints: boolean, optional
+        If False, the constraints are not created (e.g. the model only receives a solution found outside Pyomo).
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    print('        ['+str(dt.datetime.now())+'] Creating ConcreteModel...')
+    model = pe.ConcreteModel("Dummy_Ocelote")
+    model.has_initial_solution = False
+    model.contaminant_formulation = contaminant_formulation
+    model.big_m_method = big_m
+    report = get_report(model)
+    print('        ['+str(dt.datetime.now())+'] Creating sets...')
+    with report.span('set_sets', model):
+        model = set_sets(model, useful_sets)
+    print('        ['+str(dt.datetime.now())+'] Creating parameters...')
+    with report.span('set_parameters', model):
+        model = set_parameters(model, processed_data, useful_sets, attributes_with_time)
+    print('        ['+str(dt.datetime.now())+'] Creating Variables...')
+    with report.span('set_variables', model) as span:
+        model = set_variables(model)
+        span['pruned_variables'] = model.pruned_variables
+    print('        ['+str(dt.datetime.now())+'] Variables not declared: '+', '.join(f'{name} {removed}' for name, removed in model.pruned_variables.items()))
+    print('        ['+str(dt.datetime.now())+'] Creating Expressions...')
+    with report.span('set_expressions', model):
+        model = set_expressions(model)
+    if with_constraints:
+        print('        ['+str(dt.datetime.now())+'] Creating Constraints...')
+        model = set_constraints(model)
+    return model
+
+def get_contaminant_formulation(parameters):
+    """Returns the contaminant formulation of the parameters json file ('contaminant_formulation' key):
+    'concentration' (default) or 'mass_flow'."""
+    contaminant_formulation = parameters["json_file"].get("contaminant_formulation", "concentration")
+    if contaminant_formulation not in ('concentration', 'mass_flow'):
+        raise ValueError(f"Unknown contaminant formulation '{contaminant_formulation}'. Use 'concentration' or 'mass_flow'")
+    return contaminant_formulation
+
+def get_big_m(parameters):
+    """Returns the big-M method of the parameters json file ('big_m' key): 'tight' (default) or 'global'."""
+    big_m = parameters["json_file"].get("big_m", "tight")
+    if big_m not in ('tight', 'global'):
+        raise ValueError(f"Unknown big-M method '{big_m}'. Use 'tight' or 'global'")
+    return big_m
+
+def get_compiler(parameters):
+    """Returns the model compiler of the parameters json file ('compiler' key): 'pyomo' (default) or 'matrix'."""
+    compiler = parameters["json_file"].get("compiler", "pyomo")
+    if compiler not in ('pyomo', 'matrix'):
+        raise ValueError(f"Unknown compiler '{compiler}'. Use 'pyomo' or 'matrix'")
+    return compiler
+
+#Solver status and termination condition of every scipy milp status code (the rest are errors)
+MATRIX_STATUS = {0: (pe.SolverStatus.ok, pe.TerminationCondition.optimal),
+                 1: (pe.SolverStatus.aborted, pe.TerminationCondition.maxTimeLimit),
+                 2: (pe.SolverStatus.warning, pe.TerminationCondition.infeasible),
+                 3: (pe.SolverStatus.warning, pe.TerminationCondition.unbounded)}
+
+def solve_compiled_model(processed_data, useful_sets, parameters, attributes_with_time):
+    """Compiles the model into sparse matrices (see matrix_model) and solves it with the same hierarchical
+    scheme. The solution is loaded in a Pyomo model without constraints, so the outputs are generated
+    like the ones of the Pyomo model.
 
     Parameters
     ----------
@@ -688,6 +1070,96 @@ def make_model(processed_data, useful_sets, parameters,attributes_with_time):
         It has all the model's sets. 
     parameters : dictionary(string, string)
         It has stored all the not-model's parameters.
+    attributes_with_time: Dictionary(string, pd.Dataframe)
+        Time dependent attributes of nodes and arcs.
+
+    Returns
+    -------
+    tuple(Pyomo ConcreteModel, None, Pyomo Results Object)
+        The model with the solution of the last stage solved and the results of that stage, or None if the
+        network can not be compiled (it has oil or contaminant balances).
+    """
+    import src.optimization.treatment.matrix_model as matrix_model #it imports this module
+    try:
+        matrix_model.check_linear_network(processed_data, useful_sets)
+    except ValueError as e:
+        print('        ['+str(dt.datetime.now())+'] ' + str(e) + ', the Pyomo model is solved instead')
+        return None
+
+    model = build_model(processed_data, useful_sets, attributes_with_time, get_contaminant_formulation(parameters),
+                        get_big_m(parameters), with_constraints=False)
+    report = get_report(model)
+    print('        ['+str(dt.datetime.now())+'] Compiling matrix model...')
+    with report.span('compile_matrix_model', model):
+        compiled = matrix_model.compile_model(processed_data, useful_sets, attributes_with_time)
+    objective_functions = get_objective_functions(parameters)
+    with report.span('solve_matrix_model', model):
+        x, stages = matrix_model.solve_hierarchical(compiled, parameters, objective_functions)
+    if x is not None:
+        matrix_model.load_solution(model, compiled, x)
+
+    last_obj_f, sense = objective_functions[-1]
+    model.obj_function = pe.Objective(sense = sense, expr = get_objective_expression(model, last_obj_f))
+    model.obj_function_name = last_obj_f.__name__
+    result = SolverResults()
+    model.stages = []
+    for number, stage in enumerate(stages, start = 1):
+        result.solver.status, result.solver.termination_condition = MATRIX_STATUS.get(stage['status_code'], (pe.SolverStatus.error, pe.TerminationCondition.error))
+        model.stages.append({'stage': number, 'objective': stage['objective'], 'status': str(result.solver.status),
+                             'termination_condition': str(result.solver.termination_condition), 'solve_time': None,
+                             'objective_value': stage['value'], 'gap': None, 'nodes': None})
+    return model, None, result
+
+def get_model(processed_data, useful_sets, parameters, attributes_with_time):
+    """Returns the optimization model without objective function. If the parameters json file has the
+    'model_cache_dir' key and a model with the same structure was built before, that model is reused:
+    its mutable parameters are updated and its last solution is used as warm start.
+
+    Parameters
+    ----------
+    processed_data : ProcessedData
+        It has all the model's processed data.
+    useful_sets : UsefulSets
+        It has all the model's sets. 
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
+    attributes_with_time: Dictionary(string, pd.Dataframe)
+        Time dependent attributes of nodes and arcs.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    options = get_contaminant_formulation(parameters), get_big_m(parameters)
+    if not parameters["json_file"].get("model_cache_dir"):
+        return build_model(processed_data, useful_sets, attributes_with_time, *options)
+
+    signature = model_cache.get_signature(processed_data, useful_sets, attributes_with_time, *options)
+    model = model_cache.load_model(parameters, signature)
+    if model is None:
+        model = build_model(processed_data, useful_sets, attributes_with_time, *options)
+    else:
+        print('        ['+str(dt.datetime.now())+'] Reusing cached model...')
+        model.report = None #every run has its own report
+        with get_report(model).span('update_parameters', model):
+            model = model_cache.update_parameters(model, processed_data, attributes_with_time)
+        model.persistent_solver = None #the persistent solvers have the previous parameters loaded
+        model.has_initial_solution = True
+    model.signature = signature
+    return model
+
+
+def solve_model(model, parameters):
+    """Sets the objective functions and optimizes the model. A model that was already solved can be solved
+    again after changing its mutable parameters: its last solution is the warm start.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
 
     Returns
     -------
@@ -698,19 +1170,49 @@ def make_model(processed_data, useful_sets, parameters,attributes_with_time):
     Pyomo Results Object
         The optimization results (it has the model's termination conditions).
     """
-    print('        ['+str(dt.datetime.now())+'] Creating ConcreteModel...')
-    model = pe.ConcreteModel("Dummy_Ocelote")
-    print('        ['+str(dt.datetime.now())+'] Creating sets...')
-    model = set_sets(model, useful_sets)
-    print('        ['+str(dt.datetime.now())+'] Creating parameters...')
-    model = set_parameters(model, processed_data, useful_sets, attributes_with_time)
-    print('        ['+str(dt.datetime.now())+'] Creating Variables...')
-    model = set_variables(model)
-    print('        ['+str(dt.datetime.now())+'] Creating Constraints...')
-    model = set_constraints(model)
+    if isinstance(getattr(model, 'persistent_solver', None), PersistentSolver):
+        model.persistent_solver = None #the legacy persistent solvers keep the bound constraints of the previous solve
     print('        ['+str(dt.datetime.now())+'] Creating Objectives...')
     model = set_objective_function(model, parameters)
    
     solver, result = optimize(model, parameters)
+    if model.contaminant_formulation == 'mass_flow' and hasattr(model, 'm_contaminant'):
+        model = constraints.set_contaminant_concentrations(model)
+
+    return model, solver, result
+
+
+def make_model(processed_data, useful_sets, parameters,attributes_with_time):
+    """Generates and optimizes the optimization model. If the parameters json file has {"compiler": "matrix"}
+    and the network is linear, the model is compiled into sparse matrices and solved without the Pyomo
+    constraints (see solve_compiled_model).
+
+    Parameters
+    ----------
+    processed_data : ProcessedData
+        It has all the model's processed data.
+    useful_sets : UsefulSets
+        It has all the model's sets. 
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    Pyomo SolverFactory('gurobi')
+        The factory where the solver solved the problem.
+    Pyomo Results Object
+        The optimization results (it has the model's termination conditions).
+    """
+    if get_compiler(parameters) == 'matrix':
+        solved = solve_compiled_model(processed_data, useful_sets, parameters, attributes_with_time)
+        if solved is not None:
+            return solved
+    model = get_model(processed_data, useful_sets, parameters, attributes_with_time)
+    model, solver, result = solve_model(model, parameters)
+
+    if parameters["json_file"].get("model_cache_dir"):
+        model_cache.save_model(model, parameters)
 
-    return model, solver, result
\ No newline at end of file
+    return model, solver, result
@@ -0,0 +1,672 @@
+# -*- coding: utf-8 -*-
+"""
+matrix_model.py
+====================================
+This script compiles the linear part of the treatment model straight from the processed data into
+sparse matrix blocks (lb <= A x <= ub, col_lb <= x <= col_ub), without going through the Pyomo rules.
+The compiled model can be solved directly (scipy/HiGHS) or written to an MPS file. A run solves it instead of
+the Pyomo model when the parameters json file has {"compiler": "matrix"} (see make_model.solve_compiled_model).
+
+Only networks without oil and without contaminant balances are pure linear models, so those are the
+only ones that can be compiled.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import datetime as dt
+import numpy as np
+import pandas as pd
+import pyomo.environ as pe
+import scipy.sparse as sp
+from scipy.optimize import milp, LinearConstraint, Bounds
+
+from src.optimization.treatment.make_model import get_objective_functions
+from src.optimization.treatment.solvers import add_loaded_solution
+from src.optimization.treatment.preprocess_data import expand_time_values
+from src.optimization.treatment.constraints.constraints import (BPD_PSI_TO_KWH, EVAPORATION_TO_BARRELS, ARCS_EPSILON,
+                                                                PUMPS_EPSILON, PONDS_EPSILON, MIN_PUMP_ENERGY)
+
+
+class MatrixModel:
+    """Stores the linear treatment model in sparse matrix form.
+    """
+    def __init__(self, columns, column_index, A, row_lb, row_ub, col_lb, col_ub, integrality, row_families, objectives) -> None:
+        """MatrixModel Initializer
+
+        Parameters
+        ----------
+        columns : dict(string, (int, list))
+            For every variable family, its first column and its list of indexes (same indexes as the Pyomo variables).
+        column_index : dict(string, dict(tuple, int))
+            For every variable family, the column of every index.
+        A : scipy.sparse.coo_matrix
+            Constraint matrix.
+        row_lb, row_ub : numpy.ndarray
+            Lower and upper bounds of every row.
+        col_lb, col_ub : numpy.ndarray
+            Lower and upper bounds of every column.
+        integrality : numpy.ndarray
+            1 for binary columns, 0 for continuous ones.
+        row_families : dict(string, (int, int))
+            First and last (excluded) row of every constraint family.
+        objectives : dict(string, numpy.ndarray)
+            Cost vector of every objective function, keyed by the name of the Pyomo objective function.
+        """
+        self.columns, self.column_index = columns, column_index
+        self.A, self.row_lb, self.row_ub = A, row_lb, row_ub
+        self.col_lb, self.col_ub, self.integrality = col_lb, col_ub, integrality
+        self.row_families, self.objectives = row_families, objectives
+
+    @property
+    def shape(self):
+        return self.A.shape
+
+
+class _MatrixBuilder:
+    """Accumulates columns and COO triplets while the model is compiled.
+    """
+    def __init__(self, n_periods) -> None:
+        self.T = n_periods
+        self.n_cols, self.n_rows = 0, 0
+        self.columns, self.col_lb, self.col_ub, self.integrality = {}, [], [], []
+        self.rows, self.cols, self.vals = [], [], []
+        self.row_lb, self.row_ub, self.row_families = [], [], {}
+
+    def add_columns(self, name, entities, lb=0.0, ub=np.inf, binary=False):
+        """Adds one column per (entity, period). Returns the first column of the family."""
+        offset = self.n_cols
+        size = len(entities) * self.T
+        self.columns[name] = (offset, list(entities))
+        self.col_lb.append(np.broadcast_to(np.asarray(lb, dtype=float), (size,)).astype(float))
+        self.col_ub.append(np.broadcast_to(np.asarray(ub, dtype=float), (size,)).astype(float))
+        self.integrality.append(np.full(size, 1 if binary else 0))
+        self.n_cols += size
+        return offset
+
+    def add_rows(self, name, size, lb, ub):
+        """Adds a block of rows with their bounds. Returns the first row of the block."""
+        offset = self.n_rows
+        self.row_lb.append(np.broadcast_to(np.asarray(lb, dtype=float), (size,)).astype(float))
+        self.row_ub.append(np.broadcast_to(np.asarray(ub, dtype=float), (size,)).astype(float))
+        self.row_families[name] = (offset, offset + size)
+        self.n_rows += size
+        return offset
+
+    def add_entries(self, rows, cols, vals):
+        """Adds the coefficients vals in (rows, cols). Blocks of the same size are flattened, the others broadcasted."""
+        rows, cols, vals = np.asarray(rows), np.asarray(cols), np.asarray(vals, dtype=float)
+        if rows.size != cols.size:
+            rows, cols = np.broadcast_arrays(rows, cols)
+        vals = vals.ravel() if vals.size == rows.size else np.broadcast_to(vals, rows.shape).ravel()
+        self.rows.append(rows.ravel())
+        self.cols.append(cols.ravel())
+        self.vals.append(vals)
+
+    def build(self, objectives):
+        rows = np.concatenate(self.rows) if self.rows else np.array([], dtype=int)
+        cols = np.concatenate(self.cols) if self.cols else np.array([], dtype=int)
+        vals = np.concatenate(self.vals) if self.vals else np.array([])
+        A = sp.coo_matrix((vals, (rows, cols)), shape=(self.n_rows, self.n_cols))
+        A.sum_duplicates()
+
+        column_index = {}
+        for name, (offset, entities) in self.columns.items():
+            column_index[name] = {_as_tuple(e) + (t,): offset + k * self.T + (t - 1)
+                                  for k, e in enumerate(entities) for t in range(1, self.T + 1)}
+
+        return MatrixModel(self.columns, column_index, A,
+                           _concat(self.row_lb), _concat(self.row_ub),
+                           _concat(self.col_lb), _concat(self.col_ub), _concat(self.integrality),
+                           self.row_families, objectives)
+
+
+def _concat(arrays):
+    return np.concatenate(arrays) if arrays else np.array([])
+
+
+def _as_tuple(entity):
+    return entity if isinstance(entity, tuple) else (entity,)
+
+
+def _positions(entities, universe):
+    """Returns an array that maps every element of universe to its position in entities (-1 if missing)."""
+    where = {e: k for k, e in enumerate(entities)}
+    return np.array([where.get(u, -1) for u in universe], dtype=int)
+
+
+def _arc_time_values(attributes_with_time, column, arcs, n_periods):
+    """Returns an (arcs x periods) array with the time dependent attribute of the arcs."""
+    values = expand_time_values(attributes_with_time, column, arcs, n_periods)
+    return pd.to_numeric(pd.Series(values.ravel()), errors='coerce').to_numpy(dtype=float).reshape(len(arcs), n_periods)
+
+
+def _node_time_values(series, nodes, n_periods, fill=0.0):
+    """Returns a (nodes x periods) array from a Series indexed by (node, time)."""
+    index = pd.MultiIndex.from_tuples([(i, t) for i in nodes for t in range(1, n_periods + 1)])
+    return series.reindex(index).fillna(fill).to_numpy(dtype=float).reshape(len(nodes), n_periods)
+
+
+def check_linear_network(processed_data, useful_sets):
+    """Checks that the network can be compiled as a pure linear model (no oil, no contaminant balances).
+
+    Parameters
+    ----------
+    processed_data : ProcessedData
+        It has all the model's processed data.
+    useful_sets : UsefulSets
+        It has all the model's sets.
+
+    Raises
+    ------
+    ValueError
+        If the network has oil nodes/arcs or contaminant balances.
+    """
+    if len(useful_sets.oil_nodes) or len(useful_sets.oil_arcs) or len(useful_sets.fixed_oil_treatment_arcs):
+        raise ValueError("The matrix model only supports networks without oil: the oil proportion constraints are not linear")
+
+    contaminants_in = processed_data.initial_nodes_contaminants_data['value'].sum()
+    contaminants_content = processed_data.initial_content_contaminants_tanks['value'].sum()\
+        + processed_data.initial_content_contaminants_ponds['value'].sum()
+    if len(useful_sets.process_nodes) != 0 or contaminants_in != 0 or contaminants_content != 0:
+        raise ValueError("The matrix model only supports networks without contaminant balances: those constraints are not linear")
+
+
+def compile_model(processed_data, useful_sets, attributes_with_time):
+    """Compiles the linear treatment model into sparse matrix blocks. It emits the same constraint families as
+    make_model.set_constraints (arc and node capacities are emitted as column bounds).
+
+    Parameters
+    ----------
+    processed_data : ProcessedData
+        It has all the model's processed data.
+    useful_sets : UsefulSets
+        It has all the model's sets.
+    attributes_with_time: Dictionary(string, pd.Dataframe)
+        Time dependent attributes of nodes and arcs.
+
+    Returns
+    -------
+    MatrixModel
+        The compiled model.
+    """
+    check_linear_network(processed_data, useful_sets)
+
+    T = int(list(useful_sets.time_projection)[0])
+    builder = _MatrixBuilder(T)
+
+    nodes = sorted(useful_sets.nodes)
+    arcs = sorted(useful_sets.arcs)
+    node_pos = {n: k for k, n in enumerate(nodes)}
+    arc_start = np.array([node_pos[i] for i, _ in arcs], dtype=int)
+    arc_end = np.array([node_pos[j] for _, j in arcs], dtype=int)
+    n_arcs, n_nodes = len(arcs), len(nodes)
+    tt = np.arange(T)
+
+    initial = sorted(useful_sets.initial_nodes)
+    ending = sorted(useful_sets.ending_nodes)
+    pumps = sorted(useful_sets.pumps_nodes)
+    ponds = sorted(useful_sets.pond_nodes)
+    tanks_ponds = set(useful_sets.tank_nodes) | set(useful_sets.pond_nodes)
+    arcs_nominal = sorted(useful_sets.arcs_nominal_values)
+    arcs_watermix = sorted(set(useful_sets.arcs_water_stability) | set(useful_sets.arcs_water_stability_low_priority))
+    arcs_pond = sorted(useful_sets.arcs_pond_stability)
+    arc_pos = {a: k for k, a in enumerate(arcs)}
+
+    #region parameters
+    arcs_data = processed_data.arcs_data.reindex(pd.MultiIndex.from_tuples(arcs))
+    nodes_data = processed_data.nodes_data.reindex(nodes)
+    usable = _arc_time_values(attributes_with_time, 'UsablePercentage', arcs, T)
+    other_cost = _arc_time_values(attributes_with_time, 'OtherCosts', arcs, T)
+    nominal = _arc_time_values(attributes_with_time, 'Nominal_Value', arcs, T)
+    min_flow = arcs_data['MinFlow'].to_numpy(dtype=float)[:, None] * usable
+    max_flow = arcs_data['MaxFlow'].to_numpy(dtype=float)[:, None] * usable
+    flow_cost = arcs_data['ArcFlowCost'].to_numpy(dtype=float)
+    min_capacity = nodes_data['MinCapacity'].to_numpy(dtype=float)
+    max_capacity = nodes_data['MaxCapacity'].to_numpy(dtype=float)
+    big_penalty = processed_data.nodes_data["MaxCapacity"].max()
+    big_penalty_arcs = processed_data.arcs_data["MaxFlow"].max()
+    #endregion
+
+    #region columns
+    x_water = builder.add_columns('x_water', arcs, lb=np.maximum(min_flow, 0).ravel(), ub=max_flow.ravel())
+    y_lb = np.repeat(np.maximum(min_capacity, 0), T)
+    #c_11_1_1 in the first period: the water spilled before a rolling horizon window can not be used
+    for n in initial:
+        y_lb[node_pos[n] * T] = max(y_lb[node_pos[n] * T], processed_data.inital_content.get(n, 0))
+    y_ub = np.repeat(max_capacity, T)
+    y_water = builder.add_columns('y_water', nodes, lb=y_lb, ub=y_ub)
+    y_elec = builder.add_columns('y_elec_amount', pumps)
+    active_pump = builder.add_columns('xActivePump', pumps, ub=1, binary=True)
+    active_pond = builder.add_columns('xActivePonds', ponds, ub=1, binary=True)
+    water_delta = builder.add_columns('x_water_delta', arcs_nominal)
+    active_watermix = builder.add_columns('x_active_arc_watermix', arcs_watermix, ub=1, binary=True)
+    slack_pos_watermix = builder.add_columns('slack_positive_watermix', arcs_watermix)
+    slack_neg_watermix = builder.add_columns('slack_negative_watermix', arcs_watermix)
+    active_arc_pond = builder.add_columns('x_active_arc_pond', arcs_pond, ub=1, binary=True)
+    slack_pos_pond = builder.add_columns('slack_positive_pond', arcs_pond)
+    slack_neg_pond = builder.add_columns('slack_negative_pond', arcs_pond)
+    #endregion
+
+    def col(offset, positions, t=tt):
+        """Columns of (entity, period) for an array of entity positions."""
+        return offset + np.asarray(positions)[:, None] * T + np.asarray(t)[None, :]
+
+    def flow_entries(row_offset, family_pos, arc_nodes, coef, t=tt, periods=T):
+        """Adds the flow of the arcs whose node (start or end) belongs to the family of rows."""
+        block = family_pos[arc_nodes]
+        selected = np.nonzero(block >= 0)[0]
+        rows = row_offset + block[selected][:, None] * periods + np.arange(len(t))[None, :]
+        coef = np.asarray(coef, dtype=float)
+        vals = coef[block[selected]][:, None] if coef.ndim else coef
+        builder.add_entries(rows, col(x_water, selected, t), np.broadcast_to(vals, rows.shape))
+
+    #region c_0 electrical cost
+    pumps_data = processed_data.pumps_nodes_data.reindex(pumps)
+    delta_pressure = (pumps_data['PressureOut'] - pumps_data['PressureIn']).to_numpy(dtype=float)
+    linear = np.array([p in useful_sets.pumps_nodes_linear_regression for p in pumps])
+    energy_models = processed_data.pumps_energy_models_data.reindex(pumps)
+    slope_p = energy_models['SLOPE_P'].fillna(0).to_numpy(dtype=float)
+    slope_q = energy_models['SLOPE_Q'].fillna(0).to_numpy(dtype=float)
+    intercept = energy_models['INTERCEPT'].fillna(0).to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fixed_coef = delta_pressure / pumps_data['Efficiency'].to_numpy(dtype=float) * BPD_PSI_TO_KWH
+    flow_coef = np.where(linear, slope_q * processed_data.watt_to_kwh, fixed_coef)
+    rhs = np.where(linear, (slope_p * delta_pressure + intercept) * processed_data.watt_to_kwh, 0.0)
+
+    pumps_pos = _positions(pumps, nodes)
+    r = builder.add_rows('c_0_elec_cost', len(pumps) * T, np.repeat(rhs, T), np.inf)
+    builder.add_entries(r + np.arange(len(pumps) * T), col(y_elec, np.arange(len(pumps))), 1.0)
+    flow_entries(r, pumps_pos, arc_end, -flow_coef)
+    #endregion
+
+    #region c_1 water flow balance
+    balance_nodes = [n for n in nodes if n not in useful_sets.initial_nodes]
+    balance_pos = _positions(balance_nodes, nodes)
+    initial_content = np.array([processed_data.inital_content[n] if n in tanks_ponds else 0.0 for n in balance_nodes], dtype=float)
+    rhs = np.zeros((len(balance_nodes), T))
+    rhs[:, 0] = -initial_content
+    r = builder.add_rows('c_1_1_water_flow_balance', len(balance_nodes) * T, rhs.ravel(), rhs.ravel())
+    flow_entries(r, balance_pos, arc_end, 1.0)
+    flow_entries(r, balance_pos, arc_start, -1.0)
+    node_idx = np.array([node_pos[n] for n in balance_nodes], dtype=int)
+    builder.add_entries(r + np.arange(len(balance_nodes) * T), col(y_water, node_idx), -1.0)
+    if T > 1:
+        rows = r + np.arange(len(balance_nodes))[:, None] * T + tt[None, 1:]
+        builder.add_entries(rows, col(y_water, node_idx, tt[:-1]), 1.0)
+
+    if len(initial):
+        inner = [node_pos[n] for n in nodes if n not in useful_sets.initial_nodes and n not in useful_sets.ending_nodes]
+        total_initial_content = sum(processed_data.inital_content[n] for n in tanks_ponds)
+        r = builder.add_rows('c_1_2_1_water_flow_balance', 1, -total_initial_content, -total_initial_content)
+        from_initial = np.nonzero(np.isin(arc_start, [node_pos[n] for n in initial]))[0]
+        to_ending = np.nonzero(np.isin(arc_end, [node_pos[n] for n in ending]))[0]
+        builder.add_entries(np.full((len(from_initial), T), r), col(x_water, from_initial), 1.0)
+        builder.add_entries(np.full((len(to_ending), T), r), col(x_water, to_ending), -1.0)
+        builder.add_entries(np.full(len(inner), r), y_water + np.asarray(inner, dtype=int) * T + (T - 1), -1.0)
+    #endregion
+
+    #region c_3 stability
+    if T > 1:
+        for name, arcs_set, var, pos_slack, neg_slack in [
+                ('c_3_1_water_stability', arcs_watermix, x_water, slack_pos_watermix, slack_neg_watermix),
+                ('c_3_2_pond_stability', arcs_pond, active_arc_pond, slack_pos_pond, slack_neg_pond)]:
+            n = len(arcs_set)
+            r = builder.add_rows(name, n * (T - 1), 0.0, 0.0)
+            rows = r + np.arange(n)[:, None] * (T - 1) + np.arange(T - 1)[None, :]
+            var_pos = np.array([arc_pos[a] for a in arcs_set], dtype=int) if var == x_water else np.arange(n)
+            builder.add_entries(rows, col(var, var_pos, tt[1:]), 1.0)
+            builder.add_entries(rows, col(var, var_pos, tt[:-1]), -1.0)
+            builder.add_entries(rows, col(pos_slack, np.arange(n), tt[1:]), -1.0)
+            builder.add_entries(rows, col(neg_slack, np.arange(n), tt[1:]), 1.0)
+    #the first period is compared with the previous period in a rolling horizon window
+    previous_period = processed_data.previous_period or {}
+    for name, arcs_set, var, pos_slack, neg_slack, previous in [
+            ('c_3_1_water_stability_first_period', arcs_watermix, x_water, slack_pos_watermix, slack_neg_watermix, previous_period.get('x_water', {})),
+            ('c_3_2_pond_stability_first_period', arcs_pond, active_arc_pond, slack_pos_pond, slack_neg_pond, previous_period.get('x_active_arc_pond', {}))]:
+        compared = [k for k, a in enumerate(arcs_set) if a in previous]
+        values = np.array([previous[arcs_set[k]] for k in compared], dtype=float)
+        r = builder.add_rows(name, len(compared), values, values)
+        rows = r + np.arange(len(compared))
+        var_pos = np.array([arc_pos[arcs_set[k]] for k in compared], dtype=int) if var == x_water else np.array(compared, dtype=int)
+        builder.add_entries(rows, var + var_pos * T, 1.0)
+        builder.add_entries(rows, pos_slack + np.array(compared, dtype=int) * T, -1.0)
+        builder.add_entries(rows, neg_slack + np.array(compared, dtype=int) * T, 1.0)
+    #endregion
+
+    #region c_4 initial nodes
+    initial_pos = _positions(initial, nodes)
+    water_in = _node_time_values(processed_data.tanks_flow["WaterQty"], initial, T)
+    #the water spilled before a rolling horizon window
+    water_in[:, 0] += [processed_data.inital_content.get(n, 0) for n in initial]
+    r = builder.add_rows('c_4_3_initial_nodes_water', len(initial) * T, water_in.ravel(), water_in.ravel())
+    initial_idx = np.array([node_pos[n] for n in initial], dtype=int)
+    builder.add_entries(r + np.arange(len(initial) * T), col(y_water, initial_idx), 1.0)
+    if T > 1:
+        rows = r + np.arange(len(initial))[:, None] * T + tt[None, 1:]
+        builder.add_entries(rows, col(y_water, initial_idx, tt[:-1]), -1.0)
+    flow_entries(r, initial_pos, arc_start, 1.0)
+    #endregion
+
+    #region c_5_2 fixed splitter values
+    splitter_arcs = sorted(useful_sets.fixed_splitter_arcs)
+    rates = processed_data.splitter_arcs_data['FixedPercentage'].reindex(pd.MultiIndex.from_tuples(splitter_arcs)).to_numpy(dtype=float) \
+        if len(splitter_arcs) else np.array([])
+    r = builder.add_rows('c_5_2_water_fixed_spliting_values', len(splitter_arcs) * T, 0.0, 0.0)
+    for k, (j, out) in enumerate(splitter_arcs):
+        rows = r + k * T + tt
+        builder.add_entries(rows, x_water + arc_pos[(j, out)] * T + tt, 1.0)
+        builder.add_entries(rows, y_water + node_pos[j] * T + tt, rates[k])
+        entries = np.nonzero(arc_end == node_pos[j])[0]
+        builder.add_entries(np.broadcast_to(rows, (len(entries), T)), col(x_water, entries), -rates[k])
+    #endregion
+
+    #region c_14_3_1 pond evaporation
+    evaporation = processed_data.evaporation_rates['evaporation_rate'].reindex(range(1, T + 1)).fillna(0).to_numpy(dtype=float)
+    area = processed_data.ponds_nodes_data['avg_area'].reindex(ponds).to_numpy(dtype=float)
+    r = builder.add_rows('c_14_3_1_pond_evaporation', len(ponds) * T, 0.0, 0.0)
+    builder.add_entries(r + np.arange(len(ponds) * T), col(active_pond, np.arange(len(ponds))),
+                        -(area[:, None] * evaporation[None, :] * EVAPORATION_TO_BARRELS).ravel())
+    to_loss = np.isin(arc_end, [node_pos[n] for n in useful_sets.loss_tank_nodes])
+    pond_pos = np.append(_positions(ponds, nodes), -1)
+    flow_entries(r, pond_pos, np.where(to_loss, arc_start, n_nodes), 1.0)
+    #endregion
+
+    #region c_11 initial and ending nodes
+    spill_nodes = sorted(set(initial) | set(ending))
+    if T > 1:
+        spill_idx = np.array([node_pos[n] for n in spill_nodes], dtype=int)
+        r = builder.add_rows('c_11_1_1_initial_ending_spill_water', len(spill_nodes) * (T - 1), 0.0, np.inf)
+        rows = r + np.arange(len(spill_nodes))[:, None] * (T - 1) + np.arange(T - 1)[None, :]
+        builder.add_entries(rows, col(y_water, spill_idx, tt[1:]), 1.0)
+        builder.add_entries(rows, col(y_water, spill_idx, tt[:-1]), -1.0)
+
+    demand = _node_time_values(processed_data.terminal_dinamic_capacity["Aditional Total Capacity"], ending, T)
+    r = builder.add_rows('c_11_2_demand_ending_nodes', len(ending) * T, -np.inf, demand.ravel())
+    flow_entries(r, _positions(ending, nodes), arc_end, 1.0)
+    #endregion
+
+    #region c_13 active pumps
+    n = len(pumps)
+    r = builder.add_rows('c_13_1_active_pumps_max', n * T, -np.inf, 1 - PUMPS_EPSILON)
+    builder.add_entries(r + np.arange(n * T), col(active_pump, np.arange(n)), 1.0)
+    flow_entries(r, pumps_pos, arc_end, -1.0)
+
+    r = builder.add_rows('c_13_2_active_pumps_min', n * T, -np.inf, 0.0)
+    builder.add_entries(r + np.arange(n * T), col(active_pump, np.arange(n)), -big_penalty)
+    flow_entries(r, pumps_pos, arc_end, 1.0)
+
+    r = builder.add_rows('c_13_3_positive_energy', n * T, 0.0, np.inf)
+    builder.add_entries(r + np.arange(n * T), col(y_elec, np.arange(n)), 1.0)
+    builder.add_entries(r + np.arange(n * T), col(active_pump, np.arange(n)), -MIN_PUMP_ENERGY)
+    #endregion
+
+    #region c_15 linking binary and continuous variables of the stability arcs
+    for suffix, arcs_set, binary in [('watermix', arcs_watermix, active_watermix), ('pond', arcs_pond, active_arc_pond)]:
+        n = len(arcs_set)
+        flows = col(x_water, np.array([arc_pos[a] for a in arcs_set], dtype=int))
+        binaries = col(binary, np.arange(n))
+        r = builder.add_rows('c_15_active_arcs_zero_' + suffix, n * T, -np.inf, 1 - ARCS_EPSILON)
+        builder.add_entries(r + np.arange(n * T), binaries, 1.0)
+        builder.add_entries(r + np.arange(n * T), flows, -1.0)
+        r = builder.add_rows('c_15_active_arcs_positive_' + suffix, n * T, -np.inf, 0.0)
+        builder.add_entries(r + np.arange(n * T), flows, 1.0)
+        builder.add_entries(r + np.arange(n * T), binaries, -big_penalty_arcs)
+    #endregion
+
+    #region c_16 nominal values
+    n = len(arcs_nominal)
+    nominal_idx = np.array([arc_pos[a] for a in arcs_nominal], dtype=int)
+    nominal_values = nominal[nominal_idx].ravel() if n else np.array([])
+    r = builder.add_rows('c_16_1_positive_delta_nominal', n * T, -nominal_values, np.inf)
+    builder.add_entries(r + np.arange(n * T), col(water_delta, np.arange(n)), 1.0)
+    builder.add_entries(r + np.arange(n * T), col(x_water, nominal_idx), -1.0)
+    r = builder.add_rows('c_16_2_negative_delta_nominal', n * T, nominal_values, np.inf)
+    builder.add_entries(r + np.arange(n * T), col(water_delta, np.arange(n)), 1.0)
+    builder.add_entries(r + np.arange(n * T), col(x_water, nominal_idx), 1.0)
+    #endregion
+
+    #region c_17 active ponds
+    n = len(ponds)
+    pond_idx = np.array([node_pos[p] for p in ponds], dtype=int)
+    r = builder.add_rows('c_17_1_active_ponds_max', n * T, -np.inf, 1 - PONDS_EPSILON)
+    builder.add_entries(r + np.arange(n * T), col(active_pond, np.arange(n)), 1.0)
+    builder.add_entries(r + np.arange(n * T), col(y_water, pond_idx), -1.0)
+    r = builder.add_rows('c_17_1_active_ponds_min', n * T, -np.inf, 0.0)
+    builder.add_entries(r + np.arange(n * T), col(y_water, pond_idx), 1.0)
+    builder.add_entries(r + np.arange(n * T), col(active_pond, np.arange(n)), -big_penalty)
+    #endregion
+
+    #region objectives
+    def objective(*terms):
+        c = np.zeros(builder.n_cols)
+        for columns, coef in terms:
+            np.add.at(c, np.asarray(columns).ravel(), np.broadcast_to(np.asarray(coef, dtype=float), np.asarray(columns).shape).ravel())
+        return c
+
+    def arcs_where(mask):
+        return col(x_water, np.nonzero(mask)[0])
+
+    ending_idx = [node_pos[n] for n in ending]
+    not_from_ending = ~np.isin(arc_start, ending_idx)
+    energy_cost = processed_data.energy_cost
+    water_stability = [a for a in arcs_watermix if a in useful_sets.arcs_water_stability]
+    water_stability_low = [a for a in arcs_watermix if a in useful_sets.arcs_water_stability_low_priority]
+
+    def stability(arcs_set, pos_slack, neg_slack, binary, family):
+        k = np.array([family.index(a) for a in arcs_set], dtype=int)
+        return [(col(pos_slack, k), 1.0), (col(neg_slack, k), 1.0), (col(binary, k), 1.0)]
+
+    objectives = {
+        'calculate_supply_demand_flow': objective(
+            (col(y_water, [node_pos[n] for n in useful_sets.ending_nodes_max_flow]), 1.0),
+            (col(y_water, [node_pos[n] for n in useful_sets.initial_nodes_min_flow]), -1.0)),
+        'calculate_recirculation': objective((arcs_where(np.array([a in useful_sets.flag_arcs for a in arcs], dtype=bool)), 1.0)),
+        'calculate_delta_water_nominal': objective((col(water_delta, np.arange(len(arcs_nominal))), 1.0)),
+        'calculate_cost': objective(
+            (col(y_elec, np.arange(len(pumps))), energy_cost),
+            (arcs_where(not_from_ending), (flow_cost[not_from_ending][:, None] + other_cost[not_from_ending])),
+            ),
+        'calculate_energy_cost': objective((col(y_elec, np.arange(len(pumps))), energy_cost)),
+        'calculate_end_benefit': objective((arcs_where(np.isin(arc_end, ending_idx)), 1.0)),
+        'calculate_water_stability': objective(*stability(water_stability, slack_pos_watermix, slack_neg_watermix, active_watermix, arcs_watermix)),
+        'calculate_water_stability_low_priority': objective(*stability(water_stability_low, slack_pos_watermix, slack_neg_watermix, active_watermix, arcs_watermix)),
+        'calculate_pond_stability': objective(*stability(arcs_pond, slack_pos_pond, slack_neg_pond, active_arc_pond, arcs_pond)),
+    }
+    #endregion
+
+    return builder.build(objectives)
+
+
+def _mps_name(prefix, k):
+    return prefix + str(k)
+
+
+def write_mps(matrix_model, path, objective, sense=pe.minimize):
+    """Writes the compiled model in free MPS format. Rows are named R<k> and columns C<k>.
+
+    Parameters
+    ----------
+    matrix_model : MatrixModel
+        The compiled model.
+    path : string
+        Path of the MPS file.
+    objective : string
+        Name of the objective function (one of matrix_model.objectives).
+    sense : Pyomo sense
+        Sense of the objective function. MPS files are minimized, so maximization objectives are negated.
+
+    Returns
+    -------
+    string
+        Path of the MPS file.
+    """
+    c = matrix_model.objectives[objective] * (-1 if sense == pe.maximize else 1)
+    A = matrix_model.A.tocsc()
+    row_lb, row_ub = matrix_model.row_lb, matrix_model.row_ub
+
+    row_types, rhs, ranges = [], {}, {}
+    for k, (lb, ub) in enumerate(zip(row_lb, row_ub)):
+        if lb == ub:
+            row_types.append('E')
+            rhs[k] = lb
+        elif np.isfinite(lb) and np.isfinite(ub):
+            row_types.append('G')
+            rhs[k], ranges[k] = lb, ub - lb
+        elif np.isfinite(lb):
+            row_types.append('G')
+            rhs[k] = lb
+        elif np.isfinite(ub):
+            row_types.append('L')
+            rhs[k] = ub
+        else:
+            row_types.append('N')
+
+    with open(path, 'w') as f:
+        f.write('NAME TREATMENT\nROWS\n N OBJ\n')
+        for k, row_type in enumerate(row_types):
+            f.write(' %s %s\n' % (row_type, _mps_name('R', k)))
+
+        f.write('COLUMNS\n')
+        integer_block = False
+        for j in range(A.shape[1]):
+            is_integer = bool(matrix_model.integrality[j])
+            if is_integer != integer_block:
+                f.write(" MARKER 'MARKER' '%s'\n" % ('INTORG' if is_integer else 'INTEND'))
+                integer_block = is_integer
+            name = _mps_name('C', j)
+            if c[j] != 0:
+                f.write(' %s OBJ %.17g\n' % (name, c[j]))
+            for pos in range(A.indptr[j], A.indptr[j + 1]):
+                f.write(' %s %s %.17g\n' % (name, _mps_name('R', A.indices[pos]), A.data[pos]))
+        if integer_block:
+            f.write(" MARKER 'MARKER' 'INTEND'\n")
+
+        f.write('RHS\n')
+        for k, value in rhs.items():
+            if value != 0:
+                f.write(' RHS %s %.17g\n' % (_mps_name('R', k), value))
+        if ranges:
+            f.write('RANGES\n')
+            for k, value in ranges.items():
+                f.write(' RNG %s %.17g\n' % (_mps_name('R', k), value))
+
+        f.write('BOUNDS\n')
+        for j, (lb, ub) in enumerate(zip(matrix_model.col_lb, matrix_model.col_ub)):
+            name = _mps_name('C', j)
+            if lb == ub:
+                f.write(' FX BND %s %.17g\n' % (name, lb))
+                continue
+            if lb != 0:
+                f.write(' LO BND %s %.17g\n' % (name, lb) if np.isfinite(lb) else ' MI BND %s\n' % name)
+            if np.isfinite(ub):
+                f.write(' UP BND %s %.17g\n' % (name, ub))
+        f.write('ENDATA\n')
+
+    return path
+
+
+def solve_hierarchical(matrix_model, parameters, objective_functions=None):
+    """Solves the compiled model with the same hierarchical (lexicographic) scheme as make_model:
+    after every objective but the last one, its value is bounded by percentage_hierarchical_optimization.
+
+    Parameters
+    ----------
+    matrix_model : MatrixModel
+        The compiled model.
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
+    objective_functions : list((function, Pyomo sense)), optional
+        The objective functions to use. By default, the ones configured in the parameters.
+
+    Returns
+    -------
+    numpy.ndarray or None
+        The solution of the last objective function solved.
+    list(dict)
+        For every stage, the objective function name, its sense, status (message and scipy milp status code)
+        and optimal value.
+    """
+    if objective_functions is None:
+        objective_functions = get_objective_functions(parameters)
+
+    percentage = parameters["percentage_hierarchical_optimization"]
+    options = {'time_limit': parameters["json_file"]["gurobi_time_limit"]}
+    bounds = Bounds(matrix_model.col_lb, matrix_model.col_ub)
+    A = matrix_model.A.tocsr()
+    extra_rows, extra_lb, extra_ub = [], [], []
+    x, stages = None, []
+
+    for number, (obj_f, sense) in enumerate(objective_functions, start = 1):
+        c = matrix_model.objectives[obj_f.__name__]
+        sign = -1 if sense == pe.maximize else 1
+        if extra_rows:
+            constraint_matrix = sp.vstack([A, sp.csr_matrix(np.vstack(extra_rows))])
+            lb, ub = np.concatenate([matrix_model.row_lb, extra_lb]), np.concatenate([matrix_model.row_ub, extra_ub])
+        else:
+            constraint_matrix, lb, ub = A, matrix_model.row_lb, matrix_model.row_ub
+
+        print('        ['+str(dt.datetime.now())+'] Solving the objective function number ' + str(number))
+        result = milp(sign * c, constraints=LinearConstraint(constraint_matrix, lb, ub), bounds=bounds,
+                      integrality=matrix_model.integrality, options=options)
+        if result.x is None:
+            stages.append({'objective': obj_f.__name__, 'sense': str(sense), 'status': result.message, 'status_code': result.status, 'value': None})
+            print("         An error ocurred while solving the objective function number " + str(number))
+            break
+
+        x = result.x
+        bound = float(c @ x)
+        stages.append({'objective': obj_f.__name__, 'sense': str(sense), 'status': result.message, 'status_code': result.status, 'value': bound})
+        print("        Optimal value: " + str(bound))
+
+        if number < len(objective_functions):
+            extra_rows.append(c)
+            if sense == pe.minimize:
+                extra_lb.append(-np.inf)
+                extra_ub.append(max(bound*percentage, bound*(2-percentage)))
+            else:
+                extra_lb.append(min(bound*percentage, bound*(2-percentage)))
+                extra_ub.append(np.inf)
+
+    return x, stages
+
+
+def extract_solution(matrix_model, x):
+    """Maps a solution vector back to the Pyomo variable names and indexes.
+
+    Parameters
+    ----------
+    matrix_model : MatrixModel
+        The compiled model.
+    x : numpy.ndarray
+        Solution vector.
+
+    Returns
+    -------
+    dict(string, dict(tuple, float))
+        For every variable family, the value of every index.
+    """
+    return {name: {index: x[column] for index, column in columns.items()}
+            for name, columns in matrix_model.column_index.items()}
+
+def load_solution(model, matrix_model, x):
+    """Loads a solution vector in the variables of a Pyomo model built from the same data and adds it to
+    the solutions of the model (like a solver does), so the runs stopped by the time limit keep it. The binary
+    variables are rounded.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    matrix_model : MatrixModel
+        The compiled model.
+    x : numpy.ndarray
+        Solution vector.
+    """
+    for name, values in extract_solution(matrix_model, x).items():
+        variable = getattr(model, name)
+        for index, value in values.items():
+            if index in variable:
+                variable[index].set_value(round(value) if variable[index].is_binary() else value, skip_validation=True)
+    add_loaded_solution(model)
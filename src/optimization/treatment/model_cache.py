@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+model_cache.py
+====================================
+This script stores the treatment model between runs. The structure of the model (sets, variables, constraints)
+only depends on the network, so a model built for the same network is reused: the time-varying inputs (flow rates,
+demands, usable percentages, other costs and initial contents) are mutable parameters updated in place, and the
+previous solution is kept as the warm start of the next solve.
+
+The cached models are stored in memory and pickled in the 'model_cache_dir' folder of the parameters json file.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import hashlib, os, pickle
+import pandas as pd
+import pyomo.environ as pe
+import src.optimization.treatment.constraints.constraints as constraints
+from src.optimization.treatment.preprocess_data import get_time_values
+
+#ProcessedData attributes loaded in the mutable parameters (they do not change the model structure)
+MUTABLE_DATA = ['tanks_flow', 'terminal_dinamic_capacity', 'inital_content', 'initial_oil_content', 'sparse_node', 'sparse_arcs', 'injection_cost']
+#Columns of the arcs data loaded in the mutable parameters
+MUTABLE_ARCS_COLUMNS = ['UsablePercentage', 'OtherCosts']
+
+_models = {}
+
+
+def _hash_value(value, digest):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=repr):
+            digest.update(repr(key).encode())
+            _hash_value(value[key], digest)
+    elif isinstance(value, (set, frozenset, list, tuple)):
+        digest.update(repr(sorted(map(repr, value))).encode())
+    else:
+        digest.update(repr(value).encode())
+
+def get_signature(processed_data, useful_sets, attributes_with_time, *options):
+    """Returns the hash of everything that defines the model structure: the sets, the data
+    that is not loaded in the mutable parameters and the formulation options.
+
+    Parameters
+    ----------
+    processed_data : ProcessedData
+        It has all the model's processed data.
+    useful_sets : UsefulSets
+        It has all the model's sets.
+    attributes_with_time: Dictionary(string, pd.Dataframe)
+        Time dependent attributes of nodes and arcs.
+    options: string
+        Options that change the model structure (e.g. the contaminant formulation).
+
+    Returns
+    -------
+    string
+        The model signature.
+    """
+    digest = hashlib.sha256()
+    _hash_value(vars(useful_sets), digest)
+    for key in sorted(vars(processed_data)):
+        value = getattr(processed_data, key)
+        if key in MUTABLE_DATA or not isinstance(value, (pd.DataFrame, pd.Series, dict, int, float, str)):
+            continue
+        if key == 'arcs_data':
+            value = value.drop(columns=MUTABLE_ARCS_COLUMNS, errors='ignore')
+        if key == 'previous_period': #only the arcs with a previous value change the structure
+            value = {name: sorted(values) for name, values in value.items()}
+        digest.update(key.encode())
+        _hash_value(value, digest)
+    _hash_value(dict(zip(['static', 'overrides'], get_time_values(attributes_with_time, 'Nominal_Value'))), digest)
+    _hash_value(options, digest)
+    return digest.hexdigest()
+
+def clear_objective_expressions(model):
+    """Removes the compiled objective functions and the variables with the value of the hierarchical stages
+    with their definition rows (see make_model.get_objective_expression and make_model.get_stage_variable).
+    They are built again when the model is solved.
+    """
+    for variable in list(model.component_objects(pe.Var)):
+        if variable.name.startswith('value_'):
+            model.del_component(variable.name + '_definition')
+            model.del_component(variable)
+    for expression in list(model.component_objects(pe.Expression)):
+        if expression.name.startswith('objective_'):
+            model.del_component(expression)
+    return model
+
+def update_time_parameters(model, attributes_with_time):
+    """Loads the time dependent attributes of the arcs in the mutable parameters: the static value of every arc
+    and the values of the periods where they change (the other periods already stored take the static value).
+    The expressions of the periods that start to change were built with the static parameter of the arc, so
+    the capacity of their arcs and the objective functions are built again.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    attributes_with_time: Dictionary(string, pd.Dataframe)
+        Time dependent attributes of nodes and arcs.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    new_periods = {}
+    for column, static_param, periods, param in [("UsablePercentage", model.arc_usable_percentage, model.usable_percentage_periods, model.usable_percentage),
+                                                 ('OtherCosts', model.arc_other_cost, model.other_cost_periods, model.other_cost)]:
+        static, overrides = get_time_values(attributes_with_time, column)
+        static_param.store_values({index: value for index, value in static.items() if index in static_param})
+        new_periods[column] = [(i, j, t) for (i, j, t) in overrides if (i, j, t) not in periods and (i, j) in static_param and t in model.time_dim]
+        for index in new_periods[column]:
+            periods.add(index)
+        values = {(i, j, t): pe.value(static_param[i, j]) for (i, j, t) in periods}
+        values.update((index, value) for index, value in overrides.items() if index in periods)
+        param.store_values(values)
+
+    constraints.update_arcs_capacity(model, new_periods["UsablePercentage"])
+    if new_periods['OtherCosts']:
+        clear_objective_expressions(model)
+    return model
+
+def update_parameters(model, processed_data, attributes_with_time):
+    """Loads the time-varying inputs in the mutable parameters of the model.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    processed_data : ProcessedData
+        It has all the model's processed data.
+    attributes_with_time: Dictionary(string, pd.Dataframe)
+        Time dependent attributes of nodes and arcs.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The optimization model.
+    """
+    model = update_time_parameters(model, attributes_with_time)
+    #the contents missing in the data (e.g. the initial nodes out of a rolling horizon window) are 0
+    previous_period = processed_data.previous_period or {}
+    values = [(model.water_in, processed_data.tanks_flow["WaterQty"].to_dict()),
+              (model.oil_in, processed_data.tanks_flow["OilQty"].to_dict()),
+              (model.ending_demand, processed_data.terminal_dinamic_capacity["Aditional Total Capacity"].to_dict()),
+              (model.initial_content, {**dict.fromkeys(model.initial_content, 0), **processed_data.inital_content}),
+              (model.initial_oil_content, {**dict.fromkeys(model.initial_oil_content, 0), **processed_data.initial_oil_content}),
+              (model.previous_flow, previous_period.get('x_water', {})),
+              (model.previous_pond_activity, previous_period.get('x_active_arc_pond', {}))]
+    for param, data in values:
+        param.store_values({index: value for index, value in data.items() if index in param})
+    #the closed arcs and the big-M depend on the usable percentages (and the big-M on the initial contents)
+    model = constraints.update_closed_arcs(model)
+    return constraints.update_big_m(model)
+
+def load_model(parameters, signature):
+    """Returns the cached model with the signature, or None if there is not one.
+
+    Parameters
+    ----------
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
+    signature : string
+        The model signature.
+
+    Returns
+    -------
+    Pyomo ConcreteModel
+        The cached model.
+    """
+    if signature in _models:
+        return _models[signature]
+    path = os.path.join(parameters["json_file"]["model_cache_dir"], f'treatment_{signature}.pkl')
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            _models[signature] = pickle.load(f)
+        return _models[signature]
+    return None
+
+def save_model(model, parameters):
+    """Stores the model (and its solution) in the cache.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model. It must have the signature attribute.
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
+    """
+    _models[model.signature] = model
+    cache_dir = parameters["json_file"]["model_cache_dir"]
+    os.makedirs(cache_dir, exist_ok=True)
+    #solvers can not be pickled and the inputs of the run are not part of the model
+    attributes = {key: getattr(model, key, None) for key in ('persistent_solver', 'treatment_inputs')}
+    for key in attributes:
+        setattr(model, key, None)
+    try:
+        with open(os.path.join(cache_dir, f'treatment_{model.signature}.pkl'), 'wb') as f:
+            pickle.dump(model, f)
+    finally:
+        for key, value in attributes.items():
+            setattr(model, key, value)
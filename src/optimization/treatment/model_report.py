@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+model_report.py
+====================================
+This script stores the timing spans of the treatment model (sets, parameters, variables, every constraint family,
+every hierarchical stage and the output generation) together with the number of variables, constraints and nonzeros
+that every span added to the model. The report is saved as a json file next to the model outputs.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import json, time
+import datetime as dt
+from contextlib import contextmanager
+import pyomo.environ as pe
+from pyomo.common.collections import ComponentMap
+from pyomo.core.expr.visitor import identify_variables
+
+
+class ModelReport:
+    """Collects the timing spans and model sizes of a treatment model.
+    """
+    def __init__(self) -> None:
+        """ModelReport Initializer
+        """
+        self.spans = []
+        self.runtime = None
+        self.times = {}
+        self.totals = {'variables': 0, 'constraints': 0, 'nonzeros': 0}
+        self._counted = ComponentMap()
+
+    @contextmanager
+    def span(self, name, model=None):
+        """Times the block and, if the model is given, counts the variables, constraints and nonzeros added in it.
+        The span dictionary is yielded, so the block can add its own fields.
+
+        Parameters
+        ----------
+        name : string
+            Name of the span.
+        model : Pyomo ConcreteModel, optional
+            The optimization model.
+        """
+        span = {'name': name, 'start': str(dt.datetime.now())}
+        tik = time.time()
+        try:
+            yield span
+        finally:
+            span['seconds'] = time.time() - tik
+            if model is not None:
+                span.update(self.count_new_components(model))
+                span.update({'total_' + key: value for key, value in self.totals.items()})
+            self.spans.append(span)
+
+    def count_new_components(self, model):
+        """Counts the variables, active constraints and nonzeros of the components not counted before.
+        Only the new components are visited, so the whole model is visited once along all the spans.
+        The components are tracked by object, not by name: the ones deleted from the model (e.g. the objective
+        functions and stage variables rebuilt on a re-solve) are taken out of the totals, and the new
+        components with their names are counted again.
+
+        Parameters
+        ----------
+        model : Pyomo ConcreteModel
+            The optimization model.
+
+        Returns
+        -------
+        dict(string, int)
+            Number of variables, constraints and nonzeros added.
+        """
+        sizes = {'variables': 0, 'constraints': 0, 'nonzeros': 0}
+        components = ComponentMap((component, None) for component in model.component_objects((pe.Var, pe.Constraint), descend_into=True))
+        for component in [component for component in self._counted if component not in components]:
+            for key, value in self._counted.pop(component).items():
+                self.totals[key] -= value
+        for component in components:
+            if component in self._counted:
+                continue
+            component_sizes = {'variables': 0, 'constraints': 0, 'nonzeros': 0}
+            if component.ctype is pe.Var:
+                component_sizes['variables'] = len(component)
+            else:
+                for constraint in component.values():
+                    if constraint.active:
+                        component_sizes['constraints'] += 1
+                        component_sizes['nonzeros'] += sum(1 for _ in identify_variables(constraint.body, include_fixed=False))
+            self._counted[component] = component_sizes
+            for key, value in component_sizes.items():
+                sizes[key] += value
+                self.totals[key] += value
+        return sizes
+
+    def to_dict(self):
+        return {'runtime': self.runtime, 'times': self.times, 'totals': self.totals, 'spans': self.spans}
+
+    def to_json(self, path):
+        """Saves the report in a json file.
+
+        Parameters
+        ----------
+        path : string
+            Path of the json file.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4, default=str)
+
+
+def get_report(model):
+    """Returns the report of the model, creating it if the model does not have one yet.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+
+    Returns
+    -------
+    ModelReport
+        The report of the model.
+    """
+    if getattr(model, 'report', None) is None:
+        model.report = ModelReport()
+    return model.report
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+input_cache.py
+====================================
+Local cache of the parsed input files. The Dataframes read from a file are stored in a folder named after the
+content of the file (its hash, or its ETag in the s3 bucket), so they are loaded again while the file does not
+change. The Dataframes are stored as parquet files when pyarrow is installed (pickle files otherwise) and the
+least recently used folders are removed when the cache has more than 'input_cache_size' entries.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import hashlib, os, pickle, shutil, uuid
+import pandas as pd
+
+DEFAULT_SIZE = 32
+
+
+def get_key(*parts):
+    """Returns the cache key of the parts (e.g. the reader name, the file name and its version)."""
+    return hashlib.sha256('|'.join(map(str, parts)).encode()).hexdigest()
+
+def file_hash(path):
+    """Returns the hash of the content of a local file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def save_frame(df, path):
+    """Saves the Dataframe as a parquet file, or as a pickle file if it can not be (pyarrow is not installed
+    or the Dataframe has columns parquet does not support)."""
+    try:
+        df.to_parquet(path + '.parquet')
+    except Exception:
+        if os.path.exists(path + '.parquet'):
+            os.remove(path + '.parquet')
+        df.to_pickle(path + '.pkl')
+
+def load_frame(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+def load(cache_dir, key):
+    """Returns the Dataframes stored with the key, or None if they are not in the cache.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Folder of the cache.
+    key : str
+        The cache key.
+
+    Returns
+    -------
+    dict(str, pd.DataFrame)
+        The cached Dataframes.
+    """
+    folder = os.path.join(cache_dir, key)
+    if not os.path.isdir(folder):
+        return None
+    try:
+        frames = {os.path.splitext(name)[0]: load_frame(os.path.join(folder, name)) for name in os.listdir(folder)}
+    except (OSError, ValueError, ImportError, pickle.UnpicklingError):
+        shutil.rmtree(folder, ignore_errors=True) #a broken entry is read again from the source
+        return None
+    os.utime(folder) #the modification time is the last use of the entry
+    return frames
+
+def store(cache_dir, key, frames, size=DEFAULT_SIZE):
+    """Stores the Dataframes with the key and removes the least recently used entries.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Folder of the cache.
+    key : str
+        The cache key.
+    frames : dict(str, pd.DataFrame)
+        The Dataframes read from the file.
+    size : int, optional
+        Maximum number of entries of the cache.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    folder = os.path.join(cache_dir, key)
+    tmp_folder = os.path.join(cache_dir, f'.{key}.{uuid.uuid4().hex}')
+    os.makedirs(tmp_folder)
+    try:
+        for name, df in frames.items():
+            save_frame(df, os.path.join(tmp_folder, name))
+        shutil.rmtree(folder, ignore_errors=True)
+        os.replace(tmp_folder, folder)
+    finally:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if not name.startswith('.')]
+    entries.sort(key=os.path.getmtime)
+    for entry in entries[:max(len(entries) - size, 0)]:
+        shutil.rmtree(entry, ignore_errors=True)
+
+def read_cached(cache_dir, key, reader, size=DEFAULT_SIZE):
+    """Returns the Dataframes of the key from the cache. On a miss, they are read with the reader and stored.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Folder of the cache.
+    key : str
+        The cache key.
+    reader : function
+        Function without arguments that reads the Dataframes from the source.
+    size : int, optional
+        Maximum number of entries of the cache.
+
+    Returns
+    -------
+    dict(str, pd.DataFrame)
+        The Dataframes.
+    """
+    frames = load(cache_dir, key)
+    if frames is None:
+        frames = reader()
+        store(cache_dir, key, frames, size)
+    return frames
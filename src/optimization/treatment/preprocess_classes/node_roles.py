@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+node_roles.py
+====================================
+Role table of the model's nodes. Every node gets an integer id and a bitmask with its roles (initial, ending,
+tank, pump...), so the constraints and the outputs check the role of a node with one lookup instead of scanning
+(or copying to lists) the sets of every node type.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+from array import array
+
+#Roles, in the order node_type reports them (a node with several roles gets the first one)
+INITIAL = 1 << 0
+ENDING = 1 << 1
+TANK = 1 << 2
+PUMP = 1 << 3
+SPLITTER = 1 << 4
+MIXER = 1 << 5
+PROCESS = 1 << 6
+TREATMENT = 1 << 7
+OIL_TREATMENT = 1 << 8
+COOLING_TOWER = 1 << 9
+BOILER = 1 << 10
+LOSS_TANK = 1 << 11
+POND = 1 << 12
+OIL = 1 << 13
+
+STORAGE = TANK | POND
+
+#Role, key of the UsefulSets with its nodes and type reported in the outputs
+ROLES = [(INITIAL, 'initial_nodes', "Initial"),
+         (ENDING, 'ending_nodes', "Ending"),
+         (TANK, 'tank_nodes', "Tank"),
+         (PUMP, 'pumps_nodes', "Pump"),
+         (SPLITTER, 'splitter_nodes', "Splitter"),
+         (MIXER, 'mixer_nodes', "Mixer"),
+         (PROCESS, 'process_nodes', "Process"),
+         (TREATMENT, 'treatment_nodes', "Treatment"),
+         (OIL_TREATMENT, 'oil_treatment_nodes', "Oil Treatment"),
+         (COOLING_TOWER, 'cooling_tower_nodes', "Cooling TW"),
+         (BOILER, 'boiler_nodes', "Boiler"),
+         (LOSS_TANK, 'loss_tank_nodes', "Loss"),
+         (POND, 'pond_nodes', "Ponds"),
+         (OIL, 'oil_nodes', None)]
+
+
+class NodeRoles:
+    """The goal is to check the roles of the nodes in constant time. It stores the id and the roles bitmask
+    of every node.
+    """
+    def __init__(self, nodes, sets) -> None:
+        """NodeRoles Initializer
+
+        Parameters
+        ----------
+        nodes : Set(string)
+            All active model's nodes.
+        sets : dict
+            Dictionary of sets with the nodes of every role (the keys of ROLES, e.g. 'initial_nodes').
+        """
+        self.ids = {node: k for k, node in enumerate(sorted(nodes))}
+        self.masks = array('l', [0] * len(self.ids))
+        for role, key, _ in ROLES:
+            for node in sets[key]:
+                self.masks[self.ids[node]] |= role
+        self.types = {}
+        for node, k in self.ids.items():
+            self.types[node] = next((name for role, _, name in ROLES if name and self.masks[k] & role), None)
+
+    def mask(self, node):
+        """Returns the roles bitmask of the node (0 if it is not an active node)."""
+        k = self.ids.get(node)
+        return 0 if k is None else self.masks[k]
+
+    def has(self, node, roles):
+        """Checks if the node has any of the roles.
+
+        Parameters
+        ----------
+        node : string
+            The node.
+        roles : int
+            Bitmask of roles, e.g. TANK | POND.
+
+        Returns
+        -------
+        boolean
+            True if the node has at least one of the roles.
+        """
+        return bool(self.mask(node) & roles)
+
+    def node_type(self, node):
+        """Returns the type of the node reported in the outputs (None if it has none)."""
+        return self.types.get(node)
+
+    def __repr__(self) -> str:
+        #deterministic, it is part of the model cache signature
+        return f"NodeRoles({sorted(self.ids)!r}, {list(self.masks)!r})"
@@ -9,9 +9,20 @@ Auxiliar class to help reading, processing and storing input dataframes
      - g.munera.gonzalez
      - yeison.diaz
 """
-import sys, re
+import sys, os, re, io
 import pandas as pd
+import openpyxl
 from src.commons.s3_manager import S3Manager
+from src.commons.s3_transfer import S3Transfer
+from src.optimization.treatment.preprocess_classes import input_cache
+
+#Identifiers and flags are read as text, so numeric IDs (e.g. pump 101) are not parsed as numbers
+TEXT_COLUMNS = ['ID', 'Node_Start', 'Node_End', 'Tank', 'PUMP', 'Active', 'HasOil', 'Attribute', 'Contaminant']
+TEXT_DTYPES = {column: str for column in TEXT_COLUMNS}
+
+def is_named_column(column):
+    """Returns False for the columns without header (notes or helper cells of the workbooks)."""
+    return not str(column).startswith('Unnamed')
 
 class ProcessedData(S3Manager):
     """ It has all the processed model related data.
@@ -27,6 +38,7 @@ class ProcessedData(S3Manager):
             Define if read from S3 or not
         '''
         self.parameters, self.s3_data = parameters, s3_data
+        self.s3_objects = {} #objects downloaded in advance
         self.conf_file_dict = {
             'arcs_raw_data': 'Arc_CPF', 'oil_fixed_treatment_arcs_raw_data': 'Arcs_Fixed_Oil_Treat',
             'fixed_splitter_arcs_raw_data': 'Arcs_Fixed_Splitter', 'initial_nodes_raw_data': 'Node_Start',
@@ -69,29 +81,7 @@ class ProcessedData(S3Manager):
                - Flow rates
         '''
         print('    reading data from one drive...')
-        load_data = {}
-        #reading configuration file
-        for key, sheet in self.conf_file_dict.items():
-            load_data[key] = pd.read_excel(self.parameters["data_file_dir"], sheet_name=sheet)
-
-        #reading pump models
-        load_data['pumps_energy_models_raw_data'] = pd.read_csv(self.parameters["pump_energy_model_dir"])
-
-        #reading flow_rates
-        temp_xl = pd.ExcelFile(self.parameters["flow_file"])
-        tanks_flow_raw = []
-        for i in temp_xl.sheet_names:
-            if i == "EVAPORATION":
-                _evap_df = pd.read_excel(temp_xl, sheet_name=i)
-                load_data ['evaporation_raw'] = _evap_df[_evap_df["time"]<=period]
-            else:
-                temp_df = pd.read_excel(temp_xl, sheet_name=i)
-                temp_df['Tank'] = i 
-                tanks_flow_raw.append(temp_df)
-        tanks_flow_raw = pd.concat(tanks_flow_raw)
-        tanks_flow_raw = tanks_flow_raw[tanks_flow_raw["time"]<=period]
-        load_data['tanks_flow_raw'] = tanks_flow_raw
-        return load_data
+        return self.read_inputs(period)
 
     def read_s3data(self, period):
         '''Method defined to read data from s3 bucket
@@ -106,35 +96,164 @@ class ProcessedData(S3Manager):
         '''
         print('    reading data from s3 bucket...')
         S3Manager.__init__(self)
-        
-        load_data = {}
-        #reading configuration file
-        for key, sheet in self.conf_file_dict.items():
-            load_data[key] = self.get_s3data(self.parameters["data_file_dir"], sheet_name=sheet)
+        return self.read_inputs(period, s3=True)
+
+    def read_inputs(self, period, s3=False):
+        '''Reads the configuration file, the pump energy models and the flow rates, through the input cache
+        if the parameters json file has the 'input_cache_dir' key
+
+        Parameters
+        ----------
+        period : int
+            Last period of the simulation
+        s3 : bool, optional, default False
+            Read the files from the s3 bucket
+
+        Returns
+        -------
+        load_data : dict
+            Dictionary with loaded data
+        '''
+        if s3 and not self.parameters["json_file"].get("input_cache_dir"):
+            #the three files are downloaded at the same time (with the input cache, only the changed ones are downloaded)
+            paths = [self.parameters["data_file_dir"], self.parameters["pump_energy_model_dir"], self.parameters["flow_file"]]
+            self.s3_objects = S3Transfer(self.bucket, self.client).get_objects(paths)
+
+        #reading configuration file (downloaded once for all its sheets)
+        load_data = self.read_input(self.parameters["data_file_dir"], self.read_config_file, s3)
 
         #reading pump models
-        load_data['pumps_energy_models_raw_data'] = self.get_s3data(self.parameters["pump_energy_model_dir"])
+        load_data.update(self.read_input(self.parameters["pump_energy_model_dir"], ProcessedData.read_pump_models, s3))
 
         #reading flow_rates
-        obj = self.client.get_object(
-            Bucket=self.bucket,
-            Key=self.parameters["flow_file"]
-        )
-        temp_xl = pd.ExcelFile(obj['Body'].read())
+        load_data.update(self.read_input(self.parameters["flow_file"], ProcessedData.read_flow_rates, s3, period))
+        return load_data
+
+    def read_input(self, path, reader, s3=False, *options):
+        '''Reads a file with the reader. If the parameters json file has the 'input_cache_dir' key, the Dataframes
+        are loaded from the cache while the file content (or its ETag in the s3 bucket) does not change
+
+        Parameters
+        ----------
+        path : str
+            Path of the file (key of the object in the s3 bucket)
+        reader : function
+            Function that reads the file (path or content, and the options) and returns a dict of Dataframes
+        s3 : bool, optional, default False
+            Read the file from the s3 bucket
+        options :
+            Other arguments of the reader (e.g. the period)
+
+        Returns
+        -------
+        dict
+            The Dataframes read
+        '''
+        read = lambda: reader(self.get_s3object(path) if s3 else path, *options)
+        cache_dir = self.parameters["json_file"].get("input_cache_dir")
+        if not cache_dir:
+            return read()
+        version = self.client.head_object(Bucket=self.bucket, Key=path)['ETag'] if s3 else input_cache.file_hash(path)
+        key = input_cache.get_key(reader.__name__, os.path.basename(path), version, *options)
+        return input_cache.read_cached(cache_dir, key, read, self.parameters["json_file"].get("input_cache_size", input_cache.DEFAULT_SIZE))
+
+    def get_s3object(self, key):
+        '''Downloads an object of the s3 bucket
+
+        Parameters
+        ----------
+        key : str
+            Key of the object in the bucket
+
+        Returns
+        -------
+        io.BytesIO
+            Content of the object
+        '''
+        content = self.s3_objects.pop(key, None)
+        if content is None:
+            content = S3Transfer(self.bucket, self.client).get_object(key)
+        return io.BytesIO(content)
+
+    def read_config_file(self, source):
+        '''Reads all the sheets of the configuration file in one pass: the workbook is opened once and
+        only the columns with header are read.
+
+        Parameters
+        ----------
+        source : str or file-like
+            Path or content of the configuration file
+
+        Returns
+        -------
+        load_data : dict
+            Dictionary with one Dataframe per key of conf_file_dict
+        '''
+        sheets = pd.read_excel(source, sheet_name=list(self.conf_file_dict.values()), usecols=is_named_column, dtype=TEXT_DTYPES)
+        return {key: sheets[sheet] for key, sheet in self.conf_file_dict.items()}
+
+    @staticmethod
+    def read_pump_models(source):
+        '''Reads the pump energy models file'''
+        return {'pumps_energy_models_raw_data': pd.read_csv(source, dtype=TEXT_DTYPES)}
+
+    @staticmethod
+    def read_flow_rates(source, period):
+        '''Reads the flow rates file (one sheet per tank and the EVAPORATION one) row by row, keeping only the
+        rows of the simulated periods, so the memory used depends on the periods and not on the file length.
+
+        Parameters
+        ----------
+        source : str or file-like
+            Path or content of the flow rates file
+        period : int
+            Last period of the simulation
+
+        Returns
+        -------
+        load_data : dict
+            Dictionary with the tanks flow rates ('tanks_flow_raw') and the evaporation rates ('evaporation_raw')
+        '''
+        load_data = {}
         tanks_flow_raw = []
-        for i in temp_xl.sheet_names:
-            if i == "EVAPORATION":
-                _evap_df = pd.read_excel(temp_xl, sheet_name=i)
-                load_data ['evaporation_raw'] = _evap_df[_evap_df["time"]<=period]
-            else:
-                temp_df = pd.read_excel(temp_xl, sheet_name=i)
-                temp_df['Tank'] = i 
-                tanks_flow_raw.append(temp_df)
-        tanks_flow_raw = pd.concat(tanks_flow_raw)
-        tanks_flow_raw = tanks_flow_raw[tanks_flow_raw["time"]<=period]
-        load_data['tanks_flow_raw'] = tanks_flow_raw
+        workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                temp_df = ProcessedData.read_periods(sheet, period)
+                if sheet.title == "EVAPORATION":
+                    load_data ['evaporation_raw'] = temp_df
+                else:
+                    temp_df['Tank'] = sheet.title 
+                    tanks_flow_raw.append(temp_df)
+        finally:
+            workbook.close()
+        load_data['tanks_flow_raw'] = pd.concat(tanks_flow_raw)
         return load_data
 
+    @staticmethod
+    def read_periods(sheet, period):
+        '''Reads the rows of a sheet with time <= period (the first row is the header)
+
+        Parameters
+        ----------
+        sheet : openpyxl read only worksheet
+            Sheet of the flow rates file
+        period : int
+            Last period of the simulation
+
+        Returns
+        -------
+        pandas.core.frame.DataFrame
+            The rows of the simulated periods
+        '''
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, ())
+        positions = [i for i, column in enumerate(header) if column is not None] #the columns without header are skipped
+        time = header.index("time")
+        data = [[row[i] if i < len(row) else None for i in positions] for row in rows
+                if time < len(row) and isinstance(row[time], (int, float)) and row[time] <= period]
+        return pd.DataFrame(data, columns=[header[i] for i in positions])
+
     @staticmethod
     def clean_nodes(data):
         """Method that takes a Dataframe with node information and cleans it
@@ -372,7 +491,11 @@ class ProcessedData(S3Manager):
             'sparse_node' : sparse_node,
             'sparse_arcs' : sparse_arcs,
             'injection_cost' : cost_of_injection,
-            'evaporation_rates': evaporation_rates
+            'evaporation_rates': evaporation_rates,
+            #the inputs do not have the oil stored in the nodes, nor the period before the first one
+            #(a rolling horizon window takes them from the previous window)
+            'initial_oil_content': {},
+            'previous_period': None
         }
 
         return proc_data
@@ -428,6 +551,11 @@ class ProcessedData(S3Manager):
             - All the flow rates for each tank in time t
             evaporation_rates :
             - All the evaporation rates for ponds in time t
+            initial_oil_content :
+            - The oil stored in the tanks, ponds and initial nodes before the first period (empty, no oil)
+            previous_period :
+            - The flows ('x_water') and pond activities ('x_active_arc_pond') of the stability arcs in the period
+              before the first one, or None
 
         """
         print('    creating class attributes...')
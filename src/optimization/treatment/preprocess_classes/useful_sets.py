@@ -67,6 +67,8 @@ class UsefulSets:
                     Given a node_2, it returns all the node_3 that are connected via an arc (node_2, node_3)
                 time_projection : Set (int)
                     Given the number of time periods to run the model
+                node_roles : NodeRoles
+                    Id and roles bitmask of every node
         """
 
         for key, value in sets.items():
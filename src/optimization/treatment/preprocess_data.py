@@ -13,9 +13,13 @@ Functions to read, process, store and instantiate all related objects, databases
 """
 
 from collections import defaultdict
+import numpy as np
 import pandas as pd
 from src.optimization.treatment.preprocess_classes.useful_sets import UsefulSets
 from src.optimization.treatment.preprocess_classes.processed_data import ProcessedData
+from src.optimization.treatment.preprocess_classes.node_roles import NodeRoles
+
+ARC_TIME_INDEX = ['Node_Start', 'Node_End', 'time']
 
 
 def separate_splitter_nodes(processed_data, splitter_nodes, loss_tanks):
@@ -52,6 +56,123 @@ def separate_splitter_nodes(processed_data, splitter_nodes, loss_tanks):
     return splitter_nodes_with_loss_tanks, splitter_nodes_without_loss_tanks
 
 
+def get_reachable_nodes(sources, neighbours):
+    """Returns the nodes that can be reached from the sources following the neighbours.
+
+    Parameters
+    ----------
+    sources : set(string)
+        Nodes where the search starts.
+    neighbours : Dictionary(string, set(string))
+        Given a node, the nodes that are connected to it (exits to search forward, entry to search backward).
+
+    Returns
+    -------
+    set(string)
+        The sources and every node reachable from them.
+    """
+    reached = set(sources)
+    pending = list(sources)
+    while pending:
+        node = pending.pop()
+        for neighbour in neighbours.get(node, ()):
+            if neighbour not in reached:
+                reached.add(neighbour)
+                pending.append(neighbour)
+    return reached
+
+
+def presolve_network(processed_data):
+    """Removes the nodes and arcs that can not carry water: the ones that no initial node, tank or pond
+    can reach and the ones that can not reach a node able to keep the water (ending nodes, loss tanks,
+    tanks, ponds and nodes with capacity). Initial and ending nodes are always kept.
+
+    Parameters
+    ----------
+    processed_data : ProcessedData
+        It has all the processed model's data.
+
+    Returns
+    -------
+    ProcessedData
+        It has all the processed model's data, without the pruned nodes and arcs.
+    """
+    nodes = set(processed_data.nodes_data.index)
+    initial_nodes = set(processed_data.initial_nodes_data.index)
+    ending_nodes = set(processed_data.ending_nodes_data.index)
+    storage_nodes = set(processed_data.tanks_nodes_data.index) | set(processed_data.ponds_nodes_data.index)
+
+    exits = defaultdict(set)
+    entry = defaultdict(set)
+    for (i, j) in processed_data.arcs_data.index:
+        if i in nodes and j in nodes:
+            exits[i].add(j)
+            entry[j].add(i)
+
+    sources = initial_nodes | storage_nodes
+    sinks = ending_nodes | storage_nodes | set(processed_data.loss_tanks_nodes_data.index)\
+        | set(processed_data.nodes_data[processed_data.nodes_data['MaxCapacity'] > 0].index)
+    forward = get_reachable_nodes(sources, exits)
+    backward = get_reachable_nodes(sinks, entry)
+
+    kept_nodes = initial_nodes | ending_nodes | (forward & backward)
+    kept_arcs = set((i, j) for i in exits for j in exits[i] if i in forward and j in backward)
+    pruned_nodes = nodes - kept_nodes
+    pruned_arcs = set(processed_data.arcs_data.index) - kept_arcs
+    if not pruned_nodes and not pruned_arcs:
+        return processed_data
+
+    print(f'    presolve: removing {len(pruned_nodes)} nodes and {len(pruned_arcs)} arcs that can not carry water...')
+    if pruned_nodes:
+        print('        nodes: ' + ', '.join(sorted(pruned_nodes)))
+    if pruned_arcs:
+        print('        arcs: ' + ', '.join(f'{i}->{j}' for i, j in sorted(pruned_arcs)))
+
+    for key, value in vars(processed_data).items():
+        if not isinstance(value, pd.DataFrame) or len(value) == 0:
+            continue
+        if key.endswith('arcs_data') or key == 'sparse_arcs':
+            arcs_index = value.index.droplevel('time') if 'time' in value.index.names else value.index
+            setattr(processed_data, key, value[arcs_index.isin(kept_arcs)])
+        elif key.endswith('nodes_data') or key.endswith('contaminants_data') or key == 'sparse_node'\
+            or key.startswith('initial_content_contaminants'):
+            setattr(processed_data, key, value[~value.index.get_level_values(0).isin(pruned_nodes)])
+    return processed_data
+
+
+def get_contaminated_nodes(processed_data, contaminants, exits):
+    """Returns the nodes that some contaminated source (initial node, tank or pond with contaminants, or
+    process node that adds the contaminant) can reach, by contaminant. The concentration of the rest of
+    the nodes and arcs is always 0, so their contaminant variables are not created.
+
+    Parameters
+    ----------
+    processed_data : ProcessedData
+        It has all the processed model's data.
+    contaminants : set(string)
+        All the contaminants of the system.
+    exits : Dictionary(string, set(string))
+        Given a node, it returns all the nodes that are connected via an arc (node, node_2).
+
+    Returns
+    -------
+    set((string, string))
+        The (node, contaminant) pairs that can have contaminants.
+    """
+    contaminated_sources = [processed_data.initial_nodes_contaminants_data['value'],
+                            processed_data.initial_content_contaminants_tanks['value'],
+                            processed_data.initial_content_contaminants_ponds['value'],
+                            processed_data.process_nodes_contaminants_data['Addition_Qty(mg)']]
+    contaminated_nodes = set()
+    for contaminant in contaminants:
+        sources = set()
+        for data in contaminated_sources:
+            data = data[(data.index.get_level_values('Contaminant') == contaminant) & (data.fillna(0) != 0)]
+            sources.update(data.index.get_level_values(0))
+        contaminated_nodes.update((node, contaminant) for node in get_reachable_nodes(sources, exits))
+    return contaminated_nodes
+
+
 def generate_useful_sets(processed_data):
     """Generates some sets that will make the model's generation easier.
 
@@ -155,6 +276,13 @@ def generate_useful_sets(processed_data):
         exits[i].add(j)
         entry[j].add(i)
          
+    #Nodes and arcs that contaminated sources can reach, by contaminant
+    if processed_data.parameters["json_file"].get("presolve", False):
+        contaminant_nodes = get_contaminated_nodes(processed_data, contaminants, exits)
+    else:
+        contaminant_nodes = set((node, contaminant) for node in nodes for contaminant in contaminants)
+    contaminant_arcs = set((i, j, contaminant) for (i, j) in arcs for contaminant in contaminants if (i, contaminant) in contaminant_nodes)
+
     #Time period
     time_projection={int(processed_data.time_periods)}
     
@@ -200,12 +328,16 @@ def generate_useful_sets(processed_data):
         'arcs_water_stability_low_priority': arcs_water_stability_low_priority,
         'mixer_nodes_pond_stability': mixer_nodes_pond_stability,
         'arcs_pond_stability': arcs_pond_stability,
+        'contaminant_nodes': contaminant_nodes,
+        'contaminant_arcs': contaminant_arcs,
         'oil_arcs': oil_arcs, 
         'flag_arcs': flag_arcs, 
         'entry': entry, 
         'exits': exits,
         'time_projection': time_projection
     }
+    #Role table of the nodes (id and roles bitmask), to check the role of a node without scanning the sets
+    sets['node_roles'] = NodeRoles(nodes, sets)
 
     useful_sets = UsefulSets(sets)
 
@@ -234,11 +366,10 @@ def update_processed_data(processed_data, useful_sets):
     return processed_data
 
 def create_time_parameters(processed_data, useful_sets):
-    """ Adds the time attribute to the following parameters of the model:
-    - Nodes: Min Capacity, Max Capacity, Other Costs, Active and HasOil
-    - Arcs:Min Flow, Max Flow, Active, HasOil, Usable Percentage, Recirculation and ArcFlowCost
-    
-    and returns it in a new Dataframe
+    """ Returns the time dependent attributes of the arcs (Usable Percentage, Other Costs, Nominal Value and
+    the other attributes of the sparse arcs data) without repeating them in every period: the static value of
+    every arc and, apart, only the values that change in some periods (given in the sparse nodes and arcs data
+    and the injection cost).
     
     Parameters
     ----------
@@ -249,38 +380,185 @@ def create_time_parameters(processed_data, useful_sets):
     Returns 
     ----------
     Dictionary of Dataframes
-        The Dataframes which contains the new time attribute.
+        'arcs_data' has the static attributes indexed by (Node_Start, Node_End) and 'arcs_overrides' the values
+        of some periods indexed by (Node_Start, Node_End, time) (null where the static value is kept).
     """
     number_of_periods = list(useful_sets.time_projection)[0]
     
-    nodes_with_time = update_nodes_parameters(processed_data, number_of_periods)
+    nodes_costs, nodes_overrides = update_nodes_parameters(processed_data, number_of_periods)
 
-    attributes_with_time = update_arcs_parameters(processed_data, nodes_with_time)
+    attributes_with_time = update_arcs_parameters(processed_data, nodes_costs, nodes_overrides, number_of_periods)
     return attributes_with_time
 
-def update_arcs_parameters(processed_data, nodes_with_time):
-    arcs_df = processed_data.arcs_data.copy()   
-    arcs_df.reset_index(inplace = True)
-    attributes_with_time = {}
-    attributes_with_time["arcs_data"] = pd.merge(
-                                    left=arcs_df.drop('OtherCosts', axis = 1), right=nodes_with_time[['ID','time','OtherCosts']], left_on='Node_End',
-                                    right_on='ID', how='left'
-                                    ).drop('ID', axis=1)
-    attributes_with_time["arcs_data"].set_index(["Node_Start", "Node_End", "time"], inplace = True)
-    attributes_with_time["arcs_data"].update(processed_data.sparse_arcs)
-    return attributes_with_time
+def get_overrides(overrides, column, index, number_of_periods):
+    """Returns the values of a time dependent attribute given by the user (sparse nodes or arcs data). Null values
+    and unknown elements or periods are ignored.
+
+    Parameters
+    ----------
+    overrides : pd.DataFrame
+        Values given by the user, indexed by element and time.
+    column : string
+        The attribute.
+    index : pd.Index
+        The known elements.
+    number_of_periods : int
+        Number of periods.
+
+    Returns
+    -------
+    pd.Series
+        The values of the attribute, indexed by element and time.
+    """
+    if column not in overrides.columns:
+        return pd.Series(index=overrides.index[:0], dtype=float, name=column)
+    override = overrides[column].dropna()
+    rows = index.get_indexer(override.index.droplevel('time'))
+    times = override.index.get_level_values('time')
+    return override[(rows >= 0) & (times >= 1) & (times <= number_of_periods)]
+
+def scatter_overrides(values, index, overrides, column, number_of_periods):
+    """Writes the values of a time dependent attribute given by the user (sparse nodes or arcs data) in the
+    (element, period) array of the attribute. Null values and unknown elements or periods are ignored.
+
+    Parameters
+    ----------
+    values : np.array
+        Array (elements x periods) of the attribute.
+    index : pd.Index
+        Elements of the rows of the array.
+    overrides : pd.DataFrame
+        Values given by the user, indexed by element and time.
+    column : string
+        The attribute.
+    number_of_periods : int
+        Number of periods.
+
+    Returns
+    -------
+    np.array
+        The array of the attribute with the new values.
+    """
+    if column not in overrides.columns:
+        return values
+    override = get_overrides(overrides, column, index, number_of_periods)
+    if override.empty:
+        return values
+    rows = index.get_indexer(override.index.droplevel('time'))
+    times = override.index.get_level_values('time').to_numpy().astype(int)
+    values = values.astype(np.result_type(values.dtype, override.dtype), copy=False)
+    values[rows, times - 1] = override.to_numpy()
+    return values
+
+def update_arcs_parameters(processed_data, nodes_costs, nodes_overrides, number_of_periods):
+    """Returns the static attributes of the arcs and their values in the periods where they change. The other
+    cost of every arc is the one of its ending node, and the sparse arcs data replaces the values of its arcs and
+    periods.
+
+    Parameters
+    ----------
+    processed_data : ProcessedData
+        It has all the model's processed data.
+    nodes_costs : pd.Series
+        Static other cost of every node.
+    nodes_overrides : pd.Series
+        Other cost of the nodes in the periods where it changes, indexed by (ID, time).
+    number_of_periods : int
+        Number of periods.
+
+    Returns
+    -------
+    Dictionary of Dataframes
+        'arcs_data' indexed by (Node_Start, Node_End) and 'arcs_overrides' indexed by (Node_Start, Node_End, time).
+    """
+    arcs_df = processed_data.arcs_data.copy()
+    #the cost of the arc is the cost of its ending node
+    arcs_df['OtherCosts'] = nodes_costs.reindex(arcs_df.index.get_level_values('Node_End')).to_numpy()
+
+    overrides = {column: get_overrides(processed_data.sparse_arcs, column, arcs_df.index, number_of_periods)
+                 for column in processed_data.sparse_arcs.columns.intersection(arcs_df.columns)}
+    arcs = arcs_df.index.to_frame(index=False)
+    nodes_overrides = nodes_overrides.rename('OtherCosts').rename_axis(['Node_End', 'time']).reset_index()
+    arcs_costs = arcs.merge(nodes_overrides, on='Node_End').set_index(ARC_TIME_INDEX)['OtherCosts']
+    overrides['OtherCosts'] = overrides['OtherCosts'].combine_first(arcs_costs) if 'OtherCosts' in overrides else arcs_costs
+
+    index = pd.MultiIndex.from_tuples([], names=ARC_TIME_INDEX)
+    for values in overrides.values():
+        index = index.union(values.index)
+    arcs_overrides = pd.DataFrame({column: values.reindex(index) for column, values in overrides.items()}, index=index)
+    return {"arcs_data": arcs_df, "arcs_overrides": arcs_overrides}
 
 def update_nodes_parameters(processed_data, number_of_periods):
-    nodes_df = processed_data.nodes_data.copy()
-    nodes_df.reset_index(inplace = True)
-    nodes_df = nodes_df.rename(columns = {'index':'ID'})
-    nodes_with_time = pd.concat([nodes_df.assign(time = t) for t in range(1, number_of_periods + 1)], ignore_index = True)
-    nodes_with_time.set_index(['ID', 'time'], inplace = True)
-    nodes_with_time.update(processed_data.sparse_node)
-    nodes_with_time.update(processed_data.injection_cost)
-    nodes_with_time.reset_index(inplace = True)
-    nodes_with_time = nodes_with_time.rename(columns = {'index1':'ID', 'index2': 'time'})
-    return nodes_with_time
+    """Returns the static other cost of every node and its values in the periods given in the sparse nodes data
+    and the injection cost (the injection cost prevails).
+
+    Parameters
+    ----------
+    processed_data : ProcessedData
+        It has all the model's processed data.
+    number_of_periods : int
+        Number of periods.
+
+    Returns
+    -------
+    pd.Series
+        Static other cost of every node.
+    pd.Series
+        Other cost of the nodes in the periods where it changes, indexed by (ID, time).
+    """
+    costs = processed_data.nodes_data['OtherCosts']
+    costs = costs[~costs.index.duplicated(keep='last')]
+    overrides = [get_overrides(overrides, 'OtherCosts', costs.index, number_of_periods).rename_axis(['ID', 'time'])
+                 for overrides in [processed_data.sparse_node, processed_data.injection_cost]]
+    overrides = pd.concat(overrides)
+    return costs, overrides[~overrides.index.duplicated(keep='last')]
+
+def get_time_values(attributes_with_time, column):
+    """Returns the static value of every arc and the values of the periods where a time dependent attribute
+    changes.
+
+    Parameters
+    ----------
+    attributes_with_time: Dictionary(string, pd.Dataframe)
+        Time dependent attributes of the arcs.
+    column : string
+        The attribute.
+
+    Returns
+    -------
+    dict
+        Static value of every arc (i, j).
+    dict
+        Values of the attribute in some arcs and periods (i, j, t).
+    """
+    static = attributes_with_time['arcs_data'][column].to_dict()
+    overrides = attributes_with_time['arcs_overrides']
+    overrides = overrides[column].dropna().to_dict() if column in overrides.columns else {}
+    return static, overrides
+
+def expand_time_values(attributes_with_time, column, arcs, number_of_periods):
+    """Returns the (arcs x periods) array of a time dependent attribute.
+
+    Parameters
+    ----------
+    attributes_with_time: Dictionary(string, pd.Dataframe)
+        Time dependent attributes of the arcs.
+    column : string
+        The attribute.
+    arcs : list(tuple)
+        Arcs of the rows of the array.
+    number_of_periods : int
+        Number of periods.
+
+    Returns
+    -------
+    np.array
+        The value of the attribute in every arc and period.
+    """
+    index = pd.MultiIndex.from_tuples(arcs, names=['Node_Start', 'Node_End'])
+    values = attributes_with_time['arcs_data'][column].reindex(index).to_numpy()
+    values = np.repeat(values[:, np.newaxis], number_of_periods, axis=1)
+    return scatter_overrides(values, index, attributes_with_time['arcs_overrides'], column, number_of_periods)
 
 def preprocess_data(parameters,period, s3_data=False, cost_of_injection = None):
     """Generates the model's processed data and useful sets. It filters the active nodes and generates the 
@@ -306,6 +584,9 @@ def preprocess_data(parameters,period, s3_data=False, cost_of_injection = None):
     load_data = processed_data.read_data(period)       #reading data
     proc_data = processed_data.process_data(load_data, cost_of_injection)  #processing data
     processed_data.create_attributes(proc_data)         #putting data into attributes
+    #removing the nodes and arcs that can not carry water
+    if parameters["json_file"].get("presolve", False):
+        processed_data = presolve_network(processed_data)
     #creting sets object
     useful_sets = generate_useful_sets(processed_data)
     #reordering to have in consumable conditions
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+rolling_horizon.py
+====================================
+This script solves the treatment model in a rolling horizon. Every window of W periods is optimized, only its first
+K periods are committed and the state of the network at the last committed period becomes the initial state of the
+next window, that starts right after it: the water, oil and contaminant concentrations of the tanks and ponds, the water
+and oil spilled in the initial nodes (they can not be used later) and the flows of the stability arcs (the first
+period of the next window is compared with them).
+
+The window is set with the 'rolling_horizon' key of the parameters json file, e.g. {"window": 14, "commit": 7}.
+The outputs of the committed periods of every window are stitched together in one result.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import copy
+import datetime as dt
+import pandas as pd
+import pyomo.environ as pe
+from src.optimization.treatment.make_model import make_model
+from src.optimization.treatment.generate_output import generate_nodes_output, generate_arcs_output, generate_model_output,\
+                                                       standardize_outputs, save_outputs
+
+
+def get_rolling_horizon(parameters):
+    """Returns the window and commit lengths of the rolling horizon, or None if it is not configured.
+
+    Parameters
+    ----------
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
+
+    Returns
+    -------
+    tuple(int, int)
+        The number of periods optimized and committed in every window.
+    """
+    rolling_horizon = parameters["json_file"].get("rolling_horizon")
+    if not rolling_horizon:
+        return None
+    window = int(rolling_horizon["window"])
+    commit = int(rolling_horizon.get("commit", window))
+    if window < 1 or not 1 <= commit <= window:
+        raise ValueError(f"The rolling horizon needs 1 <= commit <= window, got window={window} and commit={commit}")
+    return window, commit
+
+def slice_time(df, start, length):
+    """Keeps the rows of the periods [start, start + length - 1] and renumbers them from 1.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Dataframe with a 'time' index level.
+    start : int
+        First period of the window.
+    length : int
+        Number of periods of the window.
+
+    Returns
+    -------
+    pd.DataFrame
+        The rows of the window.
+    """
+    times = df.index.get_level_values('time')
+    df = df[(times >= start) & (times < start + length)]
+    if isinstance(df.index, pd.MultiIndex):
+        return df.rename(index=lambda t: t - start + 1, level='time')
+    return df.rename(index=lambda t: t - start + 1)
+
+def get_window_data(processed_data, useful_sets, attributes_with_time, start, length, state=None):
+    """Returns the model inputs of a window. The full horizon inputs are not modified.
+
+    Parameters
+    ----------
+    processed_data : ProcessedData
+        It has all the model's processed data (full horizon).
+    useful_sets : UsefulSets
+        It has all the model's sets.
+    attributes_with_time: Dictionary(string, pd.Dataframe)
+        Time dependent attributes of nodes and arcs.
+    start : int
+        First period of the window.
+    length : int
+        Number of periods of the window.
+    state : dict, optional
+        State of the network at the end of the previous window (see get_state).
+
+    Returns
+    -------
+    ProcessedData
+        The processed data of the window.
+    UsefulSets
+        The sets of the window.
+    Dictionary(string, pd.Dataframe)
+        The time dependent attributes of the window.
+    """
+    window_data = copy.copy(processed_data)
+    for key, value in vars(processed_data).items():
+        if isinstance(value, (pd.DataFrame, pd.Series)) and 'time' in value.index.names:
+            setattr(window_data, key, slice_time(value, start, length))
+    window_data.time_periods = length
+
+    if state is not None:
+        window_data.inital_content = dict(processed_data.inital_content, **state['content'])
+        window_data.initial_oil_content = dict(processed_data.initial_oil_content, **state['oil_content'])
+        window_data.previous_period = state['previous']
+        for key in ['initial_content_contaminants_tanks', 'initial_content_contaminants_ponds']:
+            df = getattr(processed_data, key).copy()
+            df['value'] = [state['concentration'].get(index, value) for index, value in df['value'].items()]
+            setattr(window_data, key, df)
+
+    window_sets = copy.copy(useful_sets)
+    window_sets.time_projection = {length}
+    window_attributes = {key: slice_time(df, start, length) if 'time' in df.index.names else df for key, df in attributes_with_time.items()}
+    return window_data, window_sets, window_attributes
+
+def get_state(model, period):
+    """Returns the state of the network at the end of a period: the water, oil and contaminant concentrations of the
+    tanks and ponds, the water and oil spilled in the initial nodes, the flows and pond activities of the stability
+    arcs, and the cumulative water and oil stored in the ending and loss tank nodes.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimized model of the window.
+    period : int
+        Last committed period of the window.
+
+    Returns
+    -------
+    dict
+        The state of the network.
+    """
+    storage = model.tanks.union(model.ponds)
+    #the spill of the initial nodes is cumulative, it is the initial content of the next window
+    carried = storage.union(model.initial)
+    state = {'content': {j: pe.value(model.y_water[j, period]) for j in carried},
+             'oil_content': {j: pe.value(model.y_oil[j, period]) for j in carried if (j, period) in model.y_oil},
+             'concentration': {(j, c): pe.value(model.y_contaminant[j, c, period])
+                               for j in storage for c in model.contaminants if (j, c, period) in model.y_contaminant},
+             'previous': {'x_water': {(i, j): pe.value(model.x_water[i, j, period])
+                                      for (i, j) in model.arcs_water_stability.union(model.arcs_water_stability_low_priority)},
+                          'x_active_arc_pond': {(i, j): round(pe.value(model.x_active_arc_pond[i, j, period]))
+                                                for (i, j) in model.arcs_pond_stability}},
+             'stored': {}}
+    for j in model.ending.union(model.loss_tanks):
+        oil = pe.value(model.y_oil[j, period]) if (j, period) in model.y_oil else 0
+        state['stored'][j] = (pe.value(model.y_water[j, period]), oil)
+    return state
+
+def is_solved(model, result):
+    return ((result.solver.status==pe.SolverStatus.ok) and (result.solver.termination_condition==pe.TerminationCondition.optimal))\
+        or ((result.solver.status==pe.SolverStatus.aborted) and (result.solver.termination_condition==pe.TerminationCondition.maxTimeLimit) and (len(model.solutions)>0))
+
+def solve_rolling_horizon(processed_data, useful_sets, parameters, attributes_with_time):
+    """Optimizes the model window by window.
+
+    Parameters
+    ----------
+    processed_data : ProcessedData
+        It has all the model's processed data.
+    useful_sets : UsefulSets
+        It has all the model's sets.
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
+    attributes_with_time: Dictionary(string, pd.Dataframe)
+        Time dependent attributes of nodes and arcs.
+
+    Returns
+    -------
+    list(dict)
+        For every window: its model, results, first period, committed periods, output tables and final state.
+        The list stops at the first window without solution.
+    """
+    window, commit = get_rolling_horizon(parameters)
+    time_periods = int(processed_data.time_periods)
+    windows, state, start = [], None, 1
+    while start <= time_periods:
+        length = min(window, time_periods - start + 1)
+        committed = length if start + length > time_periods else commit
+        print(f"        [{dt.datetime.now()}] Optimizing periods {start} to {start + length - 1}...")
+        window_data, window_sets, window_attributes = get_window_data(processed_data, useful_sets, attributes_with_time, start, length, state)
+        model, _, result = make_model(window_data, window_sets, parameters, window_attributes)
+        windows.append({'model': model, 'result': result, 'start': start, 'committed': committed})
+        if not is_solved(model, result):
+            print(f"    the window starting in period {start} has no solution")
+            break
+        #the tables are taken now because the next window can reuse the cached model
+        windows[-1]['nodes'], windows[-1]['edges'] = get_window_outputs(model, window_data, committed)
+        state = windows[-1]['state'] = get_state(model, committed)
+        start += committed
+    return windows
+
+def get_window_outputs(model, window_data, committed):
+    """Returns the nodes' and arcs' outputs of the committed periods of a window.
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimized model of the window.
+    window_data : ProcessedData
+        The processed data of the window.
+    committed : int
+        Number of committed periods.
+
+    Returns
+    -------
+    Pandas Dataframe
+        It contains the nodes' data standardized
+    Pandas Dataframe
+        It contains the arcs' data standardized
+    """
+    df_nodes, dates = generate_nodes_output(model, window_data)
+    df_arcs = generate_arcs_output(model, window_data, dates)
+    df_nodes, df_arcs = standardize_outputs(df_nodes, df_arcs, model)
+    return df_nodes[df_nodes['Date'] <= committed].copy(), df_arcs[df_arcs['Date'] <= committed].copy()
+
+def stitch_outputs(windows, parameters, save=True):
+    """Joins the outputs of the committed periods of every window.
+
+    The water and oil stored in the ending and loss tank nodes are cumulative and every window starts them at 0, so
+    they are shifted by the amount stored at the end of the previous window. The initial nodes start every window
+    with the spill of the previous one, so they are not shifted.
+
+    Parameters
+    ----------
+    windows : list(dict)
+        The windows returned by solve_rolling_horizon (all of them solved).
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
+    save : boolean, optional
+        If True, the outputs are saved like the ones of generate_output.
+
+    Returns
+    -------
+    dict
+        Outputs of the model (nodes, edges and summary Dataframes) for the whole horizon.
+    """
+    nodes, arcs, stored = [], [], {}
+    for window in windows:
+        df_nodes, df_arcs = window['nodes'].copy(), window['edges'].copy()
+        for node, (water, oil) in stored.items():
+            rows = df_nodes['Source'] == node
+            df_nodes.loc[rows, 'Water_Stored'] += water
+            df_nodes.loc[rows, 'Oil_Stored'] += oil
+        for node, (water, oil) in window['state']['stored'].items():
+            previous = stored.get(node, (0, 0))
+            stored[node] = (previous[0] + water, previous[1] + oil)
+
+        df_nodes['Date'] += window['start'] - 1
+        df_arcs['Date'] += window['start'] - 1
+        nodes.append(df_nodes)
+        arcs.append(df_arcs)
+
+    df_nodes = pd.concat(nodes, ignore_index=True)
+    df_arcs = pd.concat(arcs, ignore_index=True)
+    df_summary = generate_model_output(windows[-1]['model'], windows[-1]['result'], df_nodes, df_arcs, parameters)
+
+    outputs = {'nodes': df_nodes, 'edges': df_arcs, 'summary': df_summary}
+    if save:
+        save_outputs(outputs, parameters)
+    return outputs
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+solvers.py
+====================================
+This script stores the solver backends that can optimize the treatment model. The backend is chosen with the
+'solver' key of the parameters json file (gurobi by default) and every backend translates the common options
+of the json file (gurobi_time_limit, mip_gap, threads, run_name) to its own option names.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import pyomo.environ as pe
+from pyomo.contrib import appsi
+from pyomo.core.expr.symbol_map import SymbolMap
+from pyomo.opt import Solution, SolutionStatus, SolverResults
+from pyomo.solvers.plugins.solvers.persistent_solver import PersistentSolver
+
+
+def gurobi_options(json_file):
+    options = {'NonConvex': 2, #The oil and contaminant balances are bilinear
+               'TimeLimit': json_file["gurobi_time_limit"], #in seconds
+               'CSAppName': json_file['run_name']} #allow Gurobi Cluster Manager to retrieve the run name
+    if json_file.get('mip_gap') is not None:
+        options['MIPGap'] = json_file['mip_gap']
+    if json_file.get('threads') is not None:
+        options['Threads'] = json_file['threads']
+    return options
+
+def highs_options(json_file):
+    options = {'time_limit': json_file["gurobi_time_limit"]}
+    if json_file.get('mip_gap') is not None:
+        options['mip_rel_gap'] = json_file['mip_gap']
+    if json_file.get('threads') is not None:
+        options['threads'] = json_file['threads']
+    return options
+
+def cbc_options(json_file):
+    options = {'sec': json_file["gurobi_time_limit"]}
+    if json_file.get('mip_gap') is not None:
+        options['ratio'] = json_file['mip_gap']
+    if json_file.get('threads') is not None:
+        options['threads'] = json_file['threads']
+    return options
+
+def scip_options(json_file):
+    options = {'limits/time': json_file["gurobi_time_limit"]}
+    if json_file.get('mip_gap') is not None:
+        options['limits/gap'] = json_file['mip_gap']
+    return options
+
+#name: (Pyomo solver, Pyomo persistent solver, options translation, supports warmstart)
+#Only gurobi and scip can solve the non convex (oil or contaminant) models
+BACKENDS = {
+    'gurobi': ('gurobi', 'gurobi_persistent', gurobi_options, True),
+    'highs': ('appsi_highs', 'appsi_highs', highs_options, False),
+    'cbc': ('cbc', None, cbc_options, True),
+    'scip': ('scip', None, scip_options, False),
+}
+
+#APPSI termination condition: (status, termination condition) of the Pyomo results
+APPSI_STATUS = {
+    appsi.base.TerminationCondition.optimal: (pe.SolverStatus.ok, pe.TerminationCondition.optimal),
+    appsi.base.TerminationCondition.maxTimeLimit: (pe.SolverStatus.aborted, pe.TerminationCondition.maxTimeLimit),
+    appsi.base.TerminationCondition.maxIterations: (pe.SolverStatus.aborted, pe.TerminationCondition.maxIterations),
+    appsi.base.TerminationCondition.objectiveLimit: (pe.SolverStatus.aborted, pe.TerminationCondition.minFunctionValue),
+    appsi.base.TerminationCondition.minStepLength: (pe.SolverStatus.aborted, pe.TerminationCondition.minStepLength),
+    appsi.base.TerminationCondition.infeasible: (pe.SolverStatus.warning, pe.TerminationCondition.infeasible),
+    appsi.base.TerminationCondition.unbounded: (pe.SolverStatus.warning, pe.TerminationCondition.unbounded),
+    appsi.base.TerminationCondition.infeasibleOrUnbounded: (pe.SolverStatus.warning, pe.TerminationCondition.infeasibleOrUnbounded),
+    appsi.base.TerminationCondition.interrupted: (pe.SolverStatus.aborted, pe.TerminationCondition.userInterrupt),
+    appsi.base.TerminationCondition.licensingProblems: (pe.SolverStatus.error, pe.TerminationCondition.licensingProblems),
+    appsi.base.TerminationCondition.error: (pe.SolverStatus.error, pe.TerminationCondition.error),
+}
+
+
+def get_backend(name):
+    """Returns the name of the backend. The name can be the backend name or any of its Pyomo solver names.
+
+    Parameters
+    ----------
+    name : string
+        Backend name (gurobi, highs, cbc, scip) or Pyomo solver name (e.g. appsi_highs, gurobi_persistent).
+
+    Returns
+    -------
+    string
+        The backend name.
+    """
+    for backend, (solver_name, persistent_name, _, _) in BACKENDS.items():
+        if name in (backend, solver_name, persistent_name):
+            return backend
+    raise ValueError(f"Unknown solver '{name}'. Available solvers: {', '.join(BACKENDS)}")
+
+def get_backend_name(parameters):
+    """Returns the backend configured in the parameters json file (gurobi by default)."""
+    return get_backend(parameters["json_file"].get("solver", "gurobi"))
+
+def available_backends():
+    """Returns the backends whose solver is installed (and licensed) in this machine."""
+    available = []
+    for backend, (solver_name, _, _, _) in BACKENDS.items():
+        try:
+            if pe.SolverFactory(solver_name).available(exception_flag=False):
+                available.append(backend)
+        except Exception:
+            pass
+    return available
+
+def create_solver(parameters, backend=None, persistent=False):
+    """Creates the Pyomo solver of the backend with its options already translated.
+
+    Parameters
+    ----------
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
+    backend : string, optional
+        Backend or Pyomo solver name. By default, the one configured in the parameters json file.
+    persistent : boolean, optional
+        If True, the persistent interface of the backend is created.
+
+    Returns
+    -------
+    Pyomo Solver
+        The solver.
+    """
+    backend = get_backend(backend) if backend else get_backend_name(parameters)
+    solver_name, persistent_name, translate_options, _ = BACKENDS[backend]
+    if persistent and persistent_name is None:
+        raise ValueError(f"The solver '{backend}' does not have a persistent interface")
+
+    if backend == 'highs':
+        #APPSI solver: it keeps its own copy of the model (so it is always persistent) and the solution is loaded
+        #by solve only if there is one
+        solver = appsi.solvers.Highs()
+        solver.config.load_solution = False
+        solver.highs_options.update(translate_options(parameters["json_file"]))
+        return solver
+
+    solver = pe.SolverFactory(persistent_name if persistent else solver_name)
+    for option, value in translate_options(parameters["json_file"]).items():
+        solver.options[option] = value
+    return solver
+
+def add_loaded_solution(model):
+    """Adds the values loaded in the variables to the solutions of the model, like the Pyomo solvers do when
+    they load their results (e.g. process_treatment_results keeps the solutions of the runs stopped by the time limit).
+
+    Parameters
+    ----------
+    model : Pyomo ConcreteModel
+        The optimization model.
+    """
+    symbol_map, solution = SymbolMap(), Solution()
+    solution.status = SolutionStatus.feasible
+    for variable in model.component_data_objects(pe.Var):
+        if variable.value is not None:
+            solution.variable[symbol_map.getSymbol(variable, lambda v: v.name)] = {'Value': variable.value}
+    model.solutions.add_symbol_map(symbol_map)
+    model.solutions.add_solution(solution, id(symbol_map))
+
+def solve_appsi(solver, model):
+    """Solves the model with an APPSI solver, loads its solution if it found one and translates its results
+    to the Pyomo results returned by the other solvers.
+
+    Parameters
+    ----------
+    solver : APPSI Solver
+        The solver, created with load_solution = False.
+    model : Pyomo ConcreteModel
+        The optimization model.
+
+    Returns
+    -------
+    Pyomo Results Object
+        The optimization results (it has the model termination conditions).
+    """
+    model.solutions.clear()
+    appsi_result = solver.solve(model)
+    result = SolverResults()
+    result.solver.status, result.solver.termination_condition = APPSI_STATUS.get(appsi_result.termination_condition,
+                                                                                   (pe.SolverStatus.unknown, pe.TerminationCondition.unknown))
+    result.solver.wallclock_time = getattr(appsi_result, 'wallclock_time', None)
+    bounds = [appsi_result.best_objective_bound, appsi_result.best_feasible_objective]
+    if model.obj_function.sense == pe.maximize:
+        bounds.reverse()
+    result.problem.lower_bound, result.problem.upper_bound = [bound if bound is not None else float('nan') for bound in bounds]
+    if appsi_result.best_feasible_objective is not None:
+        appsi_result.solution_loader.load_vars()
+        add_loaded_solution(model)
+    return result
+
+def solve(solver, model, parameters, backend=None):
+    """Solves the model with a solver created by create_solver.
+
+    Parameters
+    ----------
+    solver : Pyomo Solver
+        The solver.
+    model : Pyomo ConcreteModel
+        The optimization model.
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
+    backend : string, optional
+        Backend or Pyomo solver name. By default, the one configured in the parameters json file.
+
+    Returns
+    -------
+    Pyomo Results Object
+        The optimization results (it has the model termination conditions).
+    """
+    backend = get_backend(backend) if backend else get_backend_name(parameters)
+    warmstart = BACKENDS[backend][3] and model.has_initial_solution
+
+    if isinstance(solver, PersistentSolver):
+        return solver.solve(tee=False, logfile=parameters['solver_log'], report_timing=True, warmstart=warmstart)
+    if isinstance(solver, appsi.base.Solver):
+        return solve_appsi(solver, model)
+    if warmstart:
+        return solver.solve(model, tee=False, logfile=parameters['solver_log'], report_timing=True, warmstart=True)
+    return solver.solve(model, tee=False, logfile=parameters['solver_log'], report_timing=True)
+
+def get_gap(result):
+    """Returns the relative gap between the bounds of the results, or None if the solver did not report them."""
+    try:
+        lower, upper = float(result.problem.lower_bound), float(result.problem.upper_bound)
+    except (TypeError, ValueError, AttributeError):
+        return None
+    if abs(lower) == float('inf') or abs(upper) == float('inf'):
+        return None
+    return abs(upper - lower) / max(abs(upper), abs(lower), 1e-10)
+
+def get_solver_time(result):
+    """Returns the time the solver reported for the solve itself, or None if it did not report it."""
+    for attribute in ('wallclock_time', 'time'):
+        try:
+            return float(getattr(result.solver, attribute))
+        except (TypeError, ValueError, AttributeError):
+            continue
+    return None
+
+def get_node_count(solver, result=None):
+    """Returns the branch and bound nodes of the last solve, or None if the solver did not report them.
+    The persistent Gurobi and the HiGHS interfaces keep the solver model, the rest of the solvers report them in
+    the statistics of the results (e.g. cbc). The SolverFactory('gurobi') and scip interfaces do not report them.
+    """
+    solver_model = getattr(solver, '_solver_model', None)
+    try:
+        if hasattr(solver_model, 'NodeCount'): #gurobipy
+            return int(solver_model.NodeCount)
+        if hasattr(solver_model, 'getInfo'): #highspy
+            return int(solver_model.getInfo().mip_node_count)
+        return int(result.solver.statistics.branch_and_bound.number_of_bounded_subproblems)
+    except Exception:
+        pass
+    return None
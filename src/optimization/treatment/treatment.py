@@ -11,11 +11,14 @@ it in the simulations folder.
      - yeison.diaz
 """
 
-import time, json
+import os, time, json
 import pyomo.environ as pe
-from src.optimization.treatment.preprocess_data import preprocess_data
-from src.optimization.treatment.make_model import make_model
+from src.optimization.treatment.preprocess_data import preprocess_data, create_time_parameters
+from src.optimization.treatment.make_model import make_model, solve_model
+from src.optimization.treatment.model_cache import update_time_parameters
 from src.optimization.treatment.generate_output import generate_output
+from src.optimization.treatment.rolling_horizon import get_rolling_horizon, solve_rolling_horizon, stitch_outputs
+from src.optimization.treatment.model_report import get_report
 from src.commons.system_util import SystemUtilities
 from src.commons.process_results import ProcessResults
 from src.commons.system_util import get_string_time
@@ -23,7 +26,7 @@ from src.commons.system_util import get_string_time
 import src.recommendations.water_recommendations as wr
 
 
-def treatment_model(model_name, s3_data, param_file, date, cost_of_injection = None):
+def treatment_model(model_name, s3_data, param_file, date, cost_of_injection = None, rolling_horizon = False):
     '''Treatment model execution depending on model runed
     
     Parameters
@@ -39,11 +42,14 @@ def treatment_model(model_name, s3_data, param_file, date, cost_of_injection = N
         datetime to add in the simulation name
     cost_of_injection: pd.Dataframe, optional, default None
         cost of the injection model per period
+    rolling_horizon: boolean, optional, default False
+        If True and the parameters json file has the 'rolling_horizon' key, the model is solved window by window
     
     Returns
     -------
     model : pyomo.core.base.PyomoModel.ConcreteModel
-        Pyomo concrete model to access data
+        Pyomo concrete model to access data (the one of the last window in a rolling horizon). Its treatment_inputs
+        attribute keeps the parameters, processed data and sets of the run for process_treatment_results
     result : pyo.opt.results.results.SolverResults
         Pyomo model results in a pseudo json form
     time_ : str
@@ -58,42 +64,142 @@ def treatment_model(model_name, s3_data, param_file, date, cost_of_injection = N
     data, useful_sets, attributes_with_time = preprocess_data(parameters, simulated_period,s3_data=s3_data, cost_of_injection = cost_of_injection)
 
     print("    optimizing model...")
-    model, solver, result = make_model(data, useful_sets, parameters, attributes_with_time)
+    windows = None
+    if rolling_horizon and get_rolling_horizon(parameters):
+        windows = solve_rolling_horizon(data, useful_sets, parameters, attributes_with_time)
+        model, result = windows[-1]['model'], windows[-1]['result']
+    else:
+        model, solver, result = make_model(data, useful_sets, parameters, attributes_with_time)
+    model.rolling_horizon_windows = windows
+    model.treatment_inputs = (parameters, data, useful_sets) #to solve it again with other injection costs
     time_ = get_string_time(time.time()-tik)
+    get_report(model).runtime = time_
+    save_report(model, parameters, model_name)
 
     return model, result, time_
 
-def process_treatment_results(model_name, s3_data, param_file, date, cost_of_injection, model, result):
-    test, parameters, simulated_period = read_parameters(model_name, s3_data, param_file, date)
-    data, _, _ = preprocess_data(parameters, simulated_period,s3_data=s3_data, cost_of_injection = cost_of_injection)
-
-    if ((result.solver.status==pe.SolverStatus.ok) and (result.solver.termination_condition==pe.TerminationCondition.optimal))\
-        or ((result.solver.status==pe.SolverStatus.aborted) and (result.solver.termination_condition==pe.TerminationCondition.maxTimeLimit) and (len(model.solutions)>0)): #if the optimization is aborted because of the timelimit set, we still keep the last result obtained by Gurobi, if any
-        print("    exporting results...")
-        outputs = generate_output(model, result, parameters, data)
-        #generating recirculation recomendations
-        recirculation = wr.get_action_recirculation(data.arcs_data.reset_index(), outputs)
-        #generating reuse recomendations
-        reuse = wr.get_action_reuse(data.arcs_data.reset_index(), data.ending_nodes_data.reset_index(), outputs)
-        #generating nominal value recomendations
-        nominal = wr.get_action_nominal_values(data.arcs_data.reset_index(), outputs)
-        recommendations, actions = [recirculation, reuse, nominal], []
-        #putting it together and saving json
-        for recomm in recommendations:
-            if len(recomm):
-                actions.extend(recomm)
-        if len(actions):
-            recomendations_path = test.parameters["output_recommendations_dir"]
-            with open(recomendations_path, 'w') as f:
-                json.dump(actions, f)
-        print(f'PROCESSING {model_name.upper()} MODEL OUTPUTS:')
-        test_results = ProcessResults(model_name, outputs,  s3_data=s3_data, param_file=param_file, date=date)
-        print(f"    {model_name.upper()} running done.")
-        print('*'*50)
-        return test_results.athena
+def save_report(model, parameters, model_name):
+    '''Saves the timing spans and model sizes of the model in a json file next to the model outputs, with
+    the running time of the model (the entry export_time_report prints)
+
+    Parameters
+    ----------
+    model : pyomo.core.base.PyomoModel.ConcreteModel
+        Pyomo concrete model returned by treatment_model
+    parameters : dictionary(string, string)
+        It has stored all the not-model's parameters.
+    model_name : str
+        Model string that identify what model we are running
+    '''
+    report = get_report(model)
+    report.times = {model_name: report.runtime}
+    report.to_json(os.path.join(os.path.dirname(parameters["output_model_dir"]), f'model_report_{model_name}.json'))
+
+def resolve_treatment_model(model, cost_of_injection):
+    '''Solves again a model returned by treatment_model with new injection costs. Only the other costs of the
+    arcs change (they are mutable parameters), so the model is not built again and the previous solution is
+    the warm start.
+
+    Parameters
+    ----------
+    model : pyomo.core.base.PyomoModel.ConcreteModel
+        Pyomo concrete model returned by treatment_model
+    cost_of_injection: pd.Dataframe
+        cost of the injection model per period
+
+    Returns
+    -------
+    model : pyomo.core.base.PyomoModel.ConcreteModel
+        Pyomo concrete model to access data
+    result : pyo.opt.results.results.SolverResults
+        Pyomo model results in a pseudo json form
+    time_ : str
+        string with running time
+    '''
+    tik = time.time()
+    print("    optimizing model with the new injection costs...")
+    parameters, data, useful_sets = model.treatment_inputs
+    data.injection_cost = cost_of_injection.set_index(['ID', 'time'])
+    update_time_parameters(model, create_time_parameters(data, useful_sets))
+
+    model, solver, result = solve_model(model, parameters)
+    time_ = get_string_time(time.time()-tik)
+    get_report(model).runtime = time_
+
+    return model, result, time_
+
+def process_treatment_results(model_name, s3_data, param_file, date, cost_of_injection, model, result, data = None):
+    '''Generates the outputs, recommendations and athenas database of a solved treatment model
+
+    Parameters
+    ----------
+    model_name : str
+        Model string that identify what model we are running
+    s3_data : boolean
+        Define if read from s3 bucket or not
+    param_file : str-Nonetype
+        parameter file name
+    date : str-Nonetype
+        datetime to add in the simulation name
+    cost_of_injection: pd.Dataframe-Nonetype
+        cost of the injection model per period
+    model : pyomo.core.base.PyomoModel.ConcreteModel
+        Pyomo concrete model returned by treatment_model
+    result : pyo.opt.results.results.SolverResults
+        Pyomo model results in a pseudo json form
+    data : ProcessedData, optional, default None
+        processed data of the run. By default, the one kept in the model by treatment_model; the input files are
+        only read and processed again if the model does not have it
+
+    Returns
+    -------
+    pd.DataFrame-Nonetype
+        athenas database of the model, None if the model was not solved
+    '''
+    treatment_inputs = getattr(model, 'treatment_inputs', None)
+    if treatment_inputs is not None:
+        parameters = treatment_inputs[0]
+        data = treatment_inputs[1] if data is None else data
     else:
-        print('    an error ocurred while solving the system...')
-        return None
+        _, parameters, simulated_period = read_parameters(model_name, s3_data, param_file, date)
+        if data is None:
+            data, _, _ = preprocess_data(parameters, simulated_period,s3_data=s3_data, cost_of_injection = cost_of_injection)
+
+    try:
+        if ((result.solver.status==pe.SolverStatus.ok) and (result.solver.termination_condition==pe.TerminationCondition.optimal))\
+            or ((result.solver.status==pe.SolverStatus.aborted) and (result.solver.termination_condition==pe.TerminationCondition.maxTimeLimit) and (len(model.solutions)>0)): #if the optimization is aborted because of the timelimit set, we still keep the last result obtained by Gurobi, if any
+            print("    exporting results...")
+            with get_report(model).span('generate_output'):
+                if getattr(model, 'rolling_horizon_windows', None):
+                    outputs = stitch_outputs(model.rolling_horizon_windows, parameters)
+                else:
+                    outputs = generate_output(model, result, parameters, data)
+            #generating recirculation recomendations
+            recirculation = wr.get_action_recirculation(data.arcs_data.reset_index(), outputs)
+            #generating reuse recomendations
+            reuse = wr.get_action_reuse(data.arcs_data.reset_index(), data.ending_nodes_data.reset_index(), outputs)
+            #generating nominal value recomendations
+            nominal = wr.get_action_nominal_values(data.arcs_data.reset_index(), outputs)
+            recommendations, actions = [recirculation, reuse, nominal], []
+            #putting it together and saving json
+            for recomm in recommendations:
+                if len(recomm):
+                    actions.extend(recomm)
+            if len(actions):
+                recomendations_path = parameters["output_recommendations_dir"]
+                with open(recomendations_path, 'w') as f:
+                    json.dump(actions, f)
+            print(f'PROCESSING {model_name.upper()} MODEL OUTPUTS:')
+            test_results = ProcessResults(model_name, outputs,  s3_data=s3_data, param_file=param_file, date=date)
+            print(f"    {model_name.upper()} running done.")
+            print('*'*50)
+            return test_results.athena
+        else:
+            print('    an error ocurred while solving the system...')
+            return None
+    finally:
+        #also saved when the model was not solved, to see which step failed or took too long
+        save_report(model, parameters, model_name)
          
 def read_parameters(model_name, s3_data, param_file, date):
     test = SystemUtilities(s3_data, param_file=param_file, date=date)
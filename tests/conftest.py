@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+conftest.py
+====================================
+Shared fixtures of the tests. The treatment tests build the sample network instead of reading the configuration
+files, and they are skipped when the model dependencies (Pyomo, the commons package) are not installed.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sample_network
+
+
+@pytest.fixture
+def network(tmp_path, monkeypatch):
+    """Returns a function that preprocesses the sample network, like preprocess_data does with the input files.
+    Its keyword arguments are the ones of sample_network.load_data, an optional function that edits the loaded
+    data and the extra keys of the parameters json file.
+    """
+    preprocess = pytest.importorskip('src.optimization.treatment.preprocess_data', exc_type=ImportError)
+    from src.optimization.treatment.preprocess_classes.processed_data import ProcessedData
+
+    def preprocess_network(object_funct='upstream_supply_demand_cost', copies=1, periods=sample_network.T, contaminants=False,
+                           tank_tds=0.0, pond_tds=0.0, oil=False, edit=None, **json_file):
+        data = sample_network.load_data(copies, periods, contaminants, tank_tds, pond_tds, oil)
+        if edit is not None:
+            edit(data)
+        monkeypatch.setattr(ProcessedData, 'read_data', lambda self, period: data)
+        parameters = sample_network.parameters(str(tmp_path), object_funct, periods, **json_file)
+        processed_data, useful_sets, attributes_with_time = preprocess.preprocess_data(parameters, periods)
+        return processed_data, useful_sets, attributes_with_time, parameters
+    return preprocess_network
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+sample_network.py
+====================================
+Small treatment network used by the tests. It has initial, ending, pump, tank, pond, splitter, mixer, treatment
+and loss tank nodes, time dependent arc and node attributes and an unreachable (dead) branch. The network can be
+replicated to build larger instances of the same shape.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import numpy as np
+import pandas as pd
+
+T = 6
+
+ARCS = [('START_A', 'PUMP_P1', 0, 400, 1, 1.0, 'N', np.nan),
+        ('START_B', 'PUMP_P2', 0, 300, 1, 2.0, 'N', 100.0),
+        ('START_DEAD', 'MIX_DEAD', 0, 300, 1, 2.0, 'N', np.nan),
+        ('PUMP_P1', 'TREAT_1', 0, 400, 1, 0.5, 'N', np.nan),
+        ('TREAT_1', 'MIX_1', 0, 400, 1, 0.5, 'Y', np.nan),
+        ('PUMP_P2', 'TANK_1', 0, 300, 1, 0.5, 'N', np.nan),
+        ('TANK_1', 'MIX_1', 0, 300, 0.8, 0.5, 'N', np.nan),
+        ('TANK_1', 'SPLIT_1', 0, 200, 1, 0.5, 'N', np.nan),
+        ('SPLIT_1', 'POND_1', 0, 200, 1, 0.5, 'N', np.nan),
+        ('SPLIT_1', 'MIX_2', 0, 200, 1, 0.5, 'N', np.nan),
+        ('POND_1', 'MIX_2', 0, 250, 1, 0.5, 'N', np.nan),
+        ('POND_1', 'LOSS_1', 0, 250, 1, 0.0, 'N', np.nan),
+        ('MIX_1', 'END_1', 0, 1000, 1, 0.1, 'N', np.nan),
+        ('MIX_2', 'END_2', 0, 1000, 1, 0.1, 'N', np.nan),
+        ('MIX_DEAD', 'END_2', 0, 1000, 1, 0.1, 'N', np.nan)]
+
+#Nodes and arcs of the branch START_A -> END_1 that carry oil when the network has oil
+OIL_NODES = ['START_A', 'PUMP_P1', 'TREAT_1', 'MIX_1', 'END_1']
+
+
+def nodes(ids, extra=None, max_capacity=1000.0, oil=()):
+    df = pd.DataFrame({'ID': ids, 'MinCapacity': 0.0, 'MaxCapacity': max_capacity, 'OtherCosts': 0.0, 'Active': 'Y',
+                       'HasOil': ['Y' if i.rsplit('-', 1)[0] in oil else 'N' for i in ids]})
+    for key, value in (extra or {}).items():
+        df[key] = value
+    return df
+
+def load_data(copies=1, periods=T, contaminants=False, tank_tds=0.0, pond_tds=0.0, oil=False):
+    """Returns the loaded data of the network (like ProcessedData.read_data).
+
+    Parameters
+    ----------
+    copies : int, optional
+        Number of copies of the network (the nodes of the copy k > 1 end with '-k').
+    periods : int, optional
+        Number of time periods.
+    contaminants : boolean, optional
+        If True, START_A has TDS.
+    tank_tds, pond_tds : float, optional
+        Initial TDS of the content of TANK_1 and POND_1.
+    oil : boolean, optional
+        If True, the branch START_A -> END_1 has oil.
+
+    Returns
+    -------
+    dict(string, pd.DataFrame)
+        The loaded data.
+    """
+    oil_nodes = OIL_NODES if oil else []
+    names = lambda ids: [f'{i}-{k}' if k > 1 else i for k in range(1, copies + 1) for i in ids]
+    name = lambda i, k: f'{i}-{k}' if k > 1 else i
+    load_data = {}
+    load_data['initial_nodes_raw_data'] = nodes(names(['START_A', 'START_B', 'START_DEAD']), {'Maximize_Usage': ['Y', 'N', 'N'] * copies}, 5000, oil_nodes)
+    load_data['ending_nodes_raw_data'] = nodes(names(['END_1', 'END_2']), {'Maximize_Usage': ['Y', 'N'] * copies, 'Reuse': ['Y', 'N'] * copies}, 1e6, oil_nodes)
+    load_data['pumps_nodes_raw_data'] = nodes(names(['PUMP_P1', 'PUMP_P2']), {'PressureIn': [10, 20] * copies, 'PressureOut': [100, 120] * copies, 'Efficiency': [0.7, 0.8] * copies}, 0, oil_nodes)
+    load_data['tanks_nodes_raw_data'] = nodes(names(['TANK_1']), {'InitialCapacity': 200.0, 'Contaminant_TDS': tank_tds}, 800)
+    load_data['ponds_nodes_raw_data'] = nodes(names(['POND_1']), {'InitialCapacity': 500.0, 'Dim_top_L': 10.0, 'Dim_top_W': 10.0, 'Dim_bottom_L': 5.0, 'Dim_bottom_W': 5.0, 'Contaminant_TDS': pond_tds}, 3000)
+    load_data['splitter_nodes_raw_data'] = nodes(names(['SPLIT_1']), max_capacity=0)
+    load_data['mixer_nodes_raw_data'] = nodes(names(['MIX_1', 'MIX_2', 'MIX_DEAD']), {'WaterMixStability': ['Y', 'N', 'N'] * copies, 'WaterMixStability_LowPriority': ['N', 'Y', 'N'] * copies, 'PondStability': ['N', 'Y', 'N'] * copies}, 0, oil_nodes)
+    load_data['process_nodes_raw_data'] = nodes([], max_capacity=0)
+    load_data['treatment_nodes_raw_data'] = nodes(names(['TREAT_1']), max_capacity=0, oil=oil_nodes)
+    load_data['oil_treatment_nodes_raw_data'] = nodes([], max_capacity=0)
+    load_data['cooling_tower_nodes_raw_data'] = nodes([], max_capacity=0)
+    load_data['boiler_nodes_raw_data'] = nodes([], max_capacity=0)
+    load_data['loss_tanks_nodes_raw_data'] = nodes(names(['LOSS_1']), max_capacity=1e6)
+    load_data['process_nodes_contaminants_raw_data'] = pd.DataFrame({'ID': [], 'Contaminant': [], 'Addition_Qty(mg)': [], 'Active': []})
+    load_data['treatment_nodes_contaminants_raw_data'] = pd.DataFrame({'ID': names(['TREAT_1']), 'Contaminant': 'TDS', 'Removal_Percentage': 0.9, 'Active': 'Y'})
+
+    arcs = [(name(i, k), name(j, k), min_flow, max_flow, usable, cost, 'Y' if i in oil_nodes and j in oil_nodes else 'N', recirculation, nominal)
+            for k in range(1, copies + 1) for (i, j, min_flow, max_flow, usable, cost, recirculation, nominal) in ARCS]
+    load_data['arcs_raw_data'] = pd.DataFrame(arcs, columns=['Node_Start', 'Node_End', 'MinFlow', 'MaxFlow', 'UsablePercentage', 'ArcFlowCost', 'HasOil', 'Recirculation', 'Nominal_Value']).assign(Active='Y')
+    load_data['oil_fixed_treatment_arcs_raw_data'] = pd.DataFrame({'Node_Start': [], 'Node_End': [], 'FixedWaterPercentage': [], 'FixedOilPercentage': [], 'Active': []})
+    load_data['fixed_splitter_arcs_raw_data'] = pd.DataFrame({'Node_Start': names(['SPLIT_1']), 'Node_End': names(['POND_1']), 'FixedPercentage': 0.5, 'Active': 'Y'})
+    load_data['sparse_node'] = pd.DataFrame({'ID': ['MIX_1', 'END_2'], 'time': [2, 3], 'Attribute': 'OtherCosts', 'Value': [3.0, 1.5]})
+    load_data['sparse_arcs'] = pd.DataFrame({'Node_Start': ['TANK_1', 'PUMP_P1'], 'Node_End': ['MIX_1', 'TREAT_1'], 'time': [3, 4], 'Attribute': ['UsablePercentage', 'OtherCosts'], 'Value': [0.0, 7.0]})
+    load_data['pumps_energy_models_raw_data'] = pd.DataFrame({'PUMP': names(['P2']), 'SLOPE_P': 0.5, 'SLOPE_Q': 0.1, 'INTERCEPT': 3.0})
+
+    rows = []
+    for t in range(1, periods + 1):
+        for k in range(1, copies + 1):
+            rows.append((name('START_A', k), t, 300.0 + 10 * t, 20.0 if oil else 0.0, 0.0, 5.0 if contaminants else 0.0))
+            rows.append((name('START_B', k), t, 250.0, 0.0, 0.0, 0.0))
+            rows.append((name('START_DEAD', k), t, 10.0, 0.0, 0.0, 0.0))
+            rows.append((name('END_1', k), t, 0.0, 0.0, 450.0 if t % 3 else 100.0, 0.0))
+            rows.append((name('END_2', k), t, 0.0, 0.0, 200.0, 0.0))
+    load_data['tanks_flow_raw'] = pd.DataFrame(rows, columns=['Tank', 'time', 'WaterQty', 'OilQty', 'Aditional Total Capacity', 'Contaminant_TDS'])
+    load_data['evaporation_raw'] = pd.DataFrame({'time': list(range(1, periods + 1)), 'evaporation_rate': 0.1})
+    return load_data
+
+def parameters(output_dir, object_funct='upstream_supply_demand_cost', periods=T, **json_file):
+    """Returns the run parameters of the network, with the outputs in output_dir."""
+    json_file = dict({'gurobi_time_limit': 60, 'run_name': 'tests', 'time_periods': periods, 'solver': 'highs'}, **json_file)
+    return {'energy_cost': 0.1, 'energy_co2': 0.001, 'time_periods': periods, 'barrel_to_liters': 158.98,
+            'day_to_sec': 86400, 'watt_to_kwh': 0.001, 'json_file': json_file, 'solver_log': f'{output_dir}/solver.log',
+            'object_funct': object_funct, 'percentage_hierarchical_optimization': 0.99,
+            'output_model_dir': f'{output_dir}/model.csv', 'output_nodes_dir': f'{output_dir}/nodes.csv',
+            'output_arcs_dir': f'{output_dir}/arcs.csv', 'output_json_dir': f'{output_dir}/params.json'}
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+test_balance_totals.py
+====================================
+The global balances of the initial nodes (c_1_2_1 and c_1_5_1 of c_1_3) reference the model-wide totals instead
+of rebuilding them for every node, so the size of the family grows linearly with nodes x periods.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import pytest
+
+
+def own_size(expr):
+    """Number of expression nodes built by an expression, without the named expressions it references."""
+    if not getattr(expr, 'is_expression_type', lambda: False)() or expr.is_named_expression_type():
+        return 1
+    return 1 + sum(own_size(arg) for arg in expr.args)
+
+def balance_size(network, copies, periods):
+    """Size of the balance totals and the c_1_2_1 and c_1_3 families by node and period."""
+    make_model = pytest.importorskip('src.optimization.treatment.make_model', exc_type=ImportError)
+    from src.optimization.treatment.constraints import constraints
+    processed_data, useful_sets, attributes_with_time, _ = network(copies=copies, periods=periods, oil=True)
+    model = make_model.pe.ConcreteModel()
+    model = make_model.set_sets(model, useful_sets)
+    model = make_model.set_parameters(model, processed_data, useful_sets, attributes_with_time)
+    model = make_model.set_variables(model)
+    model = make_model.set_expressions(model)
+    model = constraints.add_water_flow_balance(model)
+    model = constraints.add_oil_flow_balance(model)
+    assert len(model.c_1_3_oil_flow_balance) > 0
+    totals = [model.total_water_in, model.total_water_out, model.total_water_stored_last_time, model.total_initial_content,
+              model.total_oil_in, model.total_oil_out, model.total_oil_stored_last_time]
+    size = sum(own_size(total.expr) for total in totals)
+    for family in (model.c_1_2_1_water_flow_balance, model.c_1_3_oil_flow_balance):
+        size += sum(own_size(constraint.body) for constraint in family.values())
+    return size / (len(model.nodes) * len(model.time_dim))
+
+def test_balance_size_is_linear(network):
+    sizes = [balance_size(network, copies, periods) for copies, periods in [(1, 6), (2, 6), (4, 6), (2, 12)]]
+    #about 4.2 by node and period in every size. Rebuilding the totals in every initial node grows it with the
+    #number of initial nodes: 5.8, 7.5, 10.8 and 6.9
+    assert max(sizes) <= 1.2 * min(sizes)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+test_benchmark.py
+====================================
+The solver benchmark reports the branch and bound nodes of every stage, so the big-M methods can be compared
+on every available backend.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import pytest
+
+
+def test_benchmark_reports_nodes(network):
+    benchmark = pytest.importorskip('src.optimization.treatment.benchmark', exc_type=ImportError)
+    from src.optimization.treatment import solvers
+    #the scip interface does not report the node count
+    backends = [backend for backend in solvers.available_backends() if backend != 'scip']
+    if not backends:
+        pytest.skip('no solver available')
+    processed_data, useful_sets, attributes_with_time, parameters = network()
+    report = benchmark.benchmark_solvers(processed_data, useful_sets, parameters, attributes_with_time, backends, ['tight', 'global'])
+    assert 'error' not in report.columns
+    assert set(report['backend']) == set(backends) and set(report['big_m']) == {'tight', 'global'}
+    assert report['nodes'].notna().all()
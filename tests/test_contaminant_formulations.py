@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+test_contaminant_formulations.py
+====================================
+The mass flow formulation of the contaminant balances (c_18) must give the same concentrations as the
+concentration formulation. The water flows are fixed to the ones of a solution without contaminants, so both
+formulations are linear and have a single solution in the arcs and storage nodes with water.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import pytest
+
+
+def water_solution(network):
+    make_model = pytest.importorskip('src.optimization.treatment.make_model', exc_type=ImportError)
+    pytest.importorskip('highspy')
+    processed_data, useful_sets, attributes_with_time, parameters = network()
+    model, _, result = make_model.make_model(processed_data, useful_sets, parameters, attributes_with_time)
+    assert str(result.solver.termination_condition) == 'optimal'
+    return {k: v.value for k, v in model.x_water.items()}, {k: v.value for k, v in model.y_water.items()}
+
+def concentrations(network, formulation, x_water, y_water, presolve, **contaminants):
+    from src.optimization.treatment import make_model
+    from src.optimization.treatment.constraints import constraints
+    processed_data, useful_sets, attributes_with_time, parameters = network(contaminants=True, **contaminants, presolve=presolve,
+                                                                            contaminant_formulation=formulation)
+    model = make_model.build_model(processed_data, useful_sets, attributes_with_time,
+                                   make_model.get_contaminant_formulation(parameters), make_model.get_big_m(parameters))
+    for k, v in x_water.items():
+        model.x_water[k].fix(v)
+    for k, v in y_water.items():
+        model.y_water[k].fix(v)
+    model.obj_function = make_model.pe.Objective(expr=0)
+    result = make_model.pe.SolverFactory('appsi_highs').solve(model, load_solutions=False)
+    assert str(result.solver.termination_condition) == 'optimal'
+    model.solutions.load_from(result)
+    if formulation == 'mass_flow':
+        constraints.set_contaminant_concentrations(model)
+
+    arcs = {(i, j, c, t): v.value for (i, j, c, t), v in model.x_contaminant.items() if x_water[i,j,t] > 1e-6}
+    storage = {(j, c, t): v.value for (j, c, t), v in model.y_contaminant.items()
+               if (j in model.tanks or j in model.ponds) and y_water[j,t] > 1e-6}
+    return arcs, storage
+
+@pytest.mark.parametrize('presolve', [False, True])
+@pytest.mark.parametrize('tank_tds, pond_tds', [(0.0, 0.0), (20.0, 0.0), (0.0, 30.0), (20.0, 30.0)])
+def test_mass_flow_matches_concentration(network, tank_tds, pond_tds, presolve):
+    x_water, y_water = water_solution(network)
+    arcs, storage = concentrations(network, 'concentration', x_water, y_water, presolve, tank_tds=tank_tds, pond_tds=pond_tds)
+    mass_arcs, mass_storage = concentrations(network, 'mass_flow', x_water, y_water, presolve, tank_tds=tank_tds, pond_tds=pond_tds)
+
+    assert arcs.keys() == mass_arcs.keys() and storage.keys() == mass_storage.keys()
+    if presolve:
+        #START_A does not reach the tank and the pond, they get TDS from their initial content (the pond also from the tank)
+        assert any(k[0] == 'TANK_1' for k in storage) == bool(tank_tds)
+        assert any(k[0] == 'POND_1' for k in storage) == bool(tank_tds or pond_tds)
+    assert mass_arcs == pytest.approx(arcs, rel=1e-6, abs=1e-6)
+    assert mass_storage == pytest.approx(storage, rel=1e-6, abs=1e-6)
+    if pond_tds:
+        #the initial content of the pond keeps its contaminants in the first period
+        assert storage['POND_1', 'TDS', 1] > 0
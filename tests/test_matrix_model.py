@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+test_matrix_model.py
+====================================
+The matrix compiler keeps its own copy of the constraint families, so it must give the same stage values as
+the Pyomo model on every objective function.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import pytest
+
+OBJECTIVES = ['upstream_supply_demand_cost_fully_stabilized', 'downstream_minimize_costs',
+              'upstream_minimize_electrical_consumption', 'upstream_supply_demand_cost']
+
+
+def stage_values(model):
+    return [stage['objective_value'] for stage in model.stages]
+
+@pytest.mark.parametrize('object_funct', OBJECTIVES)
+def test_matrix_compiler_matches_pyomo(network, object_funct):
+    make_model = pytest.importorskip('src.optimization.treatment.make_model', exc_type=ImportError)
+    pytest.importorskip('highspy')
+    processed_data, useful_sets, attributes_with_time, parameters = network(object_funct)
+    pyomo_model, _, pyomo_result = make_model.make_model(processed_data, useful_sets, parameters, attributes_with_time)
+
+    processed_data, useful_sets, attributes_with_time, parameters = network(object_funct, compiler='matrix')
+    matrix_model, solver, matrix_result = make_model.make_model(processed_data, useful_sets, parameters, attributes_with_time)
+
+    assert solver is None and not hasattr(matrix_model, 'c_1_1_water_flow_balance')
+    assert str(matrix_result.solver.termination_condition) == str(pyomo_result.solver.termination_condition) == 'optimal'
+    #the MIP stages can stop at different solutions inside the gap
+    assert stage_values(matrix_model) == pytest.approx(stage_values(pyomo_model), rel=1e-3, abs=1e-2)
+    #the solution loaded in the Pyomo variables gives the value of the last stage
+    assert pytest.approx(matrix_model.stages[-1]['objective_value'], rel=1e-6, abs=1e-6) == make_model.pe.value(matrix_model.obj_function)
+
+def test_matrix_compiler_falls_back_to_pyomo(network):
+    make_model = pytest.importorskip('src.optimization.treatment.make_model', exc_type=ImportError)
+    pytest.importorskip('highspy')
+    processed_data, useful_sets, attributes_with_time, parameters = network(contaminants=True, compiler='matrix')
+    model = make_model.get_model(processed_data, useful_sets, parameters, attributes_with_time)
+    assert make_model.solve_compiled_model(processed_data, useful_sets, parameters, attributes_with_time) is None
+    assert hasattr(model, 'c_1_1_water_flow_balance')
+
+def test_time_limited_solution_is_kept(network, monkeypatch):
+    make_model = pytest.importorskip('src.optimization.treatment.make_model', exc_type=ImportError)
+    pytest.importorskip('highspy')
+    import src.optimization.treatment.matrix_model as matrix_model
+    solve_hierarchical = matrix_model.solve_hierarchical
+    def time_limited(*args, **kwargs):
+        x, stages = solve_hierarchical(*args, **kwargs)
+        stages[-1]['status_code'] = 1 #scipy milp stopped by the time limit with a feasible solution
+        return x, stages
+    monkeypatch.setattr(matrix_model, 'solve_hierarchical', time_limited)
+    processed_data, useful_sets, attributes_with_time, parameters = network(compiler='matrix')
+    model, _, result = make_model.solve_compiled_model(processed_data, useful_sets, parameters, attributes_with_time)
+    assert str(result.solver.termination_condition) == 'maxTimeLimit'
+    #process_treatment_results exports the time limited runs that have a solution
+    assert len(model.solutions) == 1
+    model.solutions.select(0)
+    assert model.x_water[next(iter(model.x_water))].value is not None
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+test_model_report.py
+====================================
+The model report counts every component once, also when a cached model rebuilds its objective functions and stage
+variables on a new solve, so the spans count the rebuilt components and the totals keep the size of the model.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import pytest
+
+
+def model_size(model):
+    pe = pytest.importorskip('pyomo.environ')
+    from pyomo.core.expr.visitor import identify_variables
+    constraints = list(model.component_data_objects(pe.Constraint, active=True))
+    return {'variables': sum(1 for _ in model.component_data_objects(pe.Var)), 'constraints': len(constraints),
+            'nonzeros': sum(sum(1 for _ in identify_variables(c.body, include_fixed=False)) for c in constraints)}
+
+def test_rebuilt_components_are_counted(network):
+    make_model = pytest.importorskip('src.optimization.treatment.make_model', exc_type=ImportError)
+    model_cache = pytest.importorskip('src.optimization.treatment.model_cache', exc_type=ImportError)
+    pytest.importorskip('highspy')
+    processed_data, useful_sets, attributes_with_time, parameters = network()
+    model, _, _ = make_model.make_model(processed_data, useful_sets, parameters, attributes_with_time)
+    report, spans = model.report, len(model.report.spans)
+    assert report.totals == model_size(model)
+
+    #like update_time_parameters does when a cached model gets new costs
+    model_cache.clear_objective_expressions(model)
+    model, _, _ = make_model.solve_model(model, parameters)
+    #the variables with the value of the first 2 stages (and their definitions) are built again
+    stages = report.spans[spans:]
+    assert sum(span['variables'] for span in stages) == sum(span['constraints'] for span in stages) == 2
+    assert report.totals == model_size(model)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+test_presolve.py
+====================================
+The presolve removes the nodes and arcs that can not carry water, so they are missing from the outputs. It only
+runs when the parameters json file asks for it.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+DEAD_NODES = {'MIX_ORPHAN', 'MIX_DEADEND'}
+DEAD_ARCS = {('MIX_ORPHAN', 'END_1'), ('TREAT_1', 'MIX_DEADEND')}
+
+
+def add_dead_mixers(data):
+    """Adds a mixer without inlets and a mixer without outlets (and without capacity)."""
+    mixers = data['mixer_nodes_raw_data']
+    extra = mixers.iloc[[0, 0]].assign(ID=['MIX_ORPHAN', 'MIX_DEADEND'])
+    data['mixer_nodes_raw_data'] = pd.concat([mixers, extra], ignore_index=True)
+    arcs = data['arcs_raw_data']
+    extra = arcs.iloc[[0, 0]].assign(Node_Start=['MIX_ORPHAN', 'TREAT_1'], Node_End=['END_1', 'MIX_DEADEND'], Nominal_Value=np.nan)
+    data['arcs_raw_data'] = pd.concat([arcs, extra], ignore_index=True)
+
+@pytest.mark.parametrize('json_file', [{}, {'presolve': False}])
+def test_presolve_is_disabled_by_default(network, json_file):
+    processed_data, useful_sets, _, _ = network(edit=add_dead_mixers, **json_file)
+    assert DEAD_NODES <= useful_sets.nodes and DEAD_ARCS <= useful_sets.arcs
+    assert DEAD_ARCS <= set(processed_data.arcs_data.index)
+
+def test_presolve_removes_dead_nodes(network):
+    processed_data, useful_sets, _, _ = network(edit=add_dead_mixers, presolve=True)
+    assert not DEAD_NODES & useful_sets.nodes and not DEAD_ARCS & useful_sets.arcs
+    assert not DEAD_ARCS & set(processed_data.arcs_data.index)
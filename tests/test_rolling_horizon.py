@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+test_rolling_horizon.py
+====================================
+A rolling horizon with windows shorter than the horizon carries the whole state of the network between windows: the
+stitched outputs keep the water balance of the full solve, the oil held in the storage and initial nodes is the
+initial oil content of the next window, and the first period of a window is compared with the last committed one.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import pytest
+
+
+def solve(network, window, commit):
+    rolling_horizon = pytest.importorskip('src.optimization.treatment.rolling_horizon', exc_type=ImportError)
+    pytest.importorskip('highspy')
+    processed_data, useful_sets, attributes_with_time, parameters = network('upstream_supply_demand_cost_fully_stabilized',
+                                                                            rolling_horizon={'window': window, 'commit': commit})
+    windows = rolling_horizon.solve_rolling_horizon(processed_data, useful_sets, parameters, attributes_with_time)
+    assert windows[-1]['start'] + windows[-1]['committed'] == 7
+    return windows, rolling_horizon.stitch_outputs(windows, parameters, save=False)['nodes']
+
+def total_stored(df_nodes):
+    return df_nodes.groupby('Date')['Water_Stored'].sum()
+
+def test_windows_keep_the_water_balance(network):
+    _, full = solve(network, 6, 6)
+    windows, stitched = solve(network, 4, 2)
+    #the inputs of the initial nodes plus the initial contents of TANK_1 and POND_1 are in some node every period
+    inputs = stitched[stitched['Source'].isin(['START_A', 'START_B', 'START_DEAD'])].groupby('Date')['Water_In'].sum()
+    assert total_stored(stitched).tolist() == pytest.approx((inputs.cumsum() + 700).tolist())
+    assert total_stored(stitched).tolist() == pytest.approx(total_stored(full).tolist())
+
+    #the spill of the initial nodes can not be used in the next windows either
+    spill = stitched.pivot(index='Date', columns='Source', values='Water_Stored')[['START_A', 'START_B', 'START_DEAD']]
+    assert (spill.diff().dropna() >= -1e-6).all().all()
+
+def test_first_period_is_compared_with_the_previous_window(network):
+    pe = pytest.importorskip('pyomo.environ')
+    windows, _ = solve(network, 4, 2)
+    for previous, window in zip(windows, windows[1:]):
+        model = window['model']
+        flows = previous['state']['previous']['x_water']
+        assert flows and set(flows) == set(model.arcs_previous_flow)
+        for (i, j), flow in flows.items():
+            assert (i, j, 1) in model.c_3_1_water_stability
+            change = pe.value(model.slack_positive_watermix[i, j, 1] - model.slack_negative_watermix[i, j, 1])
+            assert pe.value(model.x_water[i, j, 1]) - flow == pytest.approx(change, abs=1e-6)
+
+def test_oil_content_is_carried(network):
+    make_model = pytest.importorskip('src.optimization.treatment.make_model', exc_type=ImportError)
+    rolling_horizon = pytest.importorskip('src.optimization.treatment.rolling_horizon', exc_type=ImportError)
+    from src.optimization.treatment.constraints import constraints
+    pe = make_model.pe
+
+    def tank_with_oil(data):
+        data['tanks_nodes_raw_data']['HasOil'] = 'Y'
+
+    processed_data, useful_sets, attributes_with_time, _ = network(oil=True, edit=tank_with_oil)
+    state = {'content': {'TANK_1': 150.0, 'POND_1': 400.0, 'START_A': 30.0}, 'oil_content': {'TANK_1': 12.0, 'START_A': 5.0},
+             'concentration': {}, 'previous': {'x_water': {}, 'x_active_arc_pond': {}}}
+    window_data, window_sets, window_attributes = rolling_horizon.get_window_data(processed_data, useful_sets, attributes_with_time,
+                                                                                  3, 4, state)
+    model = pe.ConcreteModel()
+    model = make_model.set_sets(model, window_sets)
+    model = make_model.set_parameters(model, window_data, window_sets, window_attributes)
+    model = make_model.set_variables(model)
+    model = make_model.set_expressions(model)
+    model = constraints.add_oil_flow_balance(model)
+    model = constraints.add_initial_nodes_flow_balance(model)
+    model = constraints.add_initial_ending_nodes_spill(model)
+
+    #nothing flows: the tank keeps its oil and START_A spills the oil of the window on top of the previous spill
+    for variable in (model.x_water, model.x_oil):
+        for index in variable:
+            variable[index].value = 0
+    for variable in (model.y_water, model.y_oil):
+        for index in variable:
+            variable[index].value = 0
+    for t in model.time_dim:
+        model.y_oil['TANK_1', t].value = 12.0
+        model.y_oil['START_A', t].value = 5.0 + sum(pe.value(model.oil_in['START_A', s]) for s in model.time_dim if s <= t)
+        for i in model.initial:
+            model.y_water[i, t].value = state['content'].get(i, 0) + sum(pe.value(model.water_in[i, s]) for s in model.time_dim if s <= t)
+
+    families = [model.c_1_3_oil_flow_balance, model.c_4_3_initial_nodes_water, model.c_4_5_initial_nodes_oil,
+                model.c_11_1_1_initial_ending_spill_water, model.c_11_1_3_initial_ending_spill_oil]
+    for family in families:
+        for constraint in family.values():
+            body = pe.value(constraint.body)
+            assert constraint.lower is None or body >= pe.value(constraint.lower) - 1e-6, constraint.name
+            assert constraint.upper is None or body <= pe.value(constraint.upper) + 1e-6, constraint.name
+    #the spill carried to the window can not be used: sending all the oil of the period and 1 more barrel leaves 4
+    model.y_oil['START_A', 1].value = 4.0
+    assert pe.value(model.c_11_1_3_initial_ending_spill_oil[1, 'START_A'].body) < pe.value(model.c_11_1_3_initial_ending_spill_oil[1, 'START_A'].lower)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+test_s3_transfer.py
+====================================
+Concurrent transfers against a moto mocked bucket: multipart uploads, concurrent downloads and the retries of the
+failed uploads.
+
+@author:
+     - g.munera.gonzalez
+     - yeison.diaz
+"""
+
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import ClientError
+from src.commons import s3_transfer
+from src.commons.s3_transfer import MB, S3Transfer
+
+BUCKET = 'tests-bucket'
+
+
+@pytest.fixture
+def transfer(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.delenv('S3_ENDPOINT_URL', raising=False)
+    with moto.mock_aws():
+        transfer = S3Transfer(BUCKET, workers=4, multipart_threshold=5 * MB) #5 MB is the minimum part size of s3
+        transfer.client.create_bucket(Bucket=BUCKET)
+        yield transfer
+
+def client_error(status, code):
+    return ClientError({'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, 'PutObject')
+
+def upload_failed(error):
+    """Returns the error that boto3 raises when an upload fails with the client error."""
+    try:
+        try:
+            raise error
+        except ClientError as e:
+            raise S3UploadFailedError(f"Failed to upload: {e}")
+    except S3UploadFailedError as e:
+        return e
+
+def test_multipart_upload(transfer, tmp_path):
+    large, small = tmp_path / 'athena.csv', tmp_path / 'params.json'
+    large.write_bytes(bytes(range(256)) * (12 * MB // 256))
+    small.write_bytes(b'{}')
+    files = S3Transfer.folder_files(str(tmp_path), 'outputs/run/')
+    assert transfer.upload_files(files) == ['outputs/run/athena.csv', 'outputs/run/params.json']
+
+    #the etag of the objects uploaded in parts ends with the number of parts
+    assert transfer.client.head_object(Bucket=BUCKET, Key='outputs/run/athena.csv')['ETag'].strip('"').endswith('-3')
+    assert '-' not in transfer.client.head_object(Bucket=BUCKET, Key='outputs/run/params.json')['ETag']
+    assert transfer.get_object('outputs/run/athena.csv') == large.read_bytes()
+
+def test_folder_files_layout(tmp_path):
+    #one key by file directly under the prefix (with or without the trailing slash), like S3Manager.save_s3results
+    (tmp_path / 'nodes.csv').write_bytes(b'')
+    (tmp_path / 'params.json').write_bytes(b'')
+    (tmp_path / 'logs').mkdir()
+    (tmp_path / 'logs' / 'solver.log').write_bytes(b'')
+    for prefix in ['outputs/run', 'outputs/run/']:
+        assert S3Transfer.folder_files(str(tmp_path), prefix) == [(str(tmp_path / 'nodes.csv'), 'outputs/run/nodes.csv'),
+                                                                  (str(tmp_path / 'params.json'), 'outputs/run/params.json')]
+
+def test_concurrent_get(transfer):
+    keys = [f'inputs/{k}.csv' for k in range(20)]
+    for k, key in enumerate(keys):
+        transfer.client.put_object(Bucket=BUCKET, Key=key, Body=f'content {k}'.encode())
+    assert transfer.get_objects(keys) == {key: f'content {k}'.encode() for k, key in enumerate(keys)}
+    with pytest.raises(ClientError):
+        transfer.get_objects(keys + ['inputs/missing.csv'])
+
+def test_connection_pool_fits_nested_transfers(transfer):
+    #4 concurrent uploads of 4 parts each
+    assert transfer.client.meta.config.max_pool_connections >= 16
+
+def test_failed_uploads_are_retried(transfer, tmp_path, monkeypatch):
+    assert s3_transfer.is_retryable(upload_failed(client_error(503, 'SlowDown')))
+    assert not s3_transfer.is_retryable(upload_failed(client_error(403, 'AccessDenied')))
+    path = tmp_path / 'nodes.csv'
+    path.write_bytes(b'ID\nTANK_1\n')
+    with pytest.raises(S3UploadFailedError) as error:
+        S3Transfer('missing-bucket', transfer.client).upload_file(str(path), 'outputs/nodes.csv')
+    assert not s3_transfer.is_retryable(error.value)
+
+    monkeypatch.setattr(s3_transfer.time, 'sleep', lambda seconds: None)
+    upload_file, calls = transfer.client.upload_file, []
+    def flaky_upload_file(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise upload_failed(client_error(500, 'InternalError'))
+        return upload_file(*args, **kwargs)
+    monkeypatch.setattr(transfer.client, 'upload_file', flaky_upload_file)
+
+    assert transfer.upload_file(str(path), 'outputs/nodes.csv') == 'outputs/nodes.csv'
+    assert len(calls) == 2 and transfer.get_object('outputs/nodes.csv') == b'ID\nTANK_1\n'
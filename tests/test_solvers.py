@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+test_solvers.py
+====================================
+A run whose solver finds no solution must end with a not optimal result (so the outputs report the error)
+instead of an exception, with every backend interface.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import pytest
+
+
+def tank_over_capacity(data):
+    #TANK_1 can not reach its minimum content with the water its inlet can carry
+    data['tanks_nodes_raw_data']['MinCapacity'] = 700.0
+
+@pytest.mark.parametrize('persistent_solver', [None, 'appsi_highs'])
+def test_infeasible_model_returns_results(network, persistent_solver):
+    make_model = pytest.importorskip('src.optimization.treatment.make_model', exc_type=ImportError)
+    pytest.importorskip('highspy')
+    json_file = {'persistent_solver': persistent_solver} if persistent_solver else {}
+    processed_data, useful_sets, attributes_with_time, parameters = network(edit=tank_over_capacity, **json_file)
+    model, _, result = make_model.make_model(processed_data, useful_sets, parameters, attributes_with_time)
+    assert result.solver.termination_condition == make_model.pe.TerminationCondition.infeasible
+    assert len(model.solutions) == 0 and all(stage['objective_value'] is None for stage in model.stages)
+
+@pytest.mark.parametrize('persistent_solver', [None, 'appsi_highs'])
+def test_feasible_model_loads_solution(network, persistent_solver):
+    make_model = pytest.importorskip('src.optimization.treatment.make_model', exc_type=ImportError)
+    pytest.importorskip('highspy')
+    json_file = {'persistent_solver': persistent_solver} if persistent_solver else {}
+    processed_data, useful_sets, attributes_with_time, parameters = network(**json_file)
+    model, _, result = make_model.make_model(processed_data, useful_sets, parameters, attributes_with_time)
+    assert result.solver.termination_condition == make_model.pe.TerminationCondition.optimal
+    assert len(model.solutions) > 0
+    assert [stage['objective_value'] for stage in model.stages] == pytest.approx([6520.0, 1520.0, 8087.5625], rel=1e-4)
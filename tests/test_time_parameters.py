@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+test_time_parameters.py
+====================================
+The time dependent parameters of the arcs (usable percentage and other cost) only store the periods where they
+change, also after the model is built and solved, and a model updated with new periods gives the same solution
+as a model built with them. The updates only free the flows they fixed because the arc was closed.
+
+@author:
+     - c.maldonado
+     - g.munera.gonzalez
+"""
+
+import pandas as pd
+import pytest
+
+
+def stage_values(model):
+    return [stage['objective_value'] for stage in model.stages]
+
+def limit_tank_outlet(data):
+    """Halves the capacity of TANK_1 -> MIX_1 (Sparse_Arcs already closes it in period 3) and adds a cost to
+    START_A -> PUMP_P1 in every period."""
+    periods = [1, 2, 4, 5, 6]
+    data['sparse_arcs'] = pd.concat([data['sparse_arcs'], pd.DataFrame({
+        'Node_Start': ['TANK_1'] * 5 + ['START_A'] * 6, 'Node_End': ['MIX_1'] * 5 + ['PUMP_P1'] * 6,
+        'time': periods + list(range(1, 7)), 'Attribute': ['UsablePercentage'] * 5 + ['OtherCosts'] * 6,
+        'Value': [0.5] * 5 + [50.0] * 6})])
+
+def test_parameters_store_only_the_overrides(network):
+    make_model = pytest.importorskip('src.optimization.treatment.make_model', exc_type=ImportError)
+    pytest.importorskip('highspy')
+    processed_data, useful_sets, attributes_with_time, parameters = network()
+    model, _, _ = make_model.make_model(processed_data, useful_sets, parameters, attributes_with_time)
+    #Sparse_Arcs changes one usable percentage and one cost, Sparse_Node the costs of the 4 inlets of MIX_1 and END_2
+    assert len(model.usable_percentage._data) == len(model.usable_percentage_periods) == 1
+    assert len(model.other_cost._data) == len(model.other_cost_periods) == 5
+    assert make_model.pe.value(make_model.constraints.get_usable_percentage(model, 'TANK_1', 'MIX_1', 3)) == 0
+    assert make_model.pe.value(make_model.constraints.get_usable_percentage(model, 'TANK_1', 'MIX_1', 2)) == 0.8
+
+def test_new_overrides_update_the_model(network):
+    make_model = pytest.importorskip('src.optimization.treatment.make_model', exc_type=ImportError)
+    model_cache = pytest.importorskip('src.optimization.treatment.model_cache', exc_type=ImportError)
+    pytest.importorskip('highspy')
+    processed_data, useful_sets, attributes_with_time, parameters = network()
+    model, _, _ = make_model.make_model(processed_data, useful_sets, parameters, attributes_with_time)
+    before = stage_values(model)
+
+    processed_data, useful_sets, attributes_with_time, parameters = network(edit=limit_tank_outlet)
+    built, _, _ = make_model.make_model(processed_data, useful_sets, parameters, attributes_with_time)
+    #the solved model gets the new periods like a cached model does
+    model = model_cache.update_parameters(model, processed_data, attributes_with_time)
+    model, _, _ = make_model.solve_model(model, parameters)
+    assert len(model.usable_percentage._data) == 6 and len(model.other_cost._data) == 11
+    assert [model.x_water['TANK_1', 'MIX_1', t].ub for t in model.time_dim] == [built.x_water['TANK_1', 'MIX_1', t].ub for t in built.time_dim]
+    assert stage_values(built) != pytest.approx(before, rel=1e-6)
+    assert stage_values(model) == pytest.approx(stage_values(built), rel=1e-6)
+
+def test_updates_only_free_the_closed_arcs(network):
+    make_model = pytest.importorskip('src.optimization.treatment.make_model', exc_type=ImportError)
+    model_cache = pytest.importorskip('src.optimization.treatment.model_cache', exc_type=ImportError)
+    pytest.importorskip('highspy')
+    processed_data, useful_sets, attributes_with_time, parameters = network()
+    model, _, _ = make_model.make_model(processed_data, useful_sets, parameters, attributes_with_time)
+    #Sparse_Arcs closes TANK_1 -> MIX_1 in period 3, the flow of START_B -> PUMP_P2 is fixed by the user
+    assert model.x_water['TANK_1', 'MIX_1', 3].fixed and ('TANK_1', 'MIX_1', 3) in model.closed_arcs
+    model.x_water['START_B', 'PUMP_P2', 2].fix(100)
+
+    def open_tank_outlet(data):
+        data['sparse_arcs'].loc[data['sparse_arcs']['Node_Start'] == 'TANK_1', 'Value'] = 0.5
+
+    processed_data, useful_sets, attributes_with_time, parameters = network(edit=open_tank_outlet)
+    model = model_cache.update_parameters(model, processed_data, attributes_with_time)
+    assert not model.x_water['TANK_1', 'MIX_1', 3].fixed and ('TANK_1', 'MIX_1', 3) not in model.closed_arcs
+    assert model.x_water['START_B', 'PUMP_P2', 2].fixed and model.x_water['START_B', 'PUMP_P2', 2].value == 100